@@ -0,0 +1,209 @@
+"""Bulk throughput, of the route pacing and of a real bulk job
+
+First against a local fake HTTP endpoint enforcing a route limit: compares
+firing the requests with plain concurrency, retrying on 429, and pacing them
+with the RouteScheduler used by the bulk jobs.
+
+Then a bulk job run by the bot's JobQueue with DEFAULT_LIMITS against
+FakeDiscord (see fake_discord.py): it creates clans, assigns clanless members
+to them and removes members from existing clans. Reports the job throughput,
+the REST calls per route with the time their limit needs for them, and checks
+the roles of every member it touched.
+
+Run with `python benchmarks/bench_bulk_jobs.py [--requests 500] [--clans 2] [--members 40] [--removals 20]
+[--latency 0.05] [--rate-limit-share 0.0] [--lean]`
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from rate_limit import RouteScheduler  # noqa: E402
+
+LIMIT = 50
+WINDOW = 0.5
+LATENCY = 0.02
+CONCURRENCY = 16
+
+
+class FakeEndpoint:
+    """HTTP server allowing LIMIT requests per route every WINDOW seconds"""
+
+    def __init__(self):
+        self.windows = {}
+        self.served = 0
+        self.rate_limited = 0
+
+    async def handle(self, reader, writer):
+        request_line = (await reader.readline()).decode()
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        route = request_line.split(" ")[1]
+        await asyncio.sleep(LATENCY)
+        now = time.monotonic()
+        start, count = self.windows.get(route, (now, 0))
+        if now - start >= WINDOW:
+            start, count = now, 0
+        if count >= LIMIT:
+            self.rate_limited += 1
+            retry_after = WINDOW - (now - start)
+            writer.write("HTTP/1.1 429 Too Many Requests\r\nRetry-After: {0:.3f}\r\nContent-Length: 0\r\n\r\n"
+                         .format(retry_after).encode())
+        else:
+            self.windows[route] = (start, count + 1)
+            self.served += 1
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+
+async def request(port, route):
+    """Returns the Retry-After of a 429, None on success"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write("PATCH {0} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(route).encode())
+    await writer.drain()
+    status = (await reader.readline()).decode().split(" ")[1]
+    retry_after = None
+    while True:
+        line = (await reader.readline()).decode()
+        if line in ("\r\n", ""):
+            break
+        if line.lower().startswith("retry-after:"):
+            retry_after = float(line.split(":")[1])
+    writer.close()
+    return retry_after if status == "429" else None
+
+
+async def run(port, total, scheduler):
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            while True:
+                if scheduler is not None:
+                    await scheduler.acquire("member_edit", 1)
+                retry_after = await request(port, "/guilds/1/members")
+                if retry_after is None:
+                    break
+                await asyncio.sleep(retry_after)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return time.perf_counter() - start
+
+
+async def compare_pacing(total):
+    print("{0:<10} {1:>10} {2:>8} {3:>6}".format("mode", "ops/s", "time (s)", "429s"))
+    # Any window sees at most burst + rate * WINDOW requests, kept at LIMIT
+    for name, scheduler in (("naive", None),
+                            ("scheduled", RouteScheduler({"member_edit": (LIMIT / WINDOW * 0.9, LIMIT * 0.1)}))):
+        endpoint = FakeEndpoint()
+        server = await asyncio.start_server(endpoint.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        elapsed = await run(port, total, scheduler)
+        server.close()
+        await server.wait_closed()
+        print("{0:<10} {1:>10.1f} {2:>8.2f} {3:>6}".format(name, total / elapsed, elapsed, endpoint.rate_limited))
+
+
+# Limits of bulk_jobs.DEFAULT_LIMITS and the routes they pace
+ROUTES = {"role_create": "POST /guilds/{id}/roles", "member_fetch": "GET /guilds/{id}/members/{id}",
+          "member_edit": "PATCH /guilds/{id}/members/{id}"}
+
+
+async def run_job(args):
+    from fake_discord import FakeDiscord
+
+    fake = FakeDiscord(latency=args.latency, rate_limit_share=args.rate_limit_share)
+    guild = fake.generate_guild(members=args.guild_members, clans=args.guild_clans)
+    await fake.start()
+
+    import bot
+    import bulk_jobs
+    client = bot.client
+    await fake.connect(client)
+    await client.reconcile(client.get_guild(guild.id))
+
+    names = ["Bulk{0:03d}".format(i) for i in range(args.clans)]
+    steps = [["create", name] for name in names]
+    # The first member of each new clan is its chief
+    assigned = list(zip(guild.clanless[:args.members], (names[i % len(names)] for i in range(args.members))))
+    steps.extend(["assign", name, user_id, "chief" if i < len(names) else "member"]
+                 for i, (user_id, name) in enumerate(assigned))
+    removed = [(name, members[0]) for name, (_, members) in guild.clans.items() if members][:args.removals]
+    steps.extend(["remove", name, user_id] for name, user_id in removed)
+    job = bulk_jobs.BulkJob.new(guild.id, "bench", "import", steps)
+
+    fake.reset_stats()
+    start = time.perf_counter()
+    await client.jobs.submit(job)
+    while not job.finished:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    roles = {role["name"]: role_id for role_id, role in guild.roles.items()}
+    misplaced = sum(1 for i, (user_id, name) in enumerate(assigned)
+                    if roles.get(("Chef " if i < len(names) else "Membre ") + name) not in guild.members[user_id])
+    misplaced += sum(1 for name, user_id in removed if roles["Membre " + name] in guild.members[user_id])
+
+    print("Bulk job of {0} steps ({1} clans created, {2} members assigned, {3} removed), {4} intents".format(
+        len(steps), len(names), len(assigned), len(removed), "lean" if bot.LEAN_INTENTS else "full"))
+    print("Fake API : {0:.0f}ms latency, {1:.1%} of 429".format(args.latency * 1000, args.rate_limit_share))
+    print("{0} in {1:.1f}s : {2:.2f} steps/s, {3:.1f}s waited for the limits".format(
+        job.status, elapsed, len(steps) / elapsed, client.jobs.scheduler.waited))
+    print("{0} errors, {1} members without the expected roles".format(len(job.errors), misplaced))
+    for error in job.errors[-5:]:
+        print("  " + bot.job_error(bot.catalog.get("en"), error))
+    print("REST : {0} requests, {1} answered with 429".format(sum(fake.requests.values()),
+                                                              sum(fake.rate_limited.values())))
+    # Time each route limit needs on its own for the calls of the job, the bucket starting full
+    print("  {0:<40} {1:>6} {2:>12}".format("route", "calls", "limit needs"))
+    for limit, route in ROUTES.items():
+        rate, burst = bulk_jobs.DEFAULT_LIMITS[limit]
+        print("  {0:<40} {1:>6} {2:>11.1f}s".format(route, fake.requests[route],
+                                                  max(fake.requests[route] - burst, 0) / rate))
+
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await client.close()
+    await fake.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk throughput of the route pacing and of a bulk job")
+    parser.add_argument("--requests", type=int, default=500, help="requests of the pacing comparison")
+    parser.add_argument("--clans", type=int, default=2, help="clans created by the job")
+    parser.add_argument("--members", type=int, default=40, help="clanless members assigned by the job")
+    parser.add_argument("--removals", type=int, default=20, help="members removed from their clan by the job")
+    parser.add_argument("--guild-members", type=int, default=5_000, help="members of the simulated guild")
+    parser.add_argument("--guild-clans", type=int, default=250, help="clans of the simulated guild")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per REST request")
+    parser.add_argument("--rate-limit-share", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--lean", action="store_true", help="run with LEAN_INTENTS")
+    args = parser.parse_args()
+
+    asyncio.run(compare_pacing(args.requests))
+    print()
+
+    # The environment wins over the .env the bot loads
+    os.environ["LEAN_INTENTS"] = "1" if args.lean else ""
+    os.environ["METRICS_PORT"] = ""
+    os.environ["GUILD_ID"] = ""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # The clan store and the bulk jobs of the bot are written to the working directory
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        asyncio.run(run_job(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Clan lookup cost: ClanRegistry against a linear scan of the guild roles,
+and cost of the prefix search serving autocomplete and the clan pickers
+
+Run with `python benchmarks/bench_clan_registry.py`
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from clan_registry import ClanRegistry  # noqa: E402
+
+
+class FakeRole:
+    __slots__ = ("id", "name")
+
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+
+
+def make_roles(count):
+    roles = []
+    for i in range(count):
+        if i % 4 == 0:
+            roles.append(FakeRole(i, "Membre clan" + str(i)))
+        elif i % 4 == 1:
+            roles.append(FakeRole(i, "Chef clan" + str(i - 1)))
+        else:
+            roles.append(FakeRole(i, "Role " + str(i)))
+    return roles
+
+
+def linear_get(roles, name):
+    # Same loop as discord.utils.get(roles, name=name)
+    for role in roles:
+        if role.name == name:
+            return role
+    return None
+
+
+def main():
+    print("{0:>8} {1:>16} {2:>16} {3:>10}".format("roles", "scan (us/op)", "registry (us/op)", "speedup"))
+    for count in (1000, 10000):
+        roles = make_roles(count)
+        registry = ClanRegistry()
+        registry.build(roles)
+        # Worst case for the scan: the last clan of the list
+        name = "clan" + str((count - 1) // 4 * 4)
+        number = 2000
+        scan = timeit.timeit(lambda: linear_get(roles, "Membre " + name), number=number) / number
+        indexed = timeit.timeit(lambda: registry.member_role(name), number=number) / number
+        print("{0:>8} {1:>16.2f} {2:>16.3f} {3:>9.0f}x".format(count, scan * 1e6, indexed * 1e6, scan / indexed))
+
+    print()
+    print("{0:>8} {1:>20} {2:>20}".format("clans", "search 'clan1' (us)", "page 100 of '' (us)"))
+    for count in (10000, 50000):
+        registry = ClanRegistry()
+        registry.build(make_roles(count * 4))
+        number = 2000
+        prefix = timeit.timeit(lambda: registry.search("clan1"), number=number) / number
+        page = timeit.timeit(lambda: registry.search("", 100 * 25, 26), number=number) / number
+        print("{0:>8} {1:>20.2f} {2:>20.2f}".format(count, prefix * 1e6, page * 1e6))
+
+
+if __name__ == "__main__":
+    main()
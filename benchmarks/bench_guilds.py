@@ -0,0 +1,55 @@
+"""Memory and latency of one bot process against the number of guilds it serves
+
+Runs bench_interactions.py once per guild count, each in its own process so
+that the memory figures do not add up, with the same guild size and the same
+total number of flows spread over the guilds.
+
+Run with `python benchmarks/bench_guilds.py [--counts 1,4,16,64] [--members 5000] [--clans 250] [--flows 50]
+[--lean] [--tracemalloc]`
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BENCH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_interactions.py")
+
+
+def run(count: int, args) -> dict:
+    command = [sys.executable, BENCH, "--guilds", str(count), "--members", str(args.members),
+               "--clans", str(args.clans), "--flows", str(args.flows), "--latency", str(args.latency),
+               "--concurrency", str(args.concurrency), "--json"]
+    if args.lean:
+        command.append("--lean")
+    if args.tracemalloc:
+        command.append("--tracemalloc")
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot memory and latency against the guild count")
+    parser.add_argument("--counts", default="1,4,16,64", help="comma separated guild counts")
+    parser.add_argument("--members", type=int, default=5_000, help="members of each guild")
+    parser.add_argument("--clans", type=int, default=250, help="clans of each guild")
+    parser.add_argument("--flows", type=int, default=50, help="flows of each kind, over all the guilds")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per REST request")
+    parser.add_argument("--lean", action="store_true", help="run with LEAN_INTENTS")
+    parser.add_argument("--tracemalloc", action="store_true", help="measure the Python memory of the bot")
+    args = parser.parse_args()
+
+    print("{0:>7} {1:>9} {2:>9} {3:>12} {4:>9} {5:>10} {6:>8} {7:>8} {8:>8} {9:>7}".format(
+        "guilds", "members", "load s", "reconcile s", "RSS MB", "bot MB", "inter/s", "p50 ms", "p99 ms", "failed"))
+    for count in [int(count) for count in args.counts.split(",")]:
+        result = run(count, args)
+        bot_memory = "{0:.0f}".format(result["bot_memory_mb"]) if result["bot_memory_mb"] is not None else "-"
+        print("{0:>7} {1:>9} {2:>9.2f} {3:>12.2f} {4:>9.0f} {5:>10} {6:>8.1f} {7:>8.1f} {8:>8.1f} {9:>7}".format(
+            result["guilds"], result["members"], result["loaded"], result["reconciled"], result["max_rss_mb"],
+            bot_memory, result["per_second"], result["p50"] * 1000, result["p99"] * 1000,
+            result["failed"] + result["unanswered"]), flush=True)
+
+
+if __name__ == "__main__":
+    main()
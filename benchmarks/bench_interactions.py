@@ -0,0 +1,359 @@
+"""Interaction throughput of the bot against a simulated guild and a fake Discord API
+
+Drives the real commands, context menus, views and selects of src/bot.py
+through FakeDiscord (see fake_discord.py): every flow starts from a gateway
+interaction payload and goes through the bot's REST calls, with the configured
+latency and 429 injection. Reports interactions per second, p50/p99 latency per
+handler, REST calls per interaction and memory.
+
+Flows, run concurrently in a random order:
+ - create   /newclan
+ - delete   /deleteclan, then "Oui"
+ - leave    /leaveclan by a member, then "Oui"
+ - invite   "Inviter ce membre à un clan" by a chief, the clan select, then "Accepter" in the DM
+ - promote  "Ajouter comme chef à un clan" by an admin, search, then the clan select
+ - roster   /clans, "Suivant", then /claninfo by a member
+
+--race N then fires conflicting interactions at the first guild: N clan names
+each created by --contenders admins at once, and N clans deleted while one of
+their members is promoted chief. It checks that no clan role was created
+twice and that no promotion failed on a deleted role.
+
+With --guilds N the bot serves N such guilds, every other one with its own
+role prefixes in guilds.json, and the flows are spread over them. --json
+prints a one line summary at the end, read by bench_guilds.py.
+
+Run with `python benchmarks/bench_interactions.py [--members 100000] [--clans 5000] [--flows 200]
+[--concurrency 20] [--latency 0.05] [--rate-limit-share 0.01] [--guilds 1] [--race 0] [--contenders 4] [--lean]
+[--tracemalloc] [--json]`
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+from fake_discord import FakeDiscord, find_component
+from interactions import percentile
+
+RED = 0xff0000
+INVITE_MENU = "Inviter ce membre à un clan"
+CHIEF_MENU = "Ajouter comme chef à un clan"
+# Prefixes of the odd guilds, written to guilds.json
+OTHER_PREFIXES = {"member_prefix": "Member ", "chief_prefix": "Leader "}
+
+
+class Recorder:
+    """Latency of each interaction, by handler"""
+
+    def __init__(self, fake: FakeDiscord):
+        self.fake = fake
+        self.latencies = defaultdict(list)
+        self.failed = Counter()
+        self.unanswered = Counter()
+
+    async def step(self, name: str, payload: dict):
+        elapsed, answer = await self.fake.interact(payload)
+        if answer is None:
+            self.unanswered[name] += 1
+            return None
+        self.latencies[name].append(elapsed)
+        # Every refusal and error of the bot is a red embed or an error message
+        if "Une erreur" in (answer.get("content") or "") or \
+                any(embed.get("color") == RED for embed in answer.get("embeds") or []):
+            self.failed[name] += 1
+        return answer
+
+    @property
+    def interactions(self) -> int:
+        return sum(len(values) for values in self.latencies.values()) + sum(self.unanswered.values())
+
+
+def plan_flows(guild, flows: int, rng: random.Random):
+    """(name, coroutine function, guild, arguments) of each flow, on distinct clans and members"""
+    clans = [(name, chief, members) for name, (chief, members) in guild.clans.items()]
+    rng.shuffle(clans)
+    with_members = [clan for clan in clans if len(clan[2]) > 0]
+    without = [clan for clan in clans if len(clan[2]) == 0]
+    # Deleted clans take no part in the other flows
+    deleted = (without + with_members[::-1])[:flows]
+    deleted_names = {name for name, _, _ in deleted}
+    with_members = [clan for clan in with_members if clan[0] not in deleted_names]
+    plan = [("create", create_flow, guild, ("Bench{0:05d}".format(i),)) for i in range(flows)]
+    plan.extend(("delete", delete_flow, guild, (name,)) for name, _, _ in deleted)
+    plan.extend(("leave", leave_flow, guild, (name, members[0])) for name, _, members in with_members[:flows])
+    plan.extend(("invite", invite_flow, guild, (name, chief, invitee)) for (name, chief, _), invitee in
+                zip([clan for clan in clans if clan[0] not in deleted_names][:flows], guild.clanless))
+    plan.extend(("promote", promote_flow, guild, (name, members[-1]))
+                for name, _, members in with_members[flows:2 * flows])
+    plan.extend(("roster", roster_flow, guild, (name, members[0])) for name, _, members in with_members[-flows:])
+    rng.shuffle(plan)
+    return plan
+
+
+async def create_flow(recorder: Recorder, fake: FakeDiscord, guild, name: str):
+    await recorder.step("newclan", fake.command(guild, guild.admins[0], "newclan", nom=name))
+
+
+async def delete_flow(recorder: Recorder, fake: FakeDiscord, guild, name: str):
+    admin = guild.admins[1 % len(guild.admins)]
+    message = await recorder.step("deleteclan", fake.command(guild, admin, "deleteclan", nom=name))
+    button = message and find_component(message, lambda component: component.get("label") == "Oui")
+    if button:
+        await recorder.step("DeleteClanUI.accept", fake.component(guild, admin, message, button["custom_id"]))
+
+
+async def leave_flow(recorder: Recorder, fake: FakeDiscord, guild, name: str, member: int):
+    message = await recorder.step("leaveclan", fake.command(guild, member, "leaveclan", nom=name))
+    button = message and find_component(message, lambda component: component.get("label") == "Oui")
+    if button:
+        await recorder.step("LeaveClanUI.accept", fake.component(guild, member, message, button["custom_id"]))
+
+
+async def invite_flow(recorder: Recorder, fake: FakeDiscord, guild, name: str, chief: int, invitee: int):
+    message = await recorder.step("add_member_menu", fake.user_command(guild, chief, INVITE_MENU, invitee))
+    select = message and find_component(message, lambda component: component.get("type") == 3)
+    if not select:
+        return
+    await recorder.step("ClanListInvite.callback",
+                        fake.component(guild, chief, message, select["custom_id"], 3, [name]))
+    invitation = fake.direct_messages.get(invitee)
+    button = invitation and find_component(invitation,
+                                           lambda component: component.get("custom_id", "").startswith("invite:accept"))
+    if button:
+        await recorder.step("InviteButton.callback", fake.component(None, invitee, invitation, button["custom_id"]))
+
+
+async def promote_flow(recorder: Recorder, fake: FakeDiscord, guild, name: str, member: int):
+    admin = guild.admins[2 % len(guild.admins)]
+    message = await recorder.step("add_chief_menu", fake.user_command(guild, admin, CHIEF_MENU, member))
+    search = message and find_component(message, lambda component: component.get("label") == "Rechercher")
+    if not search:
+        return
+    modal = await recorder.step("ClanPickerUI.open_search", fake.component(guild, admin, message, search["custom_id"]))
+    text_input = modal and find_component(modal, lambda component: component.get("type") == 4)
+    if not text_input:
+        return
+    message = await recorder.step("ClanSearchModal.on_submit",
+                                  fake.modal_submit(guild, admin, message, modal, {text_input["custom_id"]: name}))
+    select = message and find_component(message, lambda component: component.get("type") == 3)
+    if select:
+        await recorder.step("ClanListChief.callback",
+                            fake.component(guild, admin, message, select["custom_id"], 3, [name]))
+
+
+async def roster_flow(recorder: Recorder, fake: FakeDiscord, guild, name: str, member: int):
+    message = await recorder.step("clans", fake.command(guild, member, "clans"))
+    button = message and find_component(message, lambda component: component.get("label") == "Suivant")
+    if button and not button.get("disabled"):
+        await recorder.step("ClanListUI.next_page", fake.component(guild, member, message, button["custom_id"]))
+    await recorder.step("clan_info", fake.command(guild, member, "claninfo", nom=name))
+
+
+async def race(fake: FakeDiscord, guild, rounds: int, contenders: int):
+    """Conflicting interactions fired at once, see the module documentation"""
+    recorder = Recorder(fake)
+    start = time.perf_counter()
+    names = ["Race{0:05d}".format(i) for i in range(rounds)]
+    await asyncio.gather(*(recorder.step("race newclan", fake.command(guild, guild.admins[i % len(guild.admins)],
+                                                                        "newclan", nom=name))
+                           for name in names for i in range(contenders)))
+    role_names = Counter(role["name"] for role in guild.roles.values())
+    duplicates = sum(role_names[prefix + name] - 1 for name in names for prefix in ("Membre ", "Chef ")
+                     if role_names[prefix + name] > 1)
+    created = sum(1 for name in names if role_names["Membre " + name] > 0)
+
+    # Both interactions are opened first, then their last clicks are sent together
+    admin, promoter = guild.admins[3 % len(guild.admins)], guild.admins[4 % len(guild.admins)]
+    targets = []
+    for name, (_, members) in guild.clans.items():
+        if len(targets) == rounds:
+            break
+        member_role = next((role_id for role_id, role in guild.roles.items() if role["name"] == "Membre " + name), None)
+        if member_role is not None and members and member_role in guild.members[members[0]]:
+            targets.append((name, members[0]))
+
+    async def conflict(name: str, member: int):
+        confirm = await recorder.step("race deleteclan", fake.command(guild, admin, "deleteclan", nom=name))
+        menu = await recorder.step("race add_chief_menu", fake.user_command(guild, promoter, CHIEF_MENU, member))
+        search = menu and find_component(menu, lambda component: component.get("label") == "Rechercher")
+        modal = search and await recorder.step("race open_search",
+                                               fake.component(guild, promoter, menu, search["custom_id"]))
+        text_input = modal and find_component(modal, lambda component: component.get("type") == 4)
+        picker = text_input and await recorder.step("race on_submit", fake.modal_submit(
+            guild, promoter, menu, modal, {text_input["custom_id"]: name}))
+        select = picker and find_component(picker, lambda component: component.get("type") == 3)
+        button = confirm and find_component(confirm, lambda component: component.get("label") == "Oui")
+        if not (select and button):
+            return "not started"
+        _, promotion = await asyncio.gather(
+            recorder.step("race DeleteClanUI.accept", fake.component(guild, admin, confirm, button["custom_id"])),
+            recorder.step("race ClanListChief.callback",
+                          fake.component(guild, promoter, picker, select["custom_id"], 3, [name])))
+        description = " ".join(embed.get("description", "") for embed in (promotion or {}).get("embeds") or [])
+        if "a été promu" in description:
+            return "promoted before the deletion"
+        if "n'existe pas" in description:
+            return "refused after the deletion"
+        return "failed"
+
+    outcomes = Counter(await asyncio.gather(*(conflict(name, member) for name, member in targets)))
+    elapsed = time.perf_counter() - start
+    print("Race : {0} clan names created by {1} admins at once, {2} created, {3} duplicated roles".format(
+        len(names), contenders, created, duplicates))
+    print("Race : {0} clans deleted during a promotion : {1}".format(
+        len(targets), ", ".join("{0} {1}".format(count, outcome) for outcome, count in outcomes.most_common())))
+    print("Race : {0} interactions in {1:.2f}s : {2:.1f} interactions/s, {3} unanswered".format(
+        recorder.interactions, elapsed, recorder.interactions / elapsed, sum(recorder.unanswered.values())))
+    return duplicates, outcomes["failed"]
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    fake = FakeDiscord(latency=args.latency, rate_limit_share=args.rate_limit_share, seed=args.seed)
+    guilds = []
+    configs = {}
+    for i in range(args.guilds):
+        prefixes = OTHER_PREFIXES if i % 2 == 1 else {}
+        guild = fake.generate_guild(members=args.members, clans=args.clans, name="Serveur {0}".format(i), **prefixes)
+        guilds.append(guild)
+        if prefixes:
+            configs[str(guild.id)] = prefixes
+    fake_memory = tracemalloc.get_traced_memory()[0] if args.tracemalloc else 0
+    await fake.start()
+
+    import bot
+    client = bot.client
+    with open("guilds.json", "w", encoding="utf-8") as file:
+        json.dump(configs, file)
+    client.configs = bot.GuildConfigs.load("guilds.json")
+    start = time.perf_counter()
+    await fake.connect(client)
+    loaded = time.perf_counter() - start
+    start = time.perf_counter()
+    for guild in guilds:
+        await client.reconcile(client.get_guild(guild.id))
+    reconciled = time.perf_counter() - start
+    if args.tracemalloc:
+        load_memory = tracemalloc.get_traced_memory()[0] - fake_memory
+        tracemalloc.reset_peak()
+
+    recorder = Recorder(fake)
+    plan = []
+    for i, guild in enumerate(guilds):
+        # Flows of each kind split over the guilds, the first ones taking the remainder
+        plan.extend(plan_flows(guild, args.flows // args.guilds + (i < args.flows % args.guilds), rng))
+    rng.shuffle(plan)
+    queue = asyncio.Queue()
+    for flow in plan:
+        queue.put_nowait(flow)
+
+    async def worker():
+        while not queue.empty():
+            _, function, guild, flow_args = queue.get_nowait()
+            await function(recorder, fake, guild, *flow_args)
+
+    fake.reset_stats()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    requests = sum(fake.requests.values())
+
+    print("{0} guild(s) of {1} members, {2} clans, {3} roles, {4} intents".format(
+        len(guilds), len(guilds[0].members), len(guilds[0].clans), len(guilds[0].roles),
+        "lean" if bot.LEAN_INTENTS else "full"))
+    print("Fake API : {0:.0f}ms latency, {1:.1%} of 429".format(args.latency * 1000, args.rate_limit_share))
+    print("Startup : guilds loaded in {0:.2f}s, store reconciled in {1:.2f}s".format(loaded, reconciled))
+    print("{0} flows, {1} interactions in {2:.2f}s : {3:.1f} interactions/s, concurrency {4}".format(
+        len(plan), recorder.interactions, elapsed, recorder.interactions / elapsed, args.concurrency))
+    print()
+    print("{0:<28} {1:>6} {2:>9} {3:>9} {4:>7} {5:>11}".format("handler", "count", "p50 ms", "p99 ms", "failed",
+                                                                 "unanswered"))
+    for name in sorted(set(recorder.latencies) | set(recorder.unanswered)):
+        values = recorder.latencies[name]
+        print("{0:<28} {1:>6} {2:>9.1f} {3:>9.1f} {4:>7} {5:>11}".format(
+            name, len(values), percentile(sorted(values), 0.5) * 1000, percentile(sorted(values), 0.99) * 1000,
+            recorder.failed[name], recorder.unanswered[name]))
+    print()
+    print("REST : {0} requests, {1:.2f} per interaction, {2} answered with 429".format(
+        requests, requests / max(recorder.interactions, 1), sum(fake.rate_limited.values())))
+    for route, count in fake.requests.most_common():
+        print("  {0:<60} {1:>6}".format(route, count))
+    if fake.unhandled:
+        print("Routes missing from the fake API : " + ", ".join(fake.unhandled))
+    if args.race:
+        print()
+        await race(fake, guilds[0], args.race, args.contenders)
+    if bot.metrics.journal_events.values:
+        print("Clan events journaled : " + ", ".join("{0[0]} {1:.0f}".format(key, count) for key, count
+                                                      in sorted(bot.metrics.journal_events.values.items())))
+    if bot.metrics.errors.values:
+        print("Discord errors logged : " + ", ".join("{0[0]} {1:.0f}".format(key, count)
+                                                     for key, count in bot.metrics.errors.values.items()))
+    print()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("Max RSS : {0:.0f} MB".format(max_rss))
+    if args.tracemalloc:
+        print("Python memory : fake API {0:.0f} MB, bot after load {1:.0f} MB, peak during the run {2:.0f} MB".format(
+            fake_memory / 2 ** 20, load_memory / 2 ** 20, tracemalloc.get_traced_memory()[1] / 2 ** 20))
+    if args.json:
+        latencies = sorted(value for values in recorder.latencies.values() for value in values)
+        print(json.dumps({"guilds": len(guilds), "members": sum(len(guild.members) for guild in guilds),
+                          "interactions": recorder.interactions, "per_second": recorder.interactions / elapsed,
+                          "p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99),
+                          "failed": sum(recorder.failed.values()), "unanswered": sum(recorder.unanswered.values()),
+                          "loaded": loaded, "reconciled": reconciled, "max_rss_mb": max_rss,
+                          "bot_memory_mb": load_memory / 2 ** 20 if args.tracemalloc else None}))
+
+    # Pending deletions of the answers would outlive the HTTP session
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await client.close()
+    await fake.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interaction throughput against a fake Discord API")
+    parser.add_argument("--members", type=int, default=100_000, help="members of each guild")
+    parser.add_argument("--clans", type=int, default=5_000, help="clans of each guild")
+    parser.add_argument("--flows", type=int, default=200, help="flows of each kind, over all the guilds")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per REST request")
+    parser.add_argument("--rate-limit-share", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--race", type=int, default=0, help="rounds of conflicting interactions, after the flows")
+    parser.add_argument("--contenders", type=int, default=4, help="admins creating the same clan in a race")
+    parser.add_argument("--lean", action="store_true", help="run with LEAN_INTENTS")
+    parser.add_argument("--tracemalloc", action="store_true", help="measure the Python memory, slows the run down")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="print the warnings of the bot")
+    parser.add_argument("--json", action="store_true", help="end with a one line JSON summary")
+    args = parser.parse_args()
+
+    # The environment wins over the .env the bot loads
+    os.environ["LEAN_INTENTS"] = "1" if args.lean else ""
+    os.environ["METRICS_PORT"] = ""
+    # Global commands, as the interactions of every guild carry no command guild
+    os.environ["GUILD_ID"] = ""
+    if args.verbose:
+        console = logging.StreamHandler()
+        console.setLevel(logging.WARNING)
+        logging.getLogger("discord").addHandler(console)
+    if args.tracemalloc:
+        tracemalloc.start()
+    # The clan store and the bulk jobs of the bot are written to the working directory
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
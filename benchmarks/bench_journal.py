@@ -0,0 +1,114 @@
+"""Cost of journaling clan events on the event loop, written directly or through
+the ClanJournal buffer, and speed of the replay over the rotated journal
+
+Run with `python benchmarks/bench_journal.py [events]`
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import clan_journal  # noqa: E402
+
+GUILDS = 4
+CLANS = 200
+MEMBERS = 20000
+
+
+def events(count):
+    rng = random.Random(1)
+    for guild in range(GUILDS):
+        for clan in range(CLANS):
+            yield "create", guild, "clan-" + str(clan), {"actor": 1}
+    kinds = ("invite_sent", "invite_sent", "invite_accepted", "invite_refused", "join", "promote", "leave")
+    for _ in range(count - GUILDS * CLANS):
+        member = rng.randrange(MEMBERS)
+        yield rng.choice(kinds), rng.randrange(GUILDS), "clan-" + str(rng.randrange(CLANS)), \
+            {"actor": member, "member": member}
+
+
+class DirectJournal:
+    """Previous way of persisting a line per event: open, append and close on the calling thread"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, event, guild_id, clan, **fields):
+        entry = {"ts": round(time.time(), 3), "event": event, "guild": guild_id, "clan": clan}
+        entry.update(fields)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+async def lag_probe(lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(0.001)
+        lags.append(loop.time() - start - 0.001)
+
+
+async def run(name, journal, count):
+    lags, stop = [], asyncio.Event()
+    probe = asyncio.create_task(lag_probe(lags, stop))
+    costs = []
+    start = time.perf_counter()
+    for i, (event, guild, clan, fields) in enumerate(events(count)):
+        before = time.perf_counter()
+        journal.record(event, guild, clan, **fields)
+        costs.append(time.perf_counter() - before)
+        # Events arrive from many interactions, the loop runs other tasks in between
+        if i % 100 == 99:
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    if isinstance(journal, clan_journal.ClanJournal):
+        await journal.close()
+    stop.set()
+    await probe
+    costs.sort()
+    lags.sort()
+    print("{0:<10} {1:>10.0f} {2:>10.2f} {3:>10.2f} {4:>12.2f}".format(
+        name, count / elapsed, costs[len(costs) // 2] * 1e6, costs[int(len(costs) * 0.99)] * 1e6,
+        lags[int(len(lags) * 0.99)] * 1000 if lags else 0.0))
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print("{0:<10} {1:>10} {2:>10} {3:>10} {4:>12}".format("journal", "events/s", "p50 (us)", "p99 (us)",
+                                                             "lag p99 (ms)"))
+    with tempfile.TemporaryDirectory() as directory:
+        await run("direct", DirectJournal(os.path.join(directory, "direct.jsonl")), count)
+
+        path = os.path.join(directory, "journal", "clans.jsonl")
+        journal = clan_journal.ClanJournal(path, max_bytes=4 * 1024 * 1024)
+        journal.start()
+        await run("buffered", journal, count)
+
+        files = clan_journal.journal_files(path)
+        size = sum(os.path.getsize(filename) for filename in files)
+        print("\n{0} files, {1:.1f} MB on disk, {2:.1f} MB written".format(
+            len(files), size / 1024 / 1024, os.path.getsize(os.path.join(directory, "direct.jsonl")) / 1024 / 1024))
+
+        start = time.perf_counter()
+        stats = clan_journal.replay(clan_journal.read_events(path))
+        elapsed = time.perf_counter() - start
+        # Traced apart, tracemalloc slows the replay down
+        tracemalloc.start()
+        clan_journal.replay(clan_journal.read_events(path))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("replay     {0:.0f} events/s, {1} clans, peak {2:.1f} MB".format(count / elapsed, len(stats),
+                                                                             peak / 1024 / 1024))
+        start = time.perf_counter()
+        clan_journal.replay(clan_journal.read_events(path, guild_id=0))
+        print("one guild  {0:.0f} events/s".format(count / (time.perf_counter() - start)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""Cost of a DEBUG log call on the calling thread (the event loop in the bot)
+with the file handler attached directly, as before, and behind the queue
+
+Run with `python benchmarks/bench_logging.py [records]`
+"""
+import logging
+import logging.handlers
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import logging_additions  # noqa: E402
+
+FMT = "[%(asctime)s] [%(levelname)s] %(name)s: %(message)s"
+
+
+class PerRecordColoredFormatter(logging_additions.ConsoleColoredFormatter):
+    """Previous behaviour: a new Formatter for every record"""
+
+    def format(self, record):
+        return logging.Formatter(self.FORMATS[record.levelno]._fmt).format(record)
+
+
+def file_handler(directory):
+    handler = logging.handlers.RotatingFileHandler(os.path.join(directory, "bench.log"),
+                                                   maxBytes=32 * 1024 * 1024, backupCount=5, encoding="utf-8")
+    handler.setFormatter(logging.Formatter(FMT))
+    return handler
+
+
+def run(name, logger, records, stop=None):
+    stalls = []
+    start = time.perf_counter()
+    for i in range(records):
+        before = time.perf_counter()
+        logger.debug("Dispatching event %s (sequence %d)", "GUILD_MEMBER_UPDATE", i)
+        stalls.append(time.perf_counter() - before)
+    caller = time.perf_counter() - start
+    if stop is not None:
+        stop()
+    total = time.perf_counter() - start
+    stalls.sort()
+    print("{0:<10} {1:>12.0f} {2:>12.2f} {3:>12.2f} {4:>14.0f}".format(
+        name, records / caller, stalls[len(stalls) // 2] * 1e6, stalls[int(len(stalls) * 0.99)] * 1e6,
+        records / total))
+
+
+def fresh_logger(name):
+    logger = logging.getLogger("bench." + name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    return logger
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("{0:<10} {1:>12} {2:>12} {3:>12} {4:>14}".format(
+        "pipeline", "caller rec/s", "p50 (us)", "p99 (us)", "written rec/s"))
+    with tempfile.TemporaryDirectory() as directory:
+        direct = fresh_logger("direct")
+        handler = file_handler(directory)
+        direct.addHandler(handler)
+        run("direct", direct, records)
+        handler.close()
+
+        queued = fresh_logger("queued")
+        listener = logging_additions.setup_queue_logging(queued, [file_handler(directory)])
+        run("queued", queued, records, stop=listener.stop)
+
+    record = logging.LogRecord("discord", logging.INFO, __file__, 0, "Bot ready", None, None)
+    number = 100000
+    for name, formatter in (("per-record", PerRecordColoredFormatter(FMT)),
+                            ("cached", logging_additions.ConsoleColoredFormatter(FMT))):
+        start = time.perf_counter()
+        for _ in range(number):
+            formatter.format(record)
+        print("{0:<10} colored format: {1:.2f} us/record".format(name, (time.perf_counter() - start) / number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
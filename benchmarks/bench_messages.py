@@ -0,0 +1,82 @@
+"""Cost of building a reply embed, from strings written in the code or from the
+message catalog, with the locales shipped and with a catalog of every Discord locale
+
+Run with `python benchmarks/bench_messages.py [replies]`
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import discord  # noqa: E402
+
+import messages  # noqa: E402
+
+CLAN = "Les Chevaliers"
+
+
+def inline_static(locale):
+    return discord.Embed(title="Création de clan", description="Je n'ai pas la permission de créer des rôles",
+                         color=messages.ERROR)
+
+
+def inline_dynamic(locale):
+    return discord.Embed(title="Création de clan", description="Le clan " + CLAN + " a été créé",
+                         color=messages.SUCCESS)
+
+
+def catalog_static(catalog):
+    def build(locale):
+        return catalog.get(locale).embed("new_clan.title", "new_clan.forbidden", color=messages.ERROR)
+    return build
+
+
+def catalog_dynamic(catalog):
+    def build(locale):
+        return catalog.get(locale).embed("new_clan.title", "new_clan.created", color=messages.SUCCESS, clan=CLAN)
+    return build
+
+
+def run(name, build, locales, count):
+    # Interactions come from users of every language
+    start = time.perf_counter()
+    for i in range(count):
+        build(locales[i % len(locales)]).to_dict()
+    elapsed = time.perf_counter() - start
+    print("{0:<28} {1:>10.2f}".format(name, elapsed / count * 1e6))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    locales = list(discord.Locale)
+
+    start = time.perf_counter()
+    shipped = messages.Catalog.load()
+    print("{0} locales loaded in {1:.1f} ms".format(len(shipped.locales), (time.perf_counter() - start) * 1000))
+    with tempfile.TemporaryDirectory() as directory:
+        # Every Discord locale gets its own catalog, a copy of the default one
+        shutil.copy(os.path.join(messages.LOCALES_DIR, messages.DEFAULT_LOCALE + ".json"), directory)
+        with open(os.path.join(messages.LOCALES_DIR, messages.DEFAULT_LOCALE + ".json"), encoding="utf-8") as file:
+            content = json.load(file)
+        for locale in locales:
+            with open(os.path.join(directory, locale.value + ".json"), "w", encoding="utf-8") as file:
+                json.dump(content, file, ensure_ascii=False)
+        start = time.perf_counter()
+        every = messages.Catalog.load(directory)
+        print("{0} locales loaded in {1:.1f} ms\n".format(len(every.locales), (time.perf_counter() - start) * 1000))
+
+    print("{0:<28} {1:>10}".format("reply", "us/reply"))
+    run("inline static", inline_static, locales, count)
+    run("inline dynamic", inline_dynamic, locales, count)
+    run("catalog static", catalog_static(shipped), locales, count)
+    run("catalog dynamic", catalog_dynamic(shipped), locales, count)
+    run("every locale static", catalog_static(every), locales, count)
+    run("every locale dynamic", catalog_dynamic(every), locales, count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+"""In-process stand-in for the Discord REST API and gateway, to run the bot offline
+
+FakeDiscord serves the REST routes the bot uses from a local aiohttp server,
+with a configurable latency and share of 429 responses, and pushes the gateway
+events Discord would send back (role created, member updated...) into the
+client. Interactions are built as gateway payloads and dispatched through the
+client state, so the command tree, the views and the dynamic items route them
+exactly like in production, and the bot answers them over HTTP.
+
+    fake = FakeDiscord(latency=0.05)
+    guild = fake.generate_guild(members=100_000, clans=5_000)
+    await fake.start()
+    await fake.connect(bot.client)
+    elapsed, message = await fake.interact(fake.command(guild, guild.admins[0], "newclan", nom="Rouge"))
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import discord
+import discord.http
+import discord.webhook.async_
+from aiohttp import web
+
+# Absolute, the benchmarks may change the working directory
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from metrics import route_of  # noqa: E402
+
+TOKEN = "fake-token"
+TIMESTAMP = "2024-01-01T00:00:00.000000+00:00"
+ADMINISTRATOR = str(discord.Permissions(administrator=True).value)
+
+# Interaction callback types that answer the interaction by themselves
+ANSWER_CALLBACKS = (4, 7, 9)
+
+
+def json_response(data, status: int = 200, headers: Optional[dict] = None) -> web.Response:
+    # discord.py only decodes bodies whose content type is exactly application/json
+    return web.Response(body=json.dumps(data).encode("utf-8"), status=status,
+                        headers=dict(headers or {}, **{"Content-Type": "application/json"}))
+
+
+def find_component(message: dict, predicate) -> Optional[dict]:
+    """First component of a message payload matching predicate"""
+    for row in message.get("components") or []:
+        for component in row.get("components", []):
+            if predicate(component):
+                return component
+    return None
+
+
+class FakeGuild:
+    """Roles and members of a simulated guild, kept as plain ids"""
+
+    def __init__(self, guild_id: int, name: str, channel_id: int, owner_id: int):
+        self.id = guild_id
+        self.name = name
+        self.channel_id = channel_id
+        self.owner_id = owner_id
+        # role id -> role payload
+        self.roles: Dict[int, dict] = {}
+        # user id -> role ids
+        self.members: Dict[int, List[int]] = {}
+        self.admins: List[int] = []
+        # clan name -> (chief id, member ids)
+        self.clans: Dict[str, tuple] = {}
+        self.clanless: List[int] = []
+
+
+class FakeDiscord:
+    """Local Discord REST API and gateway, see the module documentation"""
+
+    def __init__(self, latency: float = 0.0, rate_limit_share: float = 0.0, retry_after: float = 0.05,
+                 seed: int = 0):
+        self.latency = latency
+        self.rate_limit_share = rate_limit_share
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self._sequence = itertools.count()
+        self.application_id = self._id()
+        self.guilds: Dict[int, FakeGuild] = {}
+        self.client: Optional[discord.Client] = None
+        self.url = ""
+        self._runner: Optional[web.AppRunner] = None
+        # Interaction token -> future of the answer
+        self._answers: Dict[str, asyncio.Future] = {}
+        # Interaction token -> message answering it
+        self.originals: Dict[str, dict] = {}
+        # Interaction token -> id of the message of its component
+        self._component_messages: Dict[str, int] = {}
+        self.messages: Dict[int, dict] = {}
+        self.dm_channels: Dict[int, int] = {}
+        self._dm_users: Dict[int, int] = {}
+        self.direct_messages: Dict[int, dict] = {}
+        self.requests = Counter()
+        self.rate_limited = Counter()
+        self.unhandled = Counter()
+        self._routes = [(method, re.compile("^" + pattern + "$"), handler) for method, pattern, handler in (
+            ("GET", r"/users/@me", self.get_me),
+            ("GET", r"/oauth2/applications/@me", self.get_application),
+            ("PUT", r"/applications/(?P<application_id>\d+)(?:/guilds/\d+)?/commands", self.put_commands),
+            ("POST", r"/interactions/(?P<interaction_id>\d+)/(?P<token>[^/]+)/callback", self.callback),
+            ("PATCH", r"/webhooks/\d+/(?P<token>[^/]+)/messages/@original", self.edit_original),
+            ("DELETE", r"/webhooks/\d+/(?P<token>[^/]+)/messages/@original", self.delete_original),
+            ("POST", r"/guilds/(?P<guild_id>\d+)/roles", self.create_role),
+            ("DELETE", r"/guilds/(?P<guild_id>\d+)/roles/(?P<role_id>\d+)", self.delete_role),
+            ("GET", r"/guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)", self.get_member),
+            ("PATCH", r"/guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)", self.edit_member),
+            ("POST", r"/users/@me/channels", self.create_dm),
+            ("POST", r"/channels/(?P<channel_id>\d+)/messages", self.send_message),
+        )]
+
+    def _id(self) -> int:
+        # Snowflakes of the current time, interactions are dated from their ID
+        return discord.utils.time_snowflake(discord.utils.utcnow()) + next(self._sequence) % (1 << 22)
+
+    # Synthetic guilds
+
+    def generate_guild(self, members: int = 100_000, clans: int = 5_000, clan_share: float = 0.3,
+                       admins: int = 10, name: str = "Serveur de test", member_prefix: str = "Membre ",
+                       chief_prefix: str = "Chef ") -> FakeGuild:
+        """Guild with a member and a chief role per clan, and members spread over the clans
+
+        Each clan has one chief; clan_share of the other members belong to a
+        random clan. The first members are administrators and in no clan.
+        """
+        guild = FakeGuild(self._id(), name, self._id(), self._id())
+        guild.roles[guild.id] = self.role_payload(guild.id, "@everyone", 0)
+        admin_role = self._id()
+        guild.roles[admin_role] = self.role_payload(admin_role, "Admin", 1, ADMINISTRATOR)
+        clan_roles = []
+        for i in range(clans):
+            clan = "Clan{0:05d}".format(i)
+            member_role, chief_role = self._id(), self._id()
+            guild.roles[member_role] = self.role_payload(member_role, member_prefix + clan, 2 + 2 * i)
+            guild.roles[chief_role] = self.role_payload(chief_role, chief_prefix + clan, 3 + 2 * i)
+            clan_roles.append((clan, member_role, chief_role, []))
+        user_ids = [self._id() for _ in range(members)]
+        for user_id in user_ids[:admins]:
+            guild.members[user_id] = [admin_role]
+            guild.admins.append(user_id)
+        others = user_ids[admins:]
+        for (clan, _, chief_role, _), user_id in zip(clan_roles, others):
+            guild.members[user_id] = [chief_role]
+        for user_id in others[len(clan_roles):]:
+            if clan_roles and self.random.random() < clan_share:
+                clan, member_role, _, clan_members = self.random.choice(clan_roles)
+                guild.members[user_id] = [member_role]
+                clan_members.append(user_id)
+            else:
+                guild.members[user_id] = []
+                guild.clanless.append(user_id)
+        for (clan, _, _, clan_members), chief in zip(clan_roles, others):
+            guild.clans[clan] = (chief, clan_members)
+        guild.members[self.application_id] = [admin_role]
+        self.guilds[guild.id] = guild
+        return guild
+
+    # Payloads
+
+    @staticmethod
+    def role_payload(role_id: int, name: str, position: int, permissions: str = "0") -> dict:
+        return {"id": str(role_id), "name": name, "color": 0, "hoist": False, "position": position,
+                "permissions": permissions, "managed": False, "mentionable": False, "flags": 0, "icon": None,
+                "unicode_emoji": None}
+
+    def user_payload(self, user_id: int) -> dict:
+        if user_id == self.application_id:
+            return {"id": str(user_id), "username": "ClanBot", "discriminator": "0", "global_name": None,
+                    "avatar": None, "bot": True}
+        return {"id": str(user_id), "username": "membre" + str(user_id)[-6:], "discriminator": "0",
+                "global_name": None, "avatar": None}
+
+    def member_payload(self, guild: FakeGuild, user_id: int, with_user: bool = True) -> dict:
+        # Deleted roles are dropped here rather than from every member
+        data = {"roles": [str(role_id) for role_id in guild.members[user_id] if role_id in guild.roles],
+                "joined_at": TIMESTAMP, "deaf": False, "mute": False, "flags": 0, "pending": False, "nick": None,
+                "premium_since": None, "avatar": None, "communication_disabled_until": None}
+        if with_user:
+            data["user"] = self.user_payload(user_id)
+        return data
+
+    def channel_payload(self, guild: FakeGuild) -> dict:
+        return {"id": str(guild.channel_id), "type": 0, "guild_id": str(guild.id), "name": "general", "position": 0,
+                "permission_overwrites": [], "nsfw": False, "parent_id": None, "topic": None,
+                "last_message_id": None, "rate_limit_per_user": 0}
+
+    def guild_payload(self, guild: FakeGuild, members: bool = True) -> dict:
+        """GUILD_CREATE payload, the member list only comes with the members intent"""
+        return {"id": str(guild.id), "name": guild.name, "owner_id": str(guild.owner_id), "icon": None,
+                "roles": list(guild.roles.values()),
+                "members": [self.member_payload(guild, user_id) for user_id in
+                            (guild.members if members else [self.application_id])],
+                "member_count": len(guild.members), "channels": [self.channel_payload(guild)], "threads": [],
+                "emojis": [], "stickers": [], "features": [], "large": True, "unavailable": False,
+                "verification_level": 0, "explicit_content_filter": 0, "default_message_notifications": 0,
+                "mfa_level": 0, "nsfw_level": 0, "premium_tier": 0, "preferred_locale": "fr", "afk_timeout": 300,
+                "system_channel_flags": 0, "stage_instances": [], "guild_scheduled_events": [],
+                "joined_at": TIMESTAMP}
+
+    def message_payload(self, message_id: int, channel_id: int, body: dict, flags: int = 0) -> dict:
+        return {"id": str(message_id), "channel_id": str(channel_id), "type": 0,
+                "content": body.get("content") or "", "author": self.user_payload(self.application_id),
+                "embeds": body.get("embeds") or [], "components": body.get("components") or [],
+                "attachments": [], "mentions": [], "mention_roles": [], "mention_everyone": False, "pinned": False,
+                "tts": False, "timestamp": TIMESTAMP, "edited_timestamp": None, "flags": flags}
+
+    @staticmethod
+    def _edit(message: dict, body: dict):
+        # Fields left out of an edit keep their value, None clears them
+        for key in ("content", "embeds", "components"):
+            if key in body:
+                message[key] = body[key] or ("" if key == "content" else [])
+
+    # Interactions
+
+    def _interaction(self, interaction_type: int, guild: Optional[FakeGuild], user_id: int, data: dict,
+                     message: Optional[dict] = None) -> dict:
+        payload = {"id": str(self._id()), "application_id": str(self.application_id), "type": interaction_type,
+                   "token": "token-" + str(self._id()), "version": 1, "locale": "fr", "data": data,
+                   "entitlements": [], "authorizing_integration_owners": {},
+                   "attachment_size_limit": 10 * 1024 * 1024}
+        if guild is not None:
+            member = self.member_payload(guild, user_id)
+            member["permissions"] = ADMINISTRATOR if user_id in guild.admins else "0"
+            payload.update(guild_id=str(guild.id), guild_locale="fr", member=member, context=0,
+                           channel_id=str(guild.channel_id), channel=self.channel_payload(guild),
+                           app_permissions=ADMINISTRATOR)
+        else:
+            channel_id = self.dm_channels.get(user_id) or self._id()
+            payload.update(user=self.user_payload(user_id), context=1, channel_id=str(channel_id),
+                           channel={"id": str(channel_id), "type": 1, "recipients": [self.user_payload(user_id)]})
+        if message is not None:
+            payload["message"] = message
+        return payload
+
+    def command(self, guild: FakeGuild, user_id: int, name: str, **options) -> dict:
+        """Slash command payload, options being strings"""
+        return self._interaction(2, guild, user_id, {
+            "id": str(self._id()), "name": name, "type": 1,
+            "options": [{"name": key, "type": 3, "value": value} for key, value in options.items()]})
+
+    def user_command(self, guild: FakeGuild, user_id: int, name: str, target_id: int) -> dict:
+        """User context menu payload"""
+        return self._interaction(2, guild, user_id, {
+            "id": str(self._id()), "name": name, "type": 2, "target_id": str(target_id),
+            "resolved": {"users": {str(target_id): self.user_payload(target_id)},
+                         "members": {str(target_id): self.member_payload(guild, target_id, with_user=False)}}})
+
+    def component(self, guild: Optional[FakeGuild], user_id: int, message: dict, custom_id: str,
+                  component_type: int = 2, values: Optional[List[str]] = None) -> dict:
+        """Button click or select payload on a message, in a DM when guild is None"""
+        data = {"custom_id": custom_id, "component_type": component_type}
+        if values is not None:
+            data["values"] = values
+        return self._interaction(3, guild, user_id, data, message)
+
+    def modal_submit(self, guild: FakeGuild, user_id: int, message: dict, modal: dict, values: Dict[str, str]) -> dict:
+        """Modal submit payload, values by text input custom_id"""
+        rows = [{"type": 1, "components": [{"type": 4, "custom_id": custom_id, "value": value}]}
+                for custom_id, value in values.items()]
+        return self._interaction(5, guild, user_id, {"custom_id": modal["custom_id"], "components": rows}, message)
+
+    async def interact(self, payload: dict, timeout: float = 30.0):
+        """Dispatch an interaction and wait for its answer, then for its handlers
+
+        Returns the time until the answer and the message (or modal) it
+        produced, None on timeout. Waiting for the handlers lets the next step
+        of a flow find what they stored after answering, like their view.
+        """
+        future = self._answers[payload["token"]] = asyncio.get_running_loop().create_future()
+        if "message" in payload:
+            self._component_messages[payload["token"]] = int(payload["message"]["id"])
+        start = time.perf_counter()
+        handlers = self._dispatch_collecting_tasks("INTERACTION_CREATE", payload)
+        try:
+            answer = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            answer = None
+        elapsed = time.perf_counter() - start
+        if handlers:
+            await asyncio.wait(handlers, timeout=timeout)
+        self._answers.pop(payload["token"], None)
+        self._component_messages.pop(payload["token"], None)
+        return elapsed, answer
+
+    def _dispatch_collecting_tasks(self, event: str, data: dict) -> list:
+        # The client runs the handlers in tasks created while the event is parsed
+        loop = asyncio.get_running_loop()
+        previous = loop.get_task_factory()
+        tasks = []
+
+        def factory(loop, coro, **kwargs):
+            task = previous(loop, coro, **kwargs) if previous is not None else asyncio.Task(coro, loop=loop, **kwargs)
+            tasks.append(task)
+            return task
+
+        loop.set_task_factory(factory)
+        try:
+            self.dispatch(event, data)
+        finally:
+            loop.set_task_factory(previous)
+        return tasks
+
+    def _answer(self, token: str, answer):
+        future = self._answers.get(token)
+        if future is not None and not future.done():
+            future.set_result(answer)
+
+    # Server
+
+    async def start(self):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_route("*", "/{path:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(self._runner, sock).start()
+        self.url = "http://127.0.0.1:{0}/api/v10".format(sock.getsockname()[1])
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def connect(self, client: discord.Client):
+        """Log client in to the fake API and hand it the guilds, as READY and GUILD_CREATE would"""
+        self.client = client
+        discord.http.Route.BASE = self.url
+        discord.webhook.async_.Route.BASE = self.url
+        await client.login(TOKEN)
+        for guild in self.guilds.values():
+            client._connection._add_guild_from_data(self.guild_payload(guild, client.intents.members))
+        # The gateway is not simulated, mark the client ready as the READY event would
+        client._ready.set()
+
+    def reset_stats(self):
+        self.requests.clear()
+        self.rate_limited.clear()
+        self.unhandled.clear()
+
+    def dispatch(self, event: str, data: dict):
+        self.client._connection.parsers[event](data)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        path = request.path[request.path.index("/api/v10") + len("/api/v10"):] if "/api/v10" in request.path \
+            else request.path
+        route = request.method + " " + route_of(path)
+        self.requests[route] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        # Interaction callbacks are not rate limited by Discord
+        if self.rate_limit_share and "/callback" not in path and self.random.random() < self.rate_limit_share:
+            self.rate_limited[route] += 1
+            return json_response({"message": "You are being rate limited.", "retry_after": self.retry_after,
+                                  "global": False}, 429, {"Via": "1.1 google", "X-RateLimit-Scope": "user"})
+        for method, pattern, handler in self._routes:
+            match = pattern.match(path)
+            if match is not None and method == request.method:
+                response = await handler(request, **match.groupdict())
+                # Without these headers discord.py assumes a limit of 1 and serializes the route
+                response.headers.update({"X-RateLimit-Limit": "50", "X-RateLimit-Remaining": "49",
+                                         "X-RateLimit-Reset-After": "1.0",
+                                         "X-RateLimit-Reset": "{0:.3f}".format(time.time() + 1),
+                                         "X-RateLimit-Bucket": route})
+                return response
+        self.unhandled[route] += 1
+        return json_response({"message": "404: Not Found", "code": 0}, 404)
+
+    @staticmethod
+    async def _body(request: web.Request) -> dict:
+        if not request.can_read_body:
+            return {}
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            return json.loads(form["payload_json"])
+        return await request.json()
+
+    def _unknown(self, message: str, code: int) -> web.Response:
+        return json_response({"message": message, "code": code}, 404)
+
+    # Routes
+
+    async def get_me(self, request):
+        return json_response(dict(self.user_payload(self.application_id), verified=True, mfa_enabled=False, flags=0))
+
+    async def get_application(self, request):
+        return json_response({"id": str(self.application_id), "name": "ClanBot", "icon": None, "description": "",
+                              "summary": "", "bot_public": False, "bot_require_code_grant": False,
+                              "owner": self.user_payload(self.application_id), "team": None, "verify_key": "0",
+                              "flags": 0, "tags": [], "redirect_uris": [], "interactions_endpoint_url": None,
+                              "approximate_guild_count": len(self.guilds)})
+
+    async def put_commands(self, request, application_id):
+        return json_response([])
+
+    async def callback(self, request, interaction_id, token):
+        body = await self._body(request)
+        answer = None
+        if body.get("type") == 7:
+            # Update of the component message, known from the interaction
+            answer = self._update_component_message(token, body.get("data") or {})
+        elif body.get("type") == 4:
+            message_id = self._id()
+            message = self.originals[token] = self.messages[message_id] = self.message_payload(
+                message_id, 0, body.get("data") or {}, (body.get("data") or {}).get("flags", 0))
+            answer = message
+        elif body.get("type") == 9:
+            answer = body.get("data")
+        if body.get("type") in ANSWER_CALLBACKS:
+            self._answer(token, answer)
+        if request.query.get("with_response") in ("1", "true"):
+            data = {"interaction": {"id": interaction_id, "type": 2, "response_message_loading": body.get("type") == 5,
+                                    "response_message_ephemeral": False}}
+            if body.get("type") in (4, 7) and answer is not None:
+                data["resource"] = {"type": body["type"], "message": answer}
+            return json_response(data)
+        return web.Response(status=204)
+
+    def _update_component_message(self, token: str, data: dict) -> Optional[dict]:
+        message_id = self._component_messages.get(token)
+        message = self.messages.get(message_id)
+        if message is not None:
+            self._edit(message, data)
+        return message
+
+    async def edit_original(self, request, token):
+        body = await self._body(request)
+        message = self.originals.get(token)
+        if message is None:
+            component_message = self.messages.get(self._component_messages.get(token))
+            if component_message is not None:
+                # Deferred update of a component interaction, the original is the component message
+                message = self.originals[token] = component_message
+            else:
+                message_id = self._id()
+                message = self.originals[token] = self.messages[message_id] = self.message_payload(
+                    message_id, 0, {}, 64)
+        self._edit(message, body)
+        self._answer(token, message)
+        return json_response(message)
+
+    async def delete_original(self, request, token):
+        message = self.originals.pop(token, None)
+        if message is not None:
+            self.messages.pop(int(message["id"]), None)
+        return web.Response(status=204)
+
+    async def create_role(self, request, guild_id):
+        guild = self.guilds[int(guild_id)]
+        body = await self._body(request)
+        role_id = self._id()
+        role = guild.roles[role_id] = self.role_payload(role_id, body.get("name", "new role"), len(guild.roles),
+                                                        str(body.get("permissions", "0")))
+        self.dispatch("GUILD_ROLE_CREATE", {"guild_id": guild_id, "role": role})
+        return json_response(role)
+
+    async def delete_role(self, request, guild_id, role_id):
+        guild = self.guilds[int(guild_id)]
+        if guild.roles.pop(int(role_id), None) is None:
+            return self._unknown("Unknown Role", 10011)
+        self.dispatch("GUILD_ROLE_DELETE", {"guild_id": guild_id, "role_id": role_id})
+        return web.Response(status=204)
+
+    async def get_member(self, request, guild_id, user_id):
+        guild = self.guilds[int(guild_id)]
+        if int(user_id) not in guild.members:
+            return self._unknown("Unknown Member", 10007)
+        return json_response(self.member_payload(guild, int(user_id)))
+
+    async def edit_member(self, request, guild_id, user_id):
+        guild = self.guilds[int(guild_id)]
+        if int(user_id) not in guild.members:
+            return self._unknown("Unknown Member", 10007)
+        body = await self._body(request)
+        if "roles" in body:
+            if any(int(role_id) not in guild.roles for role_id in body["roles"]):
+                # What Discord answers to an edit adding a role deleted in the meantime
+                return json_response({"message": "Invalid Form Body", "code": 50035}, 400)
+            guild.members[int(user_id)] = [int(role_id) for role_id in body["roles"]]
+        member = self.member_payload(guild, int(user_id))
+        # Member events need the members intent
+        if self.client.intents.members:
+            self.dispatch("GUILD_MEMBER_UPDATE", dict(member, guild_id=guild_id))
+        return json_response(member)
+
+    async def create_dm(self, request):
+        body = await self._body(request)
+        user_id = int(body["recipient_id"])
+        channel_id = self.dm_channels.get(user_id)
+        if channel_id is None:
+            channel_id = self.dm_channels[user_id] = self._id()
+            self._dm_users[channel_id] = user_id
+        return json_response({"id": str(channel_id), "type": 1, "recipients": [self.user_payload(user_id)],
+                              "last_message_id": None})
+
+    async def send_message(self, request, channel_id):
+        body = await self._body(request)
+        message_id = self._id()
+        message = self.messages[message_id] = self.message_payload(message_id, int(channel_id), body)
+        user_id = self._dm_users.get(int(channel_id))
+        if user_id is not None:
+            self.direct_messages[user_id] = message
+        return json_response(message)
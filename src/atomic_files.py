@@ -0,0 +1,27 @@
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def open_atomic(path: str, mode: str = "w"):
+    """open() writing to path + ".tmp", renamed over path once the block is done
+
+    Written aside then renamed, a crash never leaves a truncated file behind.
+    When the block raises, path is left as it was.
+    """
+    temporary = path + ".tmp"
+    try:
+        with open(temporary, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as file:
+            yield file
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+    os.replace(temporary, path)
+
+
+def write_atomic(path: str, data: str):
+    with open_atomic(path) as file:
+        file.write(data)
@@ -0,0 +1,26 @@
+import asyncio
+import logging
+from typing import Coroutine, Optional, Set
+
+logger = logging.getLogger('discord.clanbot.background')
+
+# The event loop only keeps weak references to its tasks, a task nobody awaits could be collected while running
+_tasks: Set[asyncio.Task] = set()
+
+
+def spawn(coro: Coroutine, name: Optional[str] = None) -> asyncio.Task:
+    """Run coro in a task nobody awaits, kept alive until it is done and its exception logged"""
+    task = asyncio.get_running_loop().create_task(coro, name=name)
+    _tasks.add(task)
+    task.add_done_callback(_done)
+    return task
+
+
+def _done(task: asyncio.Task):
+    _tasks.discard(task)
+    if task.cancelled():
+        return
+    exception = task.exception()
+    if exception is not None:
+        logger.error("Background task " + task.get_name() + " failed", exc_info=exception)
+
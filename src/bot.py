@@ -1,374 +1,1151 @@
+# First, the startup metrics are timed from its import
+import metrics
+import asyncio
 import discord
+import io
+import json
 import os
+import time
+from typing import Optional
 from dotenv import load_dotenv
 from discord import app_commands
 import logging
 import logging_additions
 import logging.handlers
-
-if not os.path.exists("logs"):
-    os.mkdir("logs")
+from clan_registry import ClanRegistry
+from clan_roster import ClanRoster, EmbedCache
+from guild_config import GuildConfig, GuildConfigs
+from member_cache import MemberCache
+from role_mutations import RoleMutator
+from background import spawn
+from bulk_jobs import BulkFileError, BulkJob, JobQueue, parse_import, parse_member_ids
+from clan_store import ClanStore
+from clan_journal import ClanJournal
+from interactions import InteractionPipeline
+from command_sync import CommandSync
+from invitations import InvitationManager, InviteRefused
+from locks import KeyedLocks, clan_key
+from diagnostics import Diagnostics
+from messages import ERROR, SUCCESS, CatalogTranslator, Messages, catalog
 
 # Logging
 logger = logging.getLogger('discord')
 logger.setLevel(logging.DEBUG)
-handler = logging.handlers.RotatingFileHandler(
-    filename='logs/discord.log',
-    maxBytes=32 * 1024 * 1024,
-    backupCount=5,
-    encoding='utf-8')
-handler.doRollover()
-handler.setFormatter(logging.Formatter('[%(asctime)s] [%(levelname)s] %(name)s: %(message)s'))
-logger.addHandler(handler)
-
-# Logging on console
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
-console.setFormatter(logging_additions.ConsoleColoredFormatter("[%(asctime)s] [%(levelname)s] %(name)s: %(message)s"))
-logger.addHandler(console)
-
-
-# .env reading
-if not os.path.exists(".env"):
-    logger.critical(".env not found, exiting...")
-    exit(1)
-try:
-    load_dotenv()
-except Exception as e:
-    logger.critical("Error while reading .env, exiting...")
-    logger.critical("Stacktrace :")
-    logger.critical(e)
-    exit(1)
-
-# Constants
-try:
-    TOKEN = os.environ["TOKEN"]
-    GUILD_ID = int(os.environ["GUILD_ID"])
-except KeyError as e:
-    logger.critical("TOKEN or GUILD_ID not found in .env, exiting...")
-    logger.critical("Stacktrace :")
-    logger.critical(e)
-    exit(1)
-
-
-class ClanBotClient(discord.Client):
+# Counts the Discord errors the handlers log, for the metrics
+logger.addHandler(metrics.ErrorCounter((discord.HTTPException,)))
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Log to logs/discord.log and to the console"""
+    if not os.path.exists("logs"):
+        os.mkdir("logs")
+    # Rotated when it grows too large, or on a time schedule with LOG_ROTATION (midnight, H, W0...), never at startup
+    rotation = os.environ.get("LOG_ROTATION", "").strip()
+    if rotation:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            filename='logs/discord.log',
+            when=rotation,
+            backupCount=5,
+            encoding='utf-8')
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            filename='logs/discord.log',
+            maxBytes=32 * 1024 * 1024,
+            backupCount=5,
+            encoding='utf-8')
+    if os.environ.get("LOG_FORMAT", "").lower() == "json":
+        # JSON lines log file, for ingestion
+        handler.setFormatter(logging_additions.JsonLinesFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('[%(asctime)s] [%(levelname)s] %(name)s: %(message)s'))
+
+    # Logging on console
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    console.setFormatter(logging_additions.ConsoleColoredFormatter("[%(asctime)s] [%(levelname)s] %(name)s: %(message)s"))
+
+    # Both handlers write from a background thread, never from the event loop
+    return logging_additions.setup_queue_logging(logger, [handler, console])
+
+
+# .env reading, variables already set in the environment take precedence
+load_dotenv()
+
+# Constants, checked by main() so that the module can be imported without them
+TOKEN = os.environ.get("TOKEN")
+# Commands are synced to this guild only when it is set, globally to every guild otherwise
+GUILD_ID = int(os.environ["GUILD_ID"]) if os.environ.get("GUILD_ID", "").strip().isdigit() else None
+# Sharding: SHARD_COUNT shards in total, this process running the comma separated SHARD_IDS, or all of them.
+# Without SHARD_COUNT discord.py asks Discord for the recommended count.
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT", "").strip().isdigit() else None
+SHARD_IDS = [int(shard_id) for shard_id in os.environ.get("SHARD_IDS", "").split(",") if shard_id.strip().isdigit()] \
+    or None
+# Role prefixes and manager roles of each guild
+GUILDS_CONFIG = os.environ.get("GUILDS_CONFIG") or "guilds.json"
+# Only request the intents the clan features need and fetch members on demand
+LEAN_INTENTS = os.environ.get("LEAN_INTENTS", "").lower() in ("1", "true", "yes")
+# Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics, disabled without a port
+METRICS_PORT = int(os.environ["METRICS_PORT"]) if os.environ.get("METRICS_PORT", "").strip().isdigit() else None
+METRICS_HOST = os.environ.get("METRICS_HOST") or "127.0.0.1"
+# Loop lag sampler, slow callback detector and /botstats, off by default as they cost a little on every task step
+DIAGNOSTICS = os.environ.get("DIAGNOSTICS", "").lower() in ("1", "true", "yes")
+# Task steps holding the loop longer than this are reported, with DIAGNOSTICS
+DIAGNOSTICS_SLOW_MS = int(os.environ["DIAGNOSTICS_SLOW_MS"]) if os.environ.get("DIAGNOSTICS_SLOW_MS", "").strip().isdigit() \
+    else 50
+# Seconds an invitation can be accepted
+INVITE_TTL = 60
+# Invitations to the same member within this many milliseconds are sent in one DM, disabled without a value
+INVITE_BATCH_MS = int(os.environ["INVITE_BATCH_MS"]) if os.environ.get("INVITE_BATCH_MS", "").strip().isdigit() else None
+
+
+class ClanBotClient(discord.AutoShardedClient):
+    """One process serving every guild of its shards, each guild with its own config and clan registry"""
 
     def __init__(self):
-        super().__init__(intents=discord.Intents.all())
+        options = {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS}
+        if METRICS_PORT is not None:
+            # Counts the REST requests and 429 responses per route
+            options["http_trace"] = metrics.http_trace()
+        if LEAN_INTENTS:
+            # Roles and role events come with the guilds intent, interactions need no intent
+            intents = discord.Intents.none()
+            intents.guilds = True
+            super().__init__(intents=intents, chunk_guilds_at_startup=False,
+                             member_cache_flags=discord.MemberCacheFlags.none(), **options)
+        else:
+            super().__init__(intents=discord.Intents.all(), **options)
         self.synced = False
+        self.registries = {}
+        self.rosters = {}
+        self.embeds = EmbedCache()
+        self.configs = GuildConfigs()
+        self.members = MemberCache()
+        self.role_mutator = RoleMutator(self.members)
+        self.jobs = JobQueue(self)
+        self.store = ClanStore()
+        # Shared by the processes of the other shards, rotated by the one running shard 0
+        self.journal = ClanJournal(rotate=self.shard_ids is None or 0 in self.shard_ids)
+        self.role_mutator.listeners.append(self.store_member_later)
+        self.locks = KeyedLocks()
+        self.invitations = InvitationManager(self.send_invitations, INVITE_TTL, (INVITE_BATCH_MS or 0) / 1000)
+        self.metrics_server = None
+        self.diagnostics = Diagnostics(DIAGNOSTICS_SLOW_MS / 1000) if DIAGNOSTICS else None
+
+    async def setup_hook(self):
+        await self.store.open()
+        self.journal.start()
+        self.jobs.start()
+        self.add_dynamic_items(InviteButton)
+        # Descriptions of the commands in the languages of the catalog
+        await tree.set_translator(CatalogTranslator(catalog))
+        if self.diagnostics is not None:
+            self.diagnostics.start()
+        if METRICS_PORT is not None:
+            self.register_metrics()
+            self.metrics_server = metrics.MetricsServer(METRICS_HOST, METRICS_PORT)
+            await self.metrics_server.start()
+
+    async def close(self):
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        if self.diagnostics is not None:
+            self.diagnostics.stop()
+        await super().close()
+        await self.store.close()
+        await self.journal.close()
+
+    def register_metrics(self):
+        """Gauges read from the client state, only computed when scraped"""
+        register = metrics.registry.register
+        register(metrics.Gauge("clanbot_gateway_latency_seconds", "Gateway heartbeat latency per shard",
+                               lambda: {(str(shard_id),): latency for shard_id, latency in self.latencies},
+                               ("shard",)))
+        register(metrics.Gauge("clanbot_guilds", "Guilds of the bot", lambda: len(self.guilds)))
+        register(metrics.Gauge("clanbot_clans", "Clans per guild",
+                               lambda: {(guild_id,): len(registry) for guild_id, registry in self.registries.items()},
+                               ("guild",)))
+        register(metrics.Gauge("clanbot_cached_members", "Members in the client cache",
+                               lambda: sum(len(guild.members) for guild in self.guilds)))
+        register(metrics.Gauge("clanbot_member_cache_size", "Members in the MemberCache", lambda: len(self.members)))
+        register(metrics.Gauge("clanbot_live_views", "Views still waiting for interactions",
+                               lambda: sum(1 for view in list(metrics.live_views) if not view.is_finished())))
+        register(metrics.CounterFunction("clanbot_role_operations_total", "Role changes requested to the RoleMutator",
+                                         lambda: self.role_mutator.operations))
+        register(metrics.CounterFunction("clanbot_role_edits_total", "Member edits sent by the RoleMutator",
+                                         lambda: self.role_mutator.rest_calls))
+        register(metrics.Gauge("clanbot_bulk_jobs", "Bulk jobs per status",
+                               lambda: _count_by_status(self.jobs.jobs.values()), ("status",)))
+        register(metrics.CounterFunction("clanbot_bulk_wait_seconds_total", "Time bulk jobs waited for the rate limits",
+                                         lambda: self.jobs.scheduler.waited))
+        register(metrics.Gauge("clanbot_locks", "Clan locks held or waited for", lambda: len(self.locks)))
+        register(metrics.CounterFunction("clanbot_lock_contended_total", "Lock acquisitions that had to wait",
+                                         lambda: self.locks.contended))
+        register(metrics.Gauge("clanbot_journal_pending", "Clan events waiting to be written", lambda: len(self.journal)))
+
+    def config(self, guild: discord.Guild) -> GuildConfig:
+        return self.configs.get(guild.id)
+
+    def registry(self, guild: discord.Guild) -> ClanRegistry:
+        registry = self.registries.get(guild.id)
+        if registry is None:
+            config = self.config(guild)
+            registry = self.registries[guild.id] = ClanRegistry(config.member_prefix, config.chief_prefix)
+            registry.build(guild.roles)
+        return registry
+
+    def roster(self, guild: discord.Guild) -> ClanRoster:
+        roster = self.rosters.get(guild.id)
+        if roster is None:
+            # Seeded by reconcile
+            roster = self.rosters[guild.id] = ClanRoster()
+        return roster
+
+    async def store_member(self, member: discord.Member):
+        ranks = self.registry(member.guild).ranks_of(member.roles)
+        self.roster(member.guild).set_member(member.id, ranks)
+        try:
+            await self.store.set_member_clans(member.guild.id, member.id, ranks)
+        except Exception as e:
+            logger.error("Error while storing the clans of " + member.name)
+            logger.error("Stacktrace :")
+            logger.error(e)
+
+    async def send_invitations(self, member: discord.Member, invites):
+        """One DM inviting member to the (clan, member role, leader) invites, with their buttons"""
+        # Not an answer to the member, whose language is unknown: the one of the server
+        messages = catalog.get(member.guild.preferred_locale)
+        if len(invites) == 1:
+            clan, _, leader = invites[0]
+            content = messages.text("invite.message", clan=clan, leader=leader.name)
+        else:
+            content = messages.text("invite.message_several") + "\n" + "\n".join(
+                messages.text("invite.message_line", clan=clan, leader=leader.name) for clan, _, leader in invites)
+        await member.send(content, view=JoinClanUI(member.guild.id, member.id,
+                                                   [(clan, role.id) for clan, role, _ in invites],
+                                                   int(time.time()) + INVITE_TTL, messages))
+
+    def store_member_later(self, member: discord.Member):
+        spawn(self.store_member(member), "store_member")
+
+    async def store_clan(self, guild: discord.Guild, name: str):
+        clan = self.registry(guild).get(name)
+        if clan is None:
+            self.roster(guild).remove_clan(name)
+            await self.store.delete_clan(guild.id, name)
+        else:
+            self.roster(guild).add_clan(name)
+            await self.store.upsert_clan(guild.id, name, clan.member.id if clan.member else None,
+                                         clan.chief.id if clan.chief else None)
+
+    async def reconcile(self, guild: discord.Guild):
+        """Bring the store up to date with the roles, and the members if they are cached"""
+        registry = self.registry(guild)
+        roster = self.rosters.get(guild.id)
+        if roster is None or roster.seeded:
+            roster = self.rosters[guild.id] = ClanRoster()
+        clans = [(clan.name, clan.member.id if clan.member else None, clan.chief.id if clan.chief else None)
+                 for clan in registry]
+        memberships = None
+        if not LEAN_INTENTS and guild.chunked:
+            memberships = []
+            for i, member in enumerate(guild.members):
+                for name, rank in registry.ranks_of(member.roles).items():
+                    memberships.append((member.id, name, rank))
+                # Give the event loop a chance to run on large guilds
+                if i % 1000 == 999:
+                    await asyncio.sleep(0)
+        await self.store.reconcile(guild.id, clans, memberships)
+        # Counted once from the store, then only updated from the membership changes
+        roster.seed([name for name, _, _ in clans], await self.store.memberships(guild.id))
+        logger.info('Clan store reconciled with {0.name} ({0.id})'.format(guild))
 
     async def on_ready(self):
+        metrics.mark_startup("ready")
         logger.info('Bot ready, starting...')
         await client.wait_until_ready()
         logger.info('Logged in as {0.user}'.format(client))
         logger.info('=' * 60)
-        logger.info('Guilds :')
-        for guild in client.guilds:
-            logger.info(' - {0.name} ({0.id})'.format(guild))
+        logger.info('{0} guilds on shards {1} of {2}'.format(len(client.guilds), sorted(client.shards),
+                                                            client.shard_count))
+        # Not named guild, which is the guild the commands are synced to
+        for server in client.guilds:
+            # One line per guild would flood the console of large deployments
+            logger.debug(' - {0.name} ({0.id}), shard {0.shard_id}, {1} clans'.format(server, len(self.registry(server))))
         logger.info('=' * 60)
         await client.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="les clans"))
         client.status = discord.Status.online
-        logger.info('Syncing...')
-        if not self.synced:
-            await tree.sync()
+        # The commands belong to the application, the process running shard 0 syncs them for every process
+        if not self.synced and (self.shard_ids is None or 0 in self.shard_ids):
+            await command_sync.sync(guild)
             self.synced = True
-            logger.info('Synced !')
+            metrics.mark_startup("commands_synced")
+
+    async def on_guild_role_create(self, role: discord.Role):
+        registry = self.registry(role.guild)
+        registry.add_role(role)
+        if registry.clan_of(role.id) is not None:
+            await self.store_clan(role.guild, registry.clan_of(role.id))
+
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.name != after.name:
+            registry = self.registry(after.guild)
+            before_clan = registry.clan_of(before.id)
+            registry.update_role(before, after)
+            for name in {before_clan, registry.clan_of(after.id)} - {None}:
+                await self.store_clan(after.guild, name)
+
+    async def on_guild_role_delete(self, role: discord.Role):
+        registry = self.registry(role.guild)
+        name = registry.clan_of(role.id)
+        registry.remove_role(role)
+        if name is not None:
+            await self.store_clan(role.guild, name)
+
+    async def on_guild_available(self, guild: discord.Guild):
+        # At startup, and each time a shard identifies again or the guild comes back from an outage: ready only
+        # fires once, and the roles, clans and members may have changed while the shard was away
+        self.registries.pop(guild.id, None)
+        spawn(self.reconcile(guild), "reconcile {0}".format(guild.id))
+
+    async def on_guild_join(self, guild: discord.Guild):
+        logger.info('Joined {0.name} ({0.id}), shard {0.shard_id}'.format(guild))
+        await self.reconcile(guild)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.registries.pop(guild.id, None)
+        self.rosters.pop(guild.id, None)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        self.members.invalidate(after.guild.id, after.id)
+        if before.roles != after.roles:
+            await self.store_member(after)
+
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        self.members.invalidate(payload.guild_id, payload.user.id)
+        if payload.guild_id in self.rosters:
+            self.rosters[payload.guild_id].remove_member(payload.user.id)
+        await self.store.remove_member(payload.guild_id, payload.user.id)
+
+    async def on_interaction(self, interaction: discord.Interaction):
+        # Interaction payloads carry up to date members, keep them for later lookups
+        if isinstance(interaction.user, discord.Member):
+            previous = self.members.get_cached(interaction.guild, interaction.user.id)
+            self.members.put(interaction.user)
+            # Without member events (lean mode) this is how the store learns about role changes
+            if previous is None or previous.roles != interaction.user.roles:
+                await self.store_member(interaction.user)
+
+
+def _count_by_status(jobs) -> dict:
+    counts = {}
+    for job in jobs:
+        counts[(job.status,)] = counts.get((job.status,), 0) + 1
+    return counts
+
+
+class ClanBotView(discord.ui.View):
+    """Base of the views of the bot, counted in the metrics while they listen"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        metrics.live_views.add(self)
 
 
 client = ClanBotClient()
 tree = discord.app_commands.CommandTree(client)
+# Syncs the tree when on_ready runs, once every command is defined
+command_sync = CommandSync(tree)
 
 """
  Commandes :
 """
 
-guild = client.get_guild(GUILD_ID)
+# The client is not connected yet, an Object is enough to register and sync the commands to a guild
+guild = discord.Object(id=GUILD_ID) if GUILD_ID is not None else None
 
 
 @tree.command(name="newclan", guild=guild, description="Créer un nouveau clan")
+@app_commands.guild_only()
 @app_commands.describe(
     nom="Nom du clan",
 )
 async def new_clan(ctx: discord.Interaction, nom: str):
-    # Admin only
-    if not ctx.user.guild_permissions.administrator:
-        await ctx.response.send_message("Vous n'avez pas la permission de faire cela", ephemeral=True, delete_after=15)
-        return
-
-    # Check if the clan already exists
-    if discord.utils.get(ctx.guild.roles, name="Membre " + nom):
-        embed = discord.Embed(title="Création de clan",
-                                description="Le clan " + nom + " existe déjà", color=0xff0000)
-        await ctx.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-    else:
-        try:
-            await ctx.guild.create_role(name="Membre " + nom, mentionable=False, hoist=False,
-                                        reason="Création du clan " + nom + " par " + ctx.user.name)
-            await ctx.guild.create_role(name="Chef " + nom, mentionable=False, hoist=False,
-                                        reason="Création du clan " + nom + " par " + ctx.user.name)
-
-            embed = discord.Embed(title="Création de clan",
-                                  description="Le clan " + nom + " a été créé", color=0x00ff00)
-            await ctx.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-        except discord.Forbidden as e:
-            embed = discord.Embed(title="Création de clan",
-                                  description="Je n'ai pas la permission de créer des rôles", color=0xff0000)
-            await ctx.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            logger.error("Permission error while creating role " + nom)
-            logger.error("Stacktrace :")
-            logger.error(e)
-        except discord.HTTPException as e:
-            embed = discord.Embed(title="Création de clan",
-                                  description="Une erreur est survenue lors de la création du clan " + nom,
-                                  color=0xff0000)
-            await ctx.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            logger.error("HTTP error while creating role " + nom)
-            logger.error("Stacktrace :")
-            logger.error(e)
+    async with InteractionPipeline(ctx, "new_clan") as reply:
+        # Admins and manager roles only
+        config = client.config(ctx.guild)
+        messages = reply.messages
+        if not config.can_manage(ctx.user):
+            await reply.send(messages.text("no_permission"), delete_after=15)
+            return
+
+        # One creation per clan name at a time, the check below sees the roles of the previous one
+        async with client.locks.hold("new_clan", clan_key(ctx.guild.id, nom)):
+            # Check if the clan already exists
+            if nom in client.registry(ctx.guild):
+                embed = messages.embed("new_clan.title", "new_clan.exists", color=ERROR, clan=nom)
+                await reply.send(embed=embed, delete_after=15)
+            else:
+                try:
+                    # Indexed right away, the role events of the gateway may come after the lock is released
+                    registry = client.registry(ctx.guild)
+                    reason = "Création du clan " + nom + " par " + ctx.user.name
+                    registry.add_role(await ctx.guild.create_role(name=config.member_prefix + nom, mentionable=False,
+                                                                  hoist=False, reason=reason))
+                    registry.add_role(await ctx.guild.create_role(name=config.chief_prefix + nom, mentionable=False,
+                                                                  hoist=False, reason=reason))
+                    await client.store_clan(ctx.guild, nom)
+                    await client.store.set_creator(ctx.guild.id, nom, ctx.user.name)
+                    client.roster(ctx.guild).touch(nom)
+                    client.journal.record("create", ctx.guild.id, nom, actor=ctx.user.id)
+
+                    embed = messages.embed("new_clan.title", "new_clan.created", color=SUCCESS, clan=nom)
+                    await reply.send(embed=embed, delete_after=15)
+                except discord.Forbidden as e:
+                    embed = messages.embed("new_clan.title", "new_clan.forbidden", color=ERROR)
+                    await reply.send(embed=embed, delete_after=15)
+                    logger.error("Permission error while creating role " + nom)
+                    logger.error("Stacktrace :")
+                    logger.error(e)
+                except discord.HTTPException as e:
+                    embed = messages.embed("new_clan.title", "new_clan.error", color=ERROR, clan=nom)
+                    await reply.send(embed=embed, delete_after=15)
+                    logger.error("HTTP error while creating role " + nom)
+                    logger.error("Stacktrace :")
+                    logger.error(e)
 
 
 @tree.command(name="deleteclan", guild=guild, description="Supprimer un clan")
+@app_commands.guild_only()
 @app_commands.describe(
     nom="Nom du clan"
 )
 async def delete_clan(ctx: discord.Interaction, nom: str):
-    # Check if the clan exists
-    if not discord.utils.get(ctx.guild.roles, name="Membre " + nom):
-        embed = discord.Embed(title="Suppression du clan " + nom,
-                                description="Le clan " + nom + " n'existe pas", color=0xff0000)
-        await ctx.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-        return
-
-    # Admin only or clan chief
-    if not ctx.user.guild_permissions.administrator:
-        if not discord.utils.get(ctx.user.roles, name="Chef " + nom):
-            embed = discord.Embed(title="Suppression du clan " + nom,
-                                  description="Vous n'avez pas la permission de faire cela", color=0xff0000)
-            await ctx.response.send_message(embed=embed, ephemeral=True, delete_after=15)
+    async with InteractionPipeline(ctx, "delete_clan") as reply:
+        messages = reply.messages
+        # Check if the clan exists
+        clan = client.registry(ctx.guild).get(nom)
+        if clan is None or clan.member is None:
+            await reply.send(embed=messages.embed("delete_clan.title", "clan_missing", color=ERROR, clan=nom),
+                             delete_after=15)
             return
 
-    embed = discord.Embed(title="Suppression du clan " + nom,
-                          description="Êtes-vous sûr de vouloir supprimer le clan " + nom + " ?")
-    embed.set_footer(text="Cette action est irréversible")
-    await ctx.response.send_message(embed=embed, ephemeral=True, delete_after=15, view=DeleteClanUI(nom))
+        # Admins, manager roles or clan chief
+        if not client.config(ctx.guild).can_manage(ctx.user):
+            if clan.chief is None or ctx.user.get_role(clan.chief.id) is None:
+                await reply.send(embed=messages.embed("delete_clan.title", "no_permission", color=ERROR, clan=nom),
+                                 delete_after=15)
+                return
+
+        embed = messages.embed("delete_clan.title", "delete_clan.confirm", footer="delete_clan.irreversible", clan=nom)
+        await reply.send(embed=embed, delete_after=15, view=DeleteClanUI(nom, messages))
 
 
 @tree.command(name="leaveclan", guild=guild, description="Quitter un clan")
+@app_commands.guild_only()
 @app_commands.describe(
     nom="Nom du clan"
 )
 async def leave_clan(ctx: discord.Interaction, nom: str):
-    # Check if the clan exists
-    if not discord.utils.get(ctx.guild.roles, name="Membre " + nom):
-        embed = discord.Embed(title="Quitter le clan " + nom,
-                                description="Le clan " + nom + " n'existe pas", color=0xff0000)
-        await ctx.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-        return
+    async with InteractionPipeline(ctx, "leave_clan") as reply:
+        messages = reply.messages
+        # Check if the clan exists
+        clan = client.registry(ctx.guild).get(nom)
+        if clan is None or clan.member is None:
+            await reply.send(embed=messages.embed("leave_clan.title", "clan_missing", color=ERROR, clan=nom),
+                             delete_after=15)
+            return
+
+        # Check if the user is in the clan
+        if not any(ctx.user.get_role(role.id) for role in clan.roles()):
+            await reply.send(embed=messages.embed("leave_clan.title", "leave_clan.not_member", color=ERROR, clan=nom),
+                             delete_after=15)
+            return
 
-    # Check if the user is in the clan
-    if not discord.utils.get(ctx.user.roles, name="Membre " + nom) and not discord.utils.get(ctx.user.roles, name="Chef " + nom):
-        embed = discord.Embed(title="Quitter le clan " + nom,
-                                description="Vous n'êtes pas dans le clan " + nom, color=0xff0000)
-        await ctx.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-        return
+        embed = messages.embed("leave_clan.title", "leave_clan.confirm", clan=nom)
+        await reply.send(embed=embed, delete_after=15, view=LeaveClanUI(nom, messages))
 
-    embed = discord.Embed(title="Quitter le clan " + nom,
-                          description="Êtes-vous sûr de vouloir quitter le clan " + nom + " ?")
-    await ctx.response.send_message(embed=embed, ephemeral=True, delete_after=15, view=LeaveClanUI(nom))
+
+@delete_clan.autocomplete("nom")
+async def clan_autocomplete(ctx: discord.Interaction, current: str):
+    return [app_commands.Choice(name=clan, value=clan) for clan in client.registry(ctx.guild).search(current)]
+
+
+@leave_clan.autocomplete("nom")
+async def user_clan_autocomplete(ctx: discord.Interaction, current: str):
+    registry = client.registry(ctx.guild)
+    prefix = current.casefold()
+    clans = set()
+    for role in ctx.user.roles:
+        name = registry.clan_of(role.id)
+        if name is not None and name.casefold().startswith(prefix):
+            clans.add(name)
+    return [app_commands.Choice(name=clan, value=clan) for clan in sorted(clans, key=str.casefold)[:25]]
+
+
+# Clan roster, served from the ClanRoster counters and cached embeds
+
+CLANS_PAGE_SIZE = 15
+
+
+def clan_list_embed(guild: discord.Guild, page: int, messages: Messages) -> discord.Embed:
+    """Page of the clans by decreasing size, rendered again only when one of its clans changed"""
+    roster = client.roster(guild)
+    names = roster.ranked(page * CLANS_PAGE_SIZE, CLANS_PAGE_SIZE)
+    stamp = (len(roster), tuple((name, roster.version(name)) for name in names))
+    embed = client.embeds.get(("clans", guild.id, page, messages.locale), stamp)
+    if embed is None:
+        lines = []
+        for i, name in enumerate(names, page * CLANS_PAGE_SIZE + 1):
+            members, chiefs = roster.counts(name)
+            lines.append(messages.text("clans.line", position=i, clan=name, members=members, chiefs=chiefs))
+        embed = discord.Embed(title=messages.text("clans.title"),
+                              description="\n".join(lines) or messages.text("clans.empty"), color=SUCCESS)
+        pages = max((len(roster) + CLANS_PAGE_SIZE - 1) // CLANS_PAGE_SIZE, 1)
+        footer = messages.text("clans.footer", page=page + 1, pages=pages, count=len(roster))
+        if LEAN_INTENTS:
+            # Without the members intent only the members whose roles the bot changed are counted
+            footer += " · " + messages.text("clans.partial")
+        embed.set_footer(text=footer)
+        client.embeds.put(("clans", guild.id, page, messages.locale), stamp, embed)
+    return embed
+
+
+async def clan_info_embed(guild: discord.Guild, name: str, messages: Messages) -> discord.Embed:
+    roster = client.roster(guild)
+    stamp = roster.version(name)
+    embed = client.embeds.get(("claninfo", guild.id, name, messages.locale), stamp)
+    if embed is None:
+        clan = await client.store.clan(guild.id, name)
+        members, chiefs = roster.counts(name)
+        leaders = sorted(roster.chiefs.get(name, ()))
+        value = " ".join("<@{0}>".format(user_id) for user_id in leaders[:20])
+        if len(leaders) > 20:
+            value += messages.text("clan_info.other_chiefs", count=len(leaders) - 20)
+        embed = discord.Embed(title=messages.text("clan_info.title", clan=name), color=SUCCESS)
+        embed.add_field(name=messages.text("clan_info.chiefs"), value=value or messages.text("clan_info.no_chief"),
+                        inline=False)
+        embed.add_field(name=messages.text("clan_info.members"), value=str(members))
+        embed.add_field(name=messages.text("clan_info.chief_count"), value=str(chiefs))
+        if clan is not None:
+            embed.add_field(name=messages.text("clan_info.created"), value="<t:{0}:D>".format(int(clan[3])) +
+                            (messages.text("clan_info.created_by", name=clan[4]) if clan[4] else ""))
+        if LEAN_INTENTS:
+            embed.set_footer(text=messages.text("clans.partial"))
+        client.embeds.put(("claninfo", guild.id, name, messages.locale), stamp, embed)
+    return embed
+
+
+@tree.command(name="clans", guild=guild, description="Liste des clans et de leur nombre de membres")
+@app_commands.guild_only()
+async def clans(ctx: discord.Interaction):
+    async with InteractionPipeline(ctx, "clans") as reply:
+        if not client.roster(ctx.guild).seeded:
+            await reply.send(reply.messages.text("clans.loading"), delete_after=15)
+            return
+        view = ClanListUI(ctx.guild, reply.messages)
+        await reply.send(embed=view.embed, view=view, delete_after=120)
+
+
+@tree.command(name="claninfo", guild=guild, description="Chefs, nombre de membres et création d'un clan")
+@app_commands.describe(
+    nom="Nom du clan"
+)
+@app_commands.guild_only()
+@app_commands.autocomplete(nom=clan_autocomplete)
+async def clan_info(ctx: discord.Interaction, nom: str):
+    async with InteractionPipeline(ctx, "clan_info") as reply:
+        if not client.roster(ctx.guild).seeded:
+            await reply.send(reply.messages.text("clans.loading"), delete_after=15)
+            return
+        if nom not in client.registry(ctx.guild) or nom not in client.roster(ctx.guild):
+            embed = reply.messages.embed("clan_info.title", "clan_missing", color=ERROR, clan=nom)
+            await reply.send(embed=embed, delete_after=15)
+            return
+        await reply.send(embed=await clan_info_embed(ctx.guild, nom, reply.messages), delete_after=60)
+
+
+# Diagnostics, only registered with DIAGNOSTICS
+
+@app_commands.command(name="botstats", description="Latence de la boucle, callbacks lents et profil du bot")
+@app_commands.describe(
+    profil="Durée du profil en secondes",
+)
+@app_commands.guild_only()
+@app_commands.default_permissions(administrator=True)
+async def bot_stats(ctx: discord.Interaction, profil: app_commands.Range[int, 1, 60] = 5):
+    async with InteractionPipeline(ctx, "bot_stats") as reply:
+        messages = reply.messages
+        # Server administrators only, whatever the manager roles: it is about the whole bot
+        if not ctx.user.guild_permissions.administrator:
+            await reply.send(messages.text("no_permission"), delete_after=15)
+            return
+        diagnostics = client.diagnostics
+        try:
+            path, samples = await diagnostics.profiler.profile(profil)
+        except RuntimeError:
+            await reply.send(messages.text("bot_stats.busy"), delete_after=15)
+            return
+        lag = diagnostics.lag.summary()
+        embed = discord.Embed(title=messages.text("bot_stats.title"), color=SUCCESS)
+        embed.add_field(name=messages.text("bot_stats.loop_lag"), value=messages.text(
+            "bot_stats.loop_lag_value", p50=lag["p50"] * 1000, p99=lag["p99"] * 1000, max=lag["max"] * 1000),
+                        inline=False)
+        embed.add_field(name=messages.text("bot_stats.gateway"), value=", ".join(
+            messages.text("bot_stats.shard", shard=shard_id, latency=latency * 1000)
+            for shard_id, latency in client.latencies) or "-", inline=False)
+        slow = [messages.text("bot_stats.slow_line", name=name, count=int(count), total=total * 1000, max=worst * 1000)
+                for name, (count, total, worst) in diagnostics.slow.top()]
+        embed.add_field(name=messages.text("bot_stats.slow", threshold=diagnostics.slow.threshold * 1000),
+                        value="\n".join(slow)[:1024] or messages.text("bot_stats.no_slow"), inline=False)
+        count, names = diagnostics.tasks()
+        embed.add_field(name=messages.text("bot_stats.tasks", count=count),
+                        value="\n".join("{0} : {1}".format(name, number) for name, number in names)[:1024] or "-",
+                        inline=False)
+        embed.add_field(name=messages.text("bot_stats.profile"),
+                        value=messages.text("bot_stats.profile_value", samples=samples, duration=profil, path=path),
+                        inline=False)
+        await reply.send(embed=embed, delete_after=120)
+
+
+if DIAGNOSTICS:
+    tree.add_command(bot_stats, guild=guild)
+
+
+# Bulk operations, run in the background by client.jobs
+
+bulk = app_commands.Group(name="clanbulk", description="Opérations de masse sur les clans", guild_only=True,
+                          default_permissions=discord.Permissions(administrator=True))
+
+
+async def refuse_non_admin(reply: InteractionPipeline) -> bool:
+    if not client.config(reply.interaction.guild).can_manage(reply.interaction.user):
+        await reply.send(reply.messages.text("no_permission"), delete_after=15)
+        return True
+    return False
+
+
+async def submit_bulk_job(reply: InteractionPipeline, kind: str, steps):
+    job = BulkJob.new(reply.interaction.guild.id, reply.interaction.user.name, kind, steps)
+    await client.jobs.submit(job)
+    embed = reply.messages.embed("bulk.job_title", "bulk.submitted", color=SUCCESS, job=job.id, count=len(steps))
+    await reply.send(embed=embed, delete_after=15)
+
+
+def job_progress(messages: Messages, job: BulkJob) -> str:
+    return messages.text("bulk.progress", job=job.id, kind=job.kind, status=job.status, cursor=job.cursor,
+                         steps=len(job.steps), errors=len(job.errors))
+
+
+def job_error(messages: Messages, error) -> str:
+    # Jobs saved before the errors were catalog keys kept their French text
+    if isinstance(error, str):
+        return error
+    key, values = error
+    return messages.text(key, **values)
+
+
+@bulk.command(name="import", description="Importer des clans et leurs membres depuis un fichier CSV ou JSON")
+@app_commands.describe(
+    fichier="Fichier .csv (clan,member_id,rank) ou .json (format de /clanbulk export)",
+)
+async def bulk_import(ctx: discord.Interaction, fichier: discord.Attachment):
+    async with InteractionPipeline(ctx, "bulk_import") as reply:
+        if await refuse_non_admin(reply):
+            return
+        try:
+            steps = parse_import(fichier.filename, await fichier.read())
+        except BulkFileError as e:
+            embed = reply.messages.embed("bulk.import_title", e.key, color=ERROR, **e.values)
+            await reply.send(embed=embed, delete_after=15)
+            return
+        await submit_bulk_job(reply, "import", steps)
+
+
+@bulk.command(name="export", description="Exporter les clans et leurs membres en JSON")
+async def bulk_export(ctx: discord.Interaction):
+    async with InteractionPipeline(ctx, "bulk_export") as reply:
+        if await refuse_non_admin(reply):
+            return
+        export = await client.store.export(ctx.guild.id)
+        warning = None
+        if LEAN_INTENTS:
+            # Only the members whose roles the bot changed, said in the reply and in the file itself
+            export["partial"] = True
+            warning = reply.messages.text("bulk.export_partial")
+        data = json.dumps(export, ensure_ascii=False, indent=1)
+        await reply.send(warning, file=discord.File(io.BytesIO(data.encode("utf-8")), filename="clans.json"))
+
+
+@bulk.command(name="assign", description="Ajouter tous les membres d'un fichier à un clan")
+@app_commands.describe(
+    nom="Nom du clan",
+    fichier="Fichier avec un identifiant de membre par ligne",
+    rang="Rang donné aux membres",
+)
+@app_commands.choices(rang=[app_commands.Choice(name="Membre", value="member"),
+                            app_commands.Choice(name="Chef", value="chief")])
+@app_commands.autocomplete(nom=clan_autocomplete)
+async def bulk_assign(ctx: discord.Interaction, nom: str, fichier: discord.Attachment, rang: str = "member"):
+    async with InteractionPipeline(ctx, "bulk_assign") as reply:
+        if await refuse_non_admin(reply):
+            return
+        if nom not in client.registry(ctx.guild):
+            embed = reply.messages.embed("bulk.assign_title", "clan_missing", color=ERROR, clan=nom)
+            await reply.send(embed=embed, delete_after=15)
+            return
+        try:
+            member_ids = parse_member_ids(await fichier.read())
+        except BulkFileError as e:
+            embed = reply.messages.embed("bulk.assign_title", e.key, color=ERROR, clan=nom, **e.values)
+            await reply.send(embed=embed, delete_after=15)
+            return
+        steps = [["assign", nom, user_id, rang] for user_id in member_ids]
+        await submit_bulk_job(reply, "assign", steps)
+
+
+@bulk.command(name="remove", description="Retirer tous les membres d'un fichier d'un clan")
+@app_commands.describe(
+    nom="Nom du clan",
+    fichier="Fichier avec un identifiant de membre par ligne",
+)
+@app_commands.autocomplete(nom=clan_autocomplete)
+async def bulk_remove(ctx: discord.Interaction, nom: str, fichier: discord.Attachment):
+    async with InteractionPipeline(ctx, "bulk_remove") as reply:
+        if await refuse_non_admin(reply):
+            return
+        if nom not in client.registry(ctx.guild):
+            embed = reply.messages.embed("bulk.remove_title", "clan_missing", color=ERROR, clan=nom)
+            await reply.send(embed=embed, delete_after=15)
+            return
+        try:
+            member_ids = parse_member_ids(await fichier.read())
+        except BulkFileError as e:
+            embed = reply.messages.embed("bulk.remove_title", e.key, color=ERROR, clan=nom, **e.values)
+            await reply.send(embed=embed, delete_after=15)
+            return
+        steps = [["remove", nom, user_id] for user_id in member_ids]
+        await submit_bulk_job(reply, "remove", steps)
+
+
+@bulk.command(name="status", description="Avancement des opérations de masse")
+@app_commands.describe(
+    tache="Identifiant de l'opération",
+)
+async def bulk_status(ctx: discord.Interaction, tache: str = None):
+    async with InteractionPipeline(ctx, "bulk_status") as reply:
+        if await refuse_non_admin(reply):
+            return
+        jobs = [client.jobs.get(tache)] if tache else list(client.jobs.jobs.values())[-10:]
+        jobs = [job for job in jobs if job is not None and job.guild_id == ctx.guild.id]
+        messages = reply.messages
+        if len(jobs) == 0:
+            await reply.send(embed=messages.embed("bulk.jobs_title", "bulk.no_job", color=SUCCESS), delete_after=60)
+            return
+        description = "\n".join(job_progress(messages, job) for job in jobs)
+        if tache and jobs[0].errors:
+            description += "\n\n" + messages.text("bulk.last_errors") + "\n" + "\n".join(job_error(messages, error) for error in jobs[0].errors[-5:])
+        embed = discord.Embed(title=messages.text("bulk.jobs_title"), description=description[:4096], color=SUCCESS)
+        await reply.send(embed=embed, delete_after=60)
+
+
+@bulk.command(name="resume", description="Reprendre une opération de masse en échec")
+@app_commands.describe(
+    tache="Identifiant de l'opération",
+)
+async def bulk_resume(ctx: discord.Interaction, tache: str):
+    async with InteractionPipeline(ctx, "bulk_resume") as reply:
+        if await refuse_non_admin(reply):
+            return
+        job = client.jobs.get(tache)
+        if job is None or job.guild_id != ctx.guild.id or job.status != "failed":
+            embed = reply.messages.embed("bulk.jobs_title", "bulk.not_failed", color=ERROR, job=tache)
+            await reply.send(embed=embed, delete_after=15)
+            return
+        await client.jobs.submit(job)
+        embed = reply.messages.embed("bulk.job_title", "bulk.resumed", color=SUCCESS, job=job.id,
+                                     progress=job_progress(reply.messages, job))
+        await reply.send(embed=embed, delete_after=15)
+
+
+tree.add_command(bulk, guild=guild)
 
 
 @tree.context_menu(name="Ajouter comme chef à un clan", guild=guild)
+@app_commands.guild_only()
 async def add_chief_menu(interaction: discord.Interaction, user: discord.Member):
-    # No bot user
-    if user.bot:
-        embed = discord.Embed(title="Ajouter " + user.name + " comme chef d'un clan",
-                              description="Vous ne pouvez pas ajouter un bot comme chef d'un clan", color=0xff0000)
-        await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-        return
+    async with InteractionPipeline(interaction, "add_chief_menu") as reply:
+        # No bot user
+        if user.bot:
+            embed = reply.messages.embed("add_chief.title", "add_chief.bot", color=ERROR, member=user.name)
+            await reply.send(embed=embed, delete_after=15)
+            return
 
-    targetted_member = user
-    origin_member = interaction.user
-    embed = discord.Embed(title="Ajouter " + targetted_member.name + " comme chef d'un clan",
-                            description="Dans quel clan voulez-vous ajouter " + targetted_member.name + " ?",
-                            color=0x00ff00)
-    await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15, view=AddChiefUI(targetted_member, origin_member))
+        targetted_member = user
+        origin_member = interaction.user
+        embed = reply.messages.embed("add_chief.title", "add_chief.pick", color=SUCCESS, member=targetted_member.name)
+        await reply.send(embed=embed, delete_after=15,
+                         view=AddChiefUI(targetted_member, origin_member, reply.messages))
 
 
 @tree.context_menu(name="Inviter ce membre à un clan", guild=guild)
+@app_commands.guild_only()
 async def add_member_menu(interaction: discord.Interaction, user: discord.Member):
-    # No bot user
-    if user.bot:
-        embed = discord.Embed(title="Inviter " + user.name + " dans un clan",
-                              description="Vous ne pouvez pas inviter un bot dans un clan", color=0xff0000)
-        await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-        return
-
-    targetted_member = user
-    origin_member = interaction.user
-
-    embed = discord.Embed(title="Inviter " + targetted_member.name + " dans un clan",
-                          description="Dans quel clan voulez-vous inviter " + targetted_member.name + " ?",
-                          color=0x00ff00)
-    await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15,
-                                            view=AddMemberUI(targetted_member, origin_member))
+    async with InteractionPipeline(interaction, "add_member_menu") as reply:
+        # No bot user
+        if user.bot:
+            embed = reply.messages.embed("add_member.title", "add_member.bot", color=ERROR, member=user.name)
+            await reply.send(embed=embed, delete_after=15)
+            return
+
+        targetted_member = user
+        origin_member = interaction.user
+
+        embed = reply.messages.embed("add_member.title", "add_member.pick", color=SUCCESS,
+                                     member=targetted_member.name)
+        await reply.send(embed=embed, delete_after=15,
+                         view=AddMemberUI(targetted_member, origin_member, reply.messages))
 
 # UIs
 
 
-class AddMemberUI(discord.ui.View):
-    def __init__(self, member: discord.Member, initiator: discord.Member):
+class ClanSearchModal(discord.ui.Modal):
+
+    def __init__(self, picker: "ClanPickerUI"):
+        super().__init__(title=picker.messages.text("picker.search_title"))
+        self.query = discord.ui.TextInput(label=picker.messages.text("picker.search_label"), required=False,
+                                          max_length=100)
+        self.add_item(self.query)
+        self.picker = picker
+
+    async def on_submit(self, interaction: discord.Interaction):
+        self.picker.query = self.query.value
+        self.picker.page = 0
+        self.picker.refresh()
+        await interaction.response.edit_message(view=self.picker)
+
+
+class ClanPickerUI(ClanBotView):
+    """Clan select split in pages of 25 clans, with a search by name prefix
+
+    When clans is None the choices come from the guild ClanRegistry index, so a
+    click only ever reads one page of it.
+    """
+
+    page_size = 25
+    select_cls = None
+
+    def __init__(self, member: discord.Member, initiator: discord.Member, messages: Messages, clans=None):
         super().__init__(timeout=60)
         self.member = member
         self.initiator = initiator
-        self.clans = []
-        for role in initiator.roles:
-            if role.name.startswith("Chef "):
-                self.clans.append(role.name[5:])
-        if len(self.clans) == 0:
-            self.add_item(discord.ui.Button(label="Vous n'êtes chef d'aucun clan", style=discord.ButtonStyle.danger,
-                                            disabled=True))
+        self.messages = messages
+        self.clans = sorted(clans, key=str.casefold) if clans is not None else None
+        self.query = ""
+        self.page = 0
+        self.refresh()
+
+    def search(self, offset: int, limit: int):
+        if self.clans is None:
+            return client.registry(self.initiator.guild).search(self.query, offset, limit)
+        query = self.query.casefold()
+        return [clan for clan in self.clans if clan.casefold().startswith(query)][offset:offset + limit]
+
+    def refresh(self):
+        self.clear_items()
+        # One extra name tells whether there is a next page
+        names = self.search(self.page * self.page_size, self.page_size + 1)
+        messages = self.messages
+        if len(names) == 0:
+            if self.page == 0 and self.query == "":
+                self.add_item(discord.ui.Button(label=messages.text("picker.not_chief"),
+                                                style=discord.ButtonStyle.danger, disabled=True))
+                return
+            self.add_item(discord.ui.Button(label=messages.text("picker.no_match"),
+                                            style=discord.ButtonStyle.danger, disabled=True))
         else:
-            self.add_item(ClanListInvite(options=[discord.SelectOption(label=clan) for clan in self.clans],
-                                   placeholder="Choisissez un clan", member=self.member, initiator=self.initiator))
+            self.add_item(self.select_cls(options=[discord.SelectOption(label=clan) for clan in names[:self.page_size]],
+                                          placeholder=messages.text("picker.placeholder"), member=self.member,
+                                          initiator=self.initiator))
 
+        previous_button = discord.ui.Button(label=messages.text("previous"), style=discord.ButtonStyle.secondary,
+                                            disabled=self.page == 0, row=1)
+        previous_button.callback = self.previous_page
+        self.add_item(previous_button)
+        next_button = discord.ui.Button(label=messages.text("next"), style=discord.ButtonStyle.secondary,
+                                        disabled=len(names) <= self.page_size, row=1)
+        next_button.callback = self.next_page
+        self.add_item(next_button)
+        search_button = discord.ui.Button(label=messages.text("search"), style=discord.ButtonStyle.primary, row=1)
+        search_button.callback = self.open_search
+        self.add_item(search_button)
 
-class AddChiefUI(discord.ui.View):
-    def __init__(self, member: discord.Member, initiator: discord.Member):
-        super().__init__(timeout=60)
-        self.member = member
-        self.initiator = initiator
-        self.clans = []
-        if not initiator.guild_permissions.administrator:
-            for role in initiator.roles:
-                if role.name.startswith("Chef "):
-                    self.clans.append(role.name[5:])
+    async def previous_page(self, interaction: discord.Interaction):
+        self.page = max(self.page - 1, 0)
+        self.refresh()
+        await interaction.response.edit_message(view=self)
+
+    async def next_page(self, interaction: discord.Interaction):
+        self.page += 1
+        self.refresh()
+        await interaction.response.edit_message(view=self)
+
+    async def open_search(self, interaction: discord.Interaction):
+        await interaction.response.send_modal(ClanSearchModal(self))
+
+
+def led_clans(member: discord.Member):
+    # The roles of the interaction are fresher than the store, and already at hand
+    return [name for name, rank in client.registry(member.guild).ranks_of(member.roles).items() if rank == "chief"]
+
+
+class AddMemberUI(ClanPickerUI):
+    def __init__(self, member: discord.Member, initiator: discord.Member, messages: Messages):
+        self.select_cls = ClanListInvite
+        super().__init__(member, initiator, messages, clans=led_clans(initiator))
+
+
+class AddChiefUI(ClanPickerUI):
+    def __init__(self, member: discord.Member, initiator: discord.Member, messages: Messages):
+        self.select_cls = ClanListChief
+        if not client.config(initiator.guild).can_manage(initiator):
+            super().__init__(member, initiator, messages, clans=led_clans(initiator))
         else:
-            for role in initiator.guild.roles:
-                if role.name.startswith("Chef "):
-                    self.clans.append(role.name[5:])
-        if len(self.clans) == 0:
-            self.add_item(discord.ui.Button(label="Vous n'êtes chef d'aucun clan", style=discord.ButtonStyle.danger,
-                                            disabled=True))
+            super().__init__(member, initiator, messages)
+
+
+class InviteButton(discord.ui.DynamicItem[discord.ui.Button],
+                   template=r"invite:(?P<action>accept|refuse):(?P<guild_id>[0-9]+):(?P<role_id>[0-9]+):"
+                            r"(?P<member_id>[0-9]+):(?P<expires>[0-9]+)"):
+    """Accept or refuse button of a clan invitation
+
+    The guild, the clan member role, the invitee and the expiry are carried by
+    the custom_id, so pending invitations take no memory and keep working after
+    a restart. Registered once with Client.add_dynamic_items.
+    """
+
+    def __init__(self, action: str, guild_id: int, role_id: int, member_id: int, expires: int,
+                 clan: Optional[str] = None, row: Optional[int] = None, messages: Messages = catalog.default):
+        # The clan is only named on the buttons of invitations to several clans
+        suffix = " " + clan if clan else ""
+        if action == "accept":
+            button = discord.ui.Button(label=(messages.text("invite.accept") + suffix)[:80],
+                                       style=discord.ButtonStyle.success, row=row)
         else:
-            self.add_item(ClanListChief(options=[discord.SelectOption(label=clan) for clan in self.clans],
-                                   placeholder="Choisissez un clan", member=self.member, initiator=self.initiator))
+            button = discord.ui.Button(label=(messages.text("invite.refuse") + suffix)[:80],
+                                       style=discord.ButtonStyle.danger, row=row)
+        button.custom_id = "invite:{0}:{1}:{2}:{3}:{4}".format(action, guild_id, role_id, member_id, expires)
+        super().__init__(button)
+        self.action = action
+        self.guild_id = guild_id
+        self.role_id = role_id
+        self.member_id = member_id
+        self.expires = expires
 
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match["action"], int(match["guild_id"]), int(match["role_id"]), int(match["member_id"]),
+                   int(match["expires"]))
 
-class JoinClanUI(discord.ui.View):
-    def __init__(self, member: discord.Member, clan: str):
-        super().__init__(timeout=60)
-        self.member = member
-        self.clan = clan
+    def other_invites(self, interaction: discord.Interaction, messages: Messages) -> Optional["JoinClanUI"]:
+        """Buttons of the other clans of a batched invitation, None when there are none"""
+        guild = client.get_guild(self.guild_id)
+        invites = []
+        for row in interaction.message.components if interaction.message is not None else []:
+            for child in getattr(row, "children", []):
+                parts = (child.custom_id or "").split(":")
+                if len(parts) == 6 and parts[0] == "invite" and parts[1] == "accept" and \
+                        int(parts[3]) != self.role_id:
+                    clan = client.registry(guild).clan_of(int(parts[3])) if guild is not None else None
+                    if clan is not None:
+                        invites.append((clan, int(parts[3])))
+        if len(invites) == 0:
+            return None
+        return JoinClanUI(self.guild_id, self.member_id, invites, self.expires, messages)
 
-    @discord.ui.button(label="Accepter", style=discord.ButtonStyle.success)
-    async def accept(self, interaction: discord.Interaction, button: discord.ui.Button):
-        try:
-            await interaction.response.send_message("Vous avez accepté l'invitation à rejoindre le clan " + self.clan + ".",
-                                                    ephemeral=True, delete_after=15)
-            await self.member.add_roles(discord.utils.get(self.member.guild.roles, name="Membre " + self.clan),
-                                        reason="Acceptation de l'invitation à rejoindre le clan " +
-                                               self.clan + " par " + self.member.name)
-            self.stop()
-        except discord.Forbidden as e:
-            await interaction.response.send_message("Je n'ai pas les permissions pour ajouter le rôle Membre " + self.clan + " à " + self.member.name + ".",
-                                                    ephemeral=True, delete_after=15)
-            self.stop()
-            logger.error("Permission error when adding role Membre " + self.clan + " to " + self.member.name)
-            logger.error("Stacktrace :")
-            logger.error(e)
-        except discord.HTTPException as e:
-            await interaction.response.send_message("Une erreur est survenue lors de l'ajout du rôle Membre " + self.clan + " à " + self.member.name + ".",
-                                                    ephemeral=True, delete_after=15)
-            self.stop()
-            logger.error("HTTP error when adding role Membre " + self.clan + " to " + self.member.name)
-            logger.error("Stacktrace :")
-            logger.error(e)
+    async def callback(self, interaction: discord.Interaction):
+        async with InteractionPipeline(interaction, "InviteButton.callback", update=True) as reply:
+            messages = reply.messages
+            guild = client.get_guild(self.guild_id)
+            clan = client.registry(guild).clan_of(self.role_id) if guild is not None else None
+            if clan is not None:
+                # Accepted, refused or expired, the clan can invite the member again
+                client.invitations.resolve(self.guild_id, clan, self.member_id)
+            others = self.other_invites(interaction, messages)
+            if time.time() > self.expires:
+                await reply.send(content=messages.text("invite.expired"), view=None)
+                return
+            if clan is None:
+                await reply.send(content=messages.text("invite.clan_gone"), view=others)
+                return
+            if self.action == "refuse":
+                client.journal.record("invite_refused", self.guild_id, clan, actor=self.member_id,
+                                      member=self.member_id)
+                await reply.send(content=messages.text("invite.refused", clan=clan), view=others)
+                return
+            try:
+                async with client.locks.hold("invite_accept", clan_key(guild.id, clan)):
+                    # The clan may have been deleted while waiting for the lock
+                    if client.registry(guild).clan_of(self.role_id) is None:
+                        await reply.send(content=messages.text("invite.clan_gone"), view=others)
+                        return
+                    member = await client.members.get(guild, self.member_id)
+                    await client.role_mutator.apply(member, add=[guild.get_role(self.role_id)],
+                                                    reason="Acceptation de l'invitation à rejoindre le clan " +
+                                                           clan + " par " + member.name)
+                    client.journal.record("invite_accepted", self.guild_id, clan, actor=self.member_id,
+                                          member=self.member_id)
+                await reply.send(content=messages.text("invite.accepted", clan=clan), view=others)
+            except discord.Forbidden as e:
+                role_name = client.config(guild).member_prefix + clan
+                await reply.send(content=messages.text("invite.role_forbidden", role=role_name,
+                                                       member=interaction.user.name), view=others)
+                logger.error("Permission error when adding role " + role_name + " to " + interaction.user.name)
+                logger.error("Stacktrace :")
+                logger.error(e)
+            except discord.HTTPException as e:
+                role_name = client.config(guild).member_prefix + clan
+                await reply.send(content=messages.text("invite.role_error", role=role_name,
+                                                       member=interaction.user.name), view=others)
+                logger.error("HTTP error when adding role " + role_name + " to " + interaction.user.name)
+                logger.error("Stacktrace :")
+                logger.error(e)
 
-    @discord.ui.button(label="Refuser", style=discord.ButtonStyle.danger)
-    async def refuse(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.send_message("Vous avez refusé l'invitation à rejoindre le clan " + self.clan + ".",
-                                                ephemeral=True, delete_after=15)
+
+class ClanListUI(ClanBotView):
+    """Pages of /clans, the embeds come from clan_list_embed"""
+
+    def __init__(self, guild: discord.Guild, messages: Messages):
+        super().__init__(timeout=120)
+        self.guild = guild
+        self.messages = messages
+        self.page = 0
+        self.embed = None
+        self.previous_button = discord.ui.Button(label=messages.text("previous"), style=discord.ButtonStyle.secondary)
+        self.previous_button.callback = self.previous_page
+        self.add_item(self.previous_button)
+        self.next_button = discord.ui.Button(label=messages.text("next"), style=discord.ButtonStyle.secondary)
+        self.next_button.callback = self.next_page
+        self.add_item(self.next_button)
+        self.refresh()
+
+    def refresh(self):
+        pages = max((len(client.roster(self.guild)) + CLANS_PAGE_SIZE - 1) // CLANS_PAGE_SIZE, 1)
+        self.page = min(self.page, pages - 1)
+        self.embed = clan_list_embed(self.guild, self.page, self.messages)
+        self.previous_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= pages - 1
+
+    async def previous_page(self, interaction: discord.Interaction):
+        self.page = max(self.page - 1, 0)
+        self.refresh()
+        await interaction.response.edit_message(embed=self.embed, view=self)
+
+    async def next_page(self, interaction: discord.Interaction):
+        self.page += 1
+        self.refresh()
+        await interaction.response.edit_message(embed=self.embed, view=self)
+
+
+class JoinClanUI(ClanBotView):
+    """Buttons of an invitation message, a row per (clan, member role id) invite, dispatched by InviteButton"""
+
+    def __init__(self, guild_id: int, member_id: int, invites, expires: int, messages: Messages):
+        super().__init__(timeout=None)
+        for row, (clan, role_id) in enumerate(invites):
+            name = clan if len(invites) > 1 else None
+            self.add_item(InviteButton("accept", guild_id, role_id, member_id, expires, name, row, messages))
+            self.add_item(InviteButton("refuse", guild_id, role_id, member_id, expires, name, row, messages))
+        # A finished view is not kept by the client once sent, InviteButton handles the clicks
         self.stop()
 
 
-class DeleteClanUI(discord.ui.View):
-    def __init__(self, name: str):
+class DeleteClanUI(ClanBotView):
+    def __init__(self, name: str, messages: Messages):
         super().__init__(timeout=60)
         self.name = name
+        self.accept.label = messages.text("yes")
+        self.refuse.label = messages.text("no")
 
     @discord.ui.button(label="Oui", style=discord.ButtonStyle.success)
     async def accept(self, interaction: discord.Interaction, button: discord.ui.Button):
-        try:
-            embed = discord.Embed(title="Suppression du clan " + self.name,
-                                  description="Le clan " + self.name + " a été supprimé.", color=0x00ff00)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            await interaction.guild.get_role(
-                discord.utils.get(interaction.guild.roles, name="Chef " + self.name).id).delete()
-            await interaction.guild.get_role(
-                discord.utils.get(interaction.guild.roles, name="Membre " + self.name).id).delete()
-            self.stop()
-        except discord.errors.Forbidden as e:
-            embed = discord.Embed(title="Suppression du clan " + self.name,
-                                  description="Je n'ai pas les permissions de faire cela", color=0xff0000)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            logger.error("Permission error while deleting clan " + self.name)
-            logger.error("Stacktrace :")
-            logger.error(e)
-            self.stop()
-        except discord.HTTPException as e:
-            embed = discord.Embed(title="Suppression du clan " + self.name,
-                                  description="Une erreur est survenue", color=0xff0000)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            logger.error("HTTP error while deleting clan " + self.name)
-            logger.error("Stacktrace :")
-            logger.error(e)
-            self.stop()
+        async with InteractionPipeline(interaction, "DeleteClanUI.accept") as reply:
+            try:
+                # A promotion or an invitation into the clan waits for the deletion, and finds no clan
+                async with client.locks.hold("delete_clan", clan_key(interaction.guild.id, self.name)):
+                    registry = client.registry(interaction.guild)
+                    clan = registry.get(self.name)
+                    if clan is not None:
+                        for role in clan.roles():
+                            await role.delete()
+                            registry.remove_role(role)
+                        await client.store_clan(interaction.guild, self.name)
+                        client.journal.record("delete", interaction.guild.id, self.name, actor=interaction.user.id)
+                embed = reply.messages.embed("delete_clan.title", "delete_clan.deleted", color=SUCCESS, clan=self.name)
+                await reply.send(embed=embed, delete_after=15)
+                self.stop()
+            except discord.errors.Forbidden as e:
+                embed = reply.messages.embed("delete_clan.title", "bot_forbidden", color=ERROR, clan=self.name)
+                await reply.send(embed=embed, delete_after=15)
+                logger.error("Permission error while deleting clan " + self.name)
+                logger.error("Stacktrace :")
+                logger.error(e)
+                self.stop()
+            except discord.HTTPException as e:
+                embed = reply.messages.embed("delete_clan.title", "error", color=ERROR, clan=self.name)
+                await reply.send(embed=embed, delete_after=15)
+                logger.error("HTTP error while deleting clan " + self.name)
+                logger.error("Stacktrace :")
+                logger.error(e)
+                self.stop()
 
     @discord.ui.button(label="Non", style=discord.ButtonStyle.danger)
     async def refuse(self, interaction: discord.Interaction, button: discord.ui.Button):
-        embed = discord.Embed(title="Suppression du clan " + self.name,
-                                description="Le clan " + self.name + " n'a pas été supprimé.", color=0xff0000)
-        await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-        self.stop()
+        async with InteractionPipeline(interaction, "DeleteClanUI.refuse") as reply:
+            embed = reply.messages.embed("delete_clan.title", "delete_clan.kept", color=ERROR, clan=self.name)
+            await reply.send(embed=embed, delete_after=15)
+            self.stop()
 
 
-class LeaveClanUI(discord.ui.View):
-    def __init__(self, name: str):
+class LeaveClanUI(ClanBotView):
+    def __init__(self, name: str, messages: Messages):
         super().__init__(timeout=60)
         self.name = name
+        self.accept.label = messages.text("yes")
+        self.refuse.label = messages.text("no")
 
     @discord.ui.button(label="Oui", style=discord.ButtonStyle.success)
     async def accept(self, interaction: discord.Interaction, button: discord.ui.Button):
-        try:
-            embed = discord.Embed(title="Quitter le clan " + self.name,
-                                    description="Vous avez quitté le clan " + self.name + ".", color=0x00ff00)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            await interaction.user.remove_roles(discord.utils.get(interaction.guild.roles, name="Membre " + self.name),
-                                                reason="Quitter le clan " + self.name)
-            await interaction.user.remove_roles(discord.utils.get(interaction.guild.roles, name="Chef " + self.name),
-                                                reason="Quitter le clan " + self.name)
-        except discord.errors.Forbidden as e:
-            embed = discord.Embed(title="Quitter le clan " + self.name,
-                                    description="Je n'ai pas les permissions de faire cela", color=0xff0000)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            logger.error("Permission error while leaving clan " + self.name)
-            logger.error("Stacktrace :")
-            logger.error(e)
-        except discord.errors.HTTPException as e:
-            embed = discord.Embed(title="Quitter le clan " + self.name,
-                                    description="Une erreur est survenue", color=0xff0000)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            logger.error("HTTP error while leaving clan " + self.name)
-            logger.error("Stacktrace :")
-            logger.error(e)
-        self.stop()
+        async with InteractionPipeline(interaction, "LeaveClanUI.accept") as reply:
+            try:
+                async with client.locks.hold("leave_clan", clan_key(interaction.guild.id, self.name)):
+                    clan = client.registry(interaction.guild).get(self.name)
+                    if clan is not None:
+                        await client.role_mutator.apply(interaction.user, remove=clan.roles(),
+                                                        reason="Quitter le clan " + self.name)
+                        client.journal.record("leave", interaction.guild.id, self.name, actor=interaction.user.id,
+                                              member=interaction.user.id)
+                embed = reply.messages.embed("leave_clan.title", "leave_clan.left", color=SUCCESS, clan=self.name)
+                await reply.send(embed=embed, delete_after=15)
+            except discord.errors.Forbidden as e:
+                embed = reply.messages.embed("leave_clan.title", "bot_forbidden", color=ERROR, clan=self.name)
+                await reply.send(embed=embed, delete_after=15)
+                logger.error("Permission error while leaving clan " + self.name)
+                logger.error("Stacktrace :")
+                logger.error(e)
+            except discord.errors.HTTPException as e:
+                embed = reply.messages.embed("leave_clan.title", "error", color=ERROR, clan=self.name)
+                await reply.send(embed=embed, delete_after=15)
+                logger.error("HTTP error while leaving clan " + self.name)
+                logger.error("Stacktrace :")
+                logger.error(e)
+            self.stop()
 
     @discord.ui.button(label="Non", style=discord.ButtonStyle.danger)
     async def refuse(self, interaction: discord.Interaction, button: discord.ui.Button):
-        embed = discord.Embed(title="Quitter le clan " + self.name,
-                                description="Vous n'avez pas quitté le clan " + self.name + ".", color=0xff0000)
-        await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-        self.stop()
+        async with InteractionPipeline(interaction, "LeaveClanUI.refuse") as reply:
+            embed = reply.messages.embed("leave_clan.title", "leave_clan.stayed", color=ERROR, clan=self.name)
+            await reply.send(embed=embed, delete_after=15)
+            self.stop()
 
 # Select menus for clan list
 
@@ -381,35 +1158,44 @@ class ClanListInvite(discord.ui.Select):
         self.initiator = initiator
 
     async def callback(self, interaction: discord.Interaction):
-        try:
-            # Checks if the user who is invited is not leader of the clan
-            if discord.utils.get(self.member.roles, name="Chef " + self.values[0]) is not None:
-                embed = discord.Embed(title="Invitation à rejoindre le clan " + self.values[0],
-                                        description="Ce membre est déjà chef du clan " + self.values[0] + ".", color=0xff0000)
-                await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-                return
-            embed = discord.Embed(title="Invitation à rejoindre le clan " + self.values[0],
-                                  description="Une invitation a été envoyée à " + self.member.name + " pour rejoindre le clan " +
-                                              self.values[0] + ". Elle expirera dans 60 secondes", color=0x00ff00)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            await self.member.send("Vous avez été invité à rejoindre le clan " + self.values[0] + " par " +
-                                   self.initiator.name + ".", view=JoinClanUI(self.member, self.values[0]), delete_after=60)
-        except discord.Forbidden as e:
-            embed = discord.Embed(title="Invitation à rejoindre le clan " + self.values[0],
-                                  description="Impossible d'envoyer un message privé à " + self.member.name + ".",
-                                  color=0xff0000)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            logger.error("Permission error when trying to send a private message to " + self.member.name + ".")
-            logger.error("Stacktrace :")
-            logger.error(e)
-        except discord.HTTPException as e:
-            embed = discord.Embed(title="Invitation à rejoindre le clan " + self.values[0],
-                                  description="Impossible d'envoyer un message privé à " + self.member.name + ".",
-                                  color=0xff0000)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            logger.error("HTTP error when trying to send a private message to " + self.member.name + ".")
-            logger.error("Stacktrace :")
-            logger.error(e)
+        async with InteractionPipeline(interaction, "ClanListInvite.callback") as reply:
+            messages = reply.messages
+            name = self.values[0]
+            try:
+                clan = client.registry(interaction.guild).get(name)
+                if clan is None or clan.member is None:
+                    await reply.send(embed=messages.embed("invite.title", "clan_missing", color=ERROR, clan=name),
+                                     delete_after=15)
+                    return
+                # Checks if the user who is invited is not leader of the clan
+                if clan.chief is not None and self.member.get_role(clan.chief.id) is not None:
+                    await reply.send(embed=messages.embed("invite.title", "already_chief", color=ERROR, clan=name),
+                                     delete_after=15)
+                    return
+                await client.invitations.invite(self.initiator, self.member, name, clan.member)
+                client.journal.record("invite_sent", interaction.guild.id, name, actor=self.initiator.id,
+                                      member=self.member.id)
+                embed = messages.embed("invite.title", "invite.sent", color=SUCCESS, clan=name, member=self.member.name,
+                                       ttl=INVITE_TTL)
+                await reply.send(embed=embed, delete_after=15)
+            except InviteRefused as e:
+                embed = messages.embed("invite.title", "invite." + e.reason, color=ERROR, clan=name,
+                                       member=self.member.name, delay=max(int(e.retry_after), 1))
+                await reply.send(embed=embed, delete_after=15)
+            except discord.Forbidden as e:
+                embed = messages.embed("invite.title", "invite.dm_failed", color=ERROR, clan=name,
+                                       member=self.member.name)
+                await reply.send(embed=embed, delete_after=15)
+                logger.error("Permission error when trying to send a private message to " + self.member.name + ".")
+                logger.error("Stacktrace :")
+                logger.error(e)
+            except discord.HTTPException as e:
+                embed = messages.embed("invite.title", "invite.dm_failed", color=ERROR, clan=name,
+                                       member=self.member.name)
+                await reply.send(embed=embed, delete_after=15)
+                logger.error("HTTP error when trying to send a private message to " + self.member.name + ".")
+                logger.error("Stacktrace :")
+                logger.error(e)
 
 
 class ClanListChief(discord.ui.Select):
@@ -420,49 +1206,78 @@ class ClanListChief(discord.ui.Select):
         self.initiator = initiator
 
     async def callback(self, interaction: discord.Interaction):
-        try:
-        # If the member is already chief of the clan
-            if discord.utils.get(self.member.roles, name="Chef " + self.values[0]) is not None:
-                embed = discord.Embed(title="Promotion dans le clan " + self.values[0],
-                                        description="Ce membre est déjà chef du clan " + self.values[0] + ".", color=0xff0000)
-                await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-                return
-            # If the member is already member of the clan then remove the member role and add the chief role
-            if discord.utils.get(self.member.roles, name="Membre " + self.values[0]) is not None:
-                await self.member.remove_roles(discord.utils.get(self.member.guild.roles, name="Membre " + self.values[0]),
-                                               reason="Promotion dans le clan " + self.values[0] + " par " +
-                                                      self.initiator.name)
-                await self.member.add_roles(discord.utils.get(self.member.guild.roles, name="Chef " + self.values[0]),
-                                            reason="Promotion dans le clan " + self.values[0] + " par " +
-                                                   self.initiator.name)
-                embed = discord.Embed(title="Promotion dans le clan " + self.values[0],
-                                      description=self.member.name + " a été promu chef du clan " + self.values[0] + ".",
-                                      color=0x00ff00)
-                await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-                return
-            # If the member is not member of the clan then add the chief role
-            await self.member.add_roles(discord.utils.get(self.member.guild.roles, name="Chef " + self.values[0]),
-                                        reason="Promotion dans le clan " + self.values[0] + " par " +   self.initiator.name)
-            embed = discord.Embed(title="Promotion dans le clan " + self.values[0],
-                                    description=self.member.name + " a été promu chef du clan " + self.values[0] + ".",
-                                    color=0x00ff00)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-        except discord.errors.Forbidden as e:
-            embed = discord.Embed(title="Promotion dans le clan " + self.values[0],
-                                  description="Je n'ai pas la permission de promouvoir " + self.member.name + " chef du clan " + self.values[0] + ".",
-                                  color=0xff0000)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            logger.error("Permission error when promoting " + self.member.name + " to chief of clan " + self.values[0] + ".")
-            logger.error("Stack trace : ")
-            logger.error(e)
-        except discord.errors.HTTPException as e:
-            embed = discord.Embed(title="Promotion dans le clan " + self.values[0],
-                                  description="Une erreur est survenue lors de la promotion de " + self.member.name + " chef du clan " + self.values[0] + ".",
-                                  color=0xff0000)
-            await interaction.response.send_message(embed=embed, ephemeral=True, delete_after=15)
-            logger.error("HTTP error when promoting " + self.member.name + " to chief of clan " + self.values[0] + ".")
-            logger.error("Stack trace : ")
-            logger.error(e)
+        async with InteractionPipeline(interaction, "ClanListChief.callback") as reply:
+            messages = reply.messages
+            name = self.values[0]
+            try:
+                # Serialized with the deletion of the clan, the role mutator orders the edits of the member
+                async with client.locks.hold("promote_chief", clan_key(self.member.guild.id, name)):
+                    clan = client.registry(self.member.guild).get(name)
+                    if clan is None or clan.chief is None:
+                        await reply.send(embed=messages.embed("promote.title", "clan_missing", color=ERROR, clan=name),
+                                         delete_after=15)
+                        return
+                    # If the member is already chief of the clan
+                    if clan.chief is not None and self.member.get_role(clan.chief.id) is not None:
+                        await reply.send(embed=messages.embed("promote.title", "already_chief", color=ERROR, clan=name),
+                                         delete_after=15)
+                        return
+                    # Add the chief role and remove the member role if the member has it, in one edit
+                    await client.role_mutator.apply(self.member, add=[clan.chief], remove=[clan.member],
+                                                    reason="Promotion dans le clan " + name + " par " +
+                                                           self.initiator.name)
+                    client.journal.record("promote", self.member.guild.id, name, actor=self.initiator.id,
+                                          member=self.member.id)
+                embed = messages.embed("promote.title", "promote.done", color=SUCCESS, clan=name, member=self.member.name)
+                await reply.send(embed=embed, delete_after=15)
+            except discord.errors.Forbidden as e:
+                embed = messages.embed("promote.title", "promote.forbidden", color=ERROR, clan=name,
+                                       member=self.member.name)
+                await reply.send(embed=embed, delete_after=15)
+                logger.error("Permission error when promoting " + self.member.name + " to chief of clan " + name + ".")
+                logger.error("Stack trace : ")
+                logger.error(e)
+            except discord.errors.HTTPException as e:
+                embed = messages.embed("promote.title", "promote.error", color=ERROR, clan=name, member=self.member.name)
+                await reply.send(embed=embed, delete_after=15)
+                logger.error("HTTP error when promoting " + self.member.name + " to chief of clan " + name + ".")
+                logger.error("Stack trace : ")
+                logger.error(e)
+
+
+def main():
+    setup_logging()
+    if not TOKEN:
+        logger.critical("TOKEN not found in .env, exiting...")
+        exit(1)
+    # A mistyped number would otherwise be ignored and the default used without a word
+    for name in ("GUILD_ID", "SHARD_COUNT", "DIAGNOSTICS_SLOW_MS", "INVITE_BATCH_MS"):
+        if os.environ.get(name, "").strip() and not os.environ[name].strip().isdigit():
+            logger.critical(name + " must be a whole number, exiting...")
+            exit(1)
+    if SHARD_COUNT == 0:
+        logger.critical("SHARD_COUNT must be at least 1, exiting...")
+        exit(1)
+    if os.environ.get("SHARD_IDS", "").strip() and \
+            not all(shard_id.strip().isdigit() for shard_id in os.environ["SHARD_IDS"].split(",")):
+        logger.critical("SHARD_IDS must be comma separated shard numbers, exiting...")
+        exit(1)
+    if SHARD_IDS is not None and SHARD_COUNT is None:
+        logger.critical("SHARD_IDS needs SHARD_COUNT, exiting...")
+        exit(1)
+    if SHARD_IDS is not None and max(SHARD_IDS) >= SHARD_COUNT:
+        logger.critical("SHARD_IDS must be below SHARD_COUNT, exiting...")
+        exit(1)
+    try:
+        client.configs = GuildConfigs.load(GUILDS_CONFIG)
+    except (OSError, ValueError) as e:
+        logger.critical("Invalid " + GUILDS_CONFIG + " : " + str(e) + ", exiting...")
+        exit(1)
+    if os.environ.get("METRICS_PORT") and METRICS_PORT is None:
+        logger.critical("METRICS_PORT must be a port number, exiting...")
+        exit(1)
+    client.run(TOKEN, log_handler=None)
 
 
-client.run(TOKEN, log_handler=None)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+import discord
+
+from atomic_files import write_atomic
+from locks import clan_key
+from rate_limit import RouteScheduler
+from role_mutations import FRESH_MEMBER
+
+logger = logging.getLogger('discord.clanbot.bulk')
+
+JOBS_DIR = "jobs"
+# (tokens per second, burst) per route and per guild. A window of T seconds
+# sees at most burst + rate * T calls, kept below the Discord limits.
+DEFAULT_LIMITS = {
+    "role_create": (0.2, 1),
+    "member_fetch": (4.5, 5),
+    "member_edit": (0.9, 1),
+}
+RETRIES = 3
+MAX_ERRORS = 50
+MAX_FINISHED_JOBS = 20
+CHECKPOINT_EVERY = 25
+
+RANKS = ("member", "chief")
+
+
+class BulkFileError(ValueError):
+    """Invalid import file, key is the catalog message explaining why and values its placeholders"""
+
+    def __init__(self, key: str, **values):
+        super().__init__(key)
+        self.key = key
+        self.values = values
+
+
+def _member_id(value) -> int:
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise BulkFileError("bulk.invalid_member_id", value=str(value))
+
+
+def parse_import(filename: str, data: bytes) -> List[list]:
+    """Steps creating the clans of an import file and assigning their members
+
+    JSON files use the export format, {"clans": [{"name", "chiefs", "members"}]}.
+    CSV files have a `clan,member_id,rank` header, rank being member or chief,
+    a row without member_id only creates the clan.
+    """
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise BulkFileError("bulk.not_utf8")
+    clans = OrderedDict()
+    if filename.lower().endswith(".json"):
+        try:
+            content = json.loads(text)
+            for clan in content["clans"]:
+                members = clans.setdefault(str(clan["name"]), [])
+                members.extend((_member_id(user_id), "chief") for user_id in clan.get("chiefs", []))
+                members.extend((_member_id(user_id), "member") for user_id in clan.get("members", []))
+        except (ValueError, KeyError, TypeError) as e:
+            if isinstance(e, BulkFileError):
+                raise
+            raise BulkFileError("bulk.invalid_json", error=str(e))
+    elif filename.lower().endswith(".csv"):
+        reader = csv.DictReader(io.StringIO(text))
+        if reader.fieldnames is None or "clan" not in reader.fieldnames:
+            raise BulkFileError("bulk.csv_columns")
+        for row in reader:
+            name = (row.get("clan") or "").strip()
+            if not name:
+                continue
+            members = clans.setdefault(name, [])
+            if (row.get("member_id") or "").strip():
+                rank = (row.get("rank") or "member").strip().lower()
+                if rank not in RANKS:
+                    raise BulkFileError("bulk.invalid_rank", rank=rank)
+                members.append((_member_id(row["member_id"]), rank))
+    else:
+        raise BulkFileError("bulk.file_type")
+
+    steps = [["create", name] for name in clans]
+    for name, members in clans.items():
+        steps.extend(["assign", name, user_id, rank] for user_id, rank in members)
+    return steps
+
+
+def parse_member_ids(data: bytes) -> List[int]:
+    """Member IDs of a file, the first column of each line"""
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise BulkFileError("bulk.not_utf8")
+    ids = []
+    for line in text.splitlines():
+        value = line.split(",")[0].strip()
+        if value and value.isdigit():
+            ids.append(int(value))
+    return ids
+
+
+def _describe(step: list) -> str:
+    return " ".join(str(part) for part in step)
+
+
+class BulkJob:
+    """A list of clan operations, executed in order and resumable from its cursor"""
+
+    def __init__(self, job_id: str, guild_id: int, author: str, kind: str, steps: List[list], cursor: int = 0,
+                 status: str = "queued", errors: Optional[list] = None, created_at: Optional[float] = None):
+        self.id = job_id
+        self.guild_id = guild_id
+        self.author = author
+        self.kind = kind
+        self.steps = steps
+        self.cursor = cursor
+        self.status = status
+        self.errors = errors if errors is not None else []
+        self.created_at = created_at if created_at is not None else time.time()
+
+    @classmethod
+    def new(cls, guild_id: int, author: str, kind: str, steps: List[list]) -> "BulkJob":
+        return cls(uuid.uuid4().hex[:8], guild_id, author, kind, steps)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "guild_id": self.guild_id, "author": self.author, "kind": self.kind,
+                "steps": self.steps, "cursor": self.cursor, "status": self.status, "errors": self.errors,
+                "created_at": self.created_at}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BulkJob":
+        return cls(data["id"], data["guild_id"], data["author"], data["kind"], data["steps"], data["cursor"],
+                   data["status"], data["errors"], data["created_at"])
+
+    def add_error(self, key: str, **values):
+        """Keep the catalog message of an error and its placeholders, rendered in the language of who reads it"""
+        self.errors.append([key, values])
+        del self.errors[:-MAX_ERRORS]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def progress(self) -> str:
+        return "{0} ({1}) : {2} - {3}/{4} opérations, {5} erreurs".format(
+            self.id, self.kind, self.status, self.cursor, len(self.steps), len(self.errors))
+
+
+class JobQueue:
+    """Runs bulk jobs one at a time in the background
+
+    REST calls go through a RouteScheduler so a job never exceeds the route
+    limits. Jobs are saved to JOBS_DIR as they progress: interrupted jobs are
+    queued again at startup and failed jobs can be resumed where they stopped.
+    When the shards are split over several processes sharing JOBS_DIR, each
+    process only loads the jobs of the guilds on its shards.
+    """
+
+    def __init__(self, client: discord.Client, limits=None, directory: str = JOBS_DIR):
+        self.client = client
+        self.scheduler = RouteScheduler(limits or DEFAULT_LIMITS)
+        self.directory = directory
+        self.jobs = OrderedDict()
+        self._queue = asyncio.Queue()
+        self._worker = None
+
+    def start(self):
+        if not os.path.exists(self.directory):
+            os.mkdir(self.directory)
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".json"):
+                continue
+            with open(os.path.join(self.directory, filename), encoding="utf-8") as f:
+                job = BulkJob.from_dict(json.load(f))
+            if not self._owns(job.guild_id):
+                continue
+            self.jobs[job.id] = job
+            if not job.finished:
+                logger.info("Resuming bulk job " + job.progress())
+                self._queue.put_nowait(job)
+        self._worker = asyncio.get_running_loop().create_task(self._run_forever())
+
+    def _owns(self, guild_id: int) -> bool:
+        """Whether the guild is on a shard of this process, see the Discord sharding formula"""
+        shard_ids = getattr(self.client, "shard_ids", None)
+        return shard_ids is None or (guild_id >> 22) % self.client.shard_count in shard_ids
+
+    def get(self, job_id: str) -> Optional[BulkJob]:
+        return self.jobs.get(job_id)
+
+    async def submit(self, job: BulkJob):
+        job.status = "queued"
+        self.jobs[job.id] = job
+        self.jobs.move_to_end(job.id)
+        await self._save(job)
+        self._queue.put_nowait(job)
+
+    async def _save(self, job: BulkJob):
+        path = os.path.join(self.directory, job.id + ".json")
+        data = json.dumps(job.to_dict())
+        await asyncio.to_thread(write_atomic, path, data)
+
+    async def _forget_old_jobs(self):
+        # Failed jobs too, the oldest ones are unlikely to be resumed
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            del self.jobs[job.id]
+            await asyncio.to_thread(os.remove, os.path.join(self.directory, job.id + ".json"))
+
+    async def _run_forever(self):
+        # Jobs need the guilds, which are only there once the client is ready
+        await self.client.wait_until_ready()
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except Exception as e:
+                job.status = "failed"
+                job.add_error("bulk.crashed", error=str(e))
+                logger.exception("Bulk job " + job.id + " crashed")
+            await self._save(job)
+            await self._forget_old_jobs()
+
+    async def _run(self, job: BulkJob):
+        guild = self.client.get_guild(job.guild_id)
+        if guild is None:
+            job.status = "failed"
+            job.add_error("bulk.guild_missing")
+            return
+        job.status = "running"
+        logger.info("Starting bulk job " + job.progress())
+        report_every = max(len(job.steps) // 10, 1)
+        while job.cursor < len(job.steps):
+            step = job.steps[job.cursor]
+            for attempt in range(RETRIES + 1):
+                try:
+                    await self._step(guild, job, step)
+                    break
+                except (discord.NotFound, discord.Forbidden) as e:
+                    # Not worth retrying: the member left or the role is above the bot
+                    job.add_error("bulk.step_failed", step=_describe(step), error=str(e))
+                    break
+                except (discord.HTTPException, OSError, asyncio.TimeoutError) as e:
+                    if attempt == RETRIES:
+                        job.status = "failed"
+                        job.add_error("bulk.step_failed", step=_describe(step), error=str(e))
+                        logger.error("Bulk job " + job.id + " failed, it can be resumed : " + job.progress())
+                        return
+                    await asyncio.sleep(2 ** attempt)
+            job.cursor += 1
+            if job.cursor % CHECKPOINT_EVERY == 0:
+                await self._save(job)
+            if job.cursor % report_every == 0:
+                logger.info("Bulk job " + job.progress())
+        job.status = "done"
+        logger.info("Finished bulk job " + job.progress())
+
+    async def _member(self, guild: discord.Guild, user_id: int, max_age: Optional[float] = None) -> discord.Member:
+        if self.client.members.get_cached(guild, user_id, max_age) is None:
+            await self.scheduler.acquire("member_fetch", guild.id)
+        return await self.client.members.get(guild, user_id, max_age)
+
+    async def _step(self, guild: discord.Guild, job: BulkJob, step: list):
+        # Each step holds the lock of its clan, like the commands touching it
+        async with self.client.locks.hold("bulk_" + step[0], clan_key(guild.id, step[1])):
+            await self._apply_step(guild, job, step)
+
+    async def _apply_step(self, guild: discord.Guild, job: BulkJob, step: list):
+        registry = self.client.registry(guild)
+        reason = "Opération de masse " + job.id + " par " + job.author
+        if step[0] == "create":
+            name = step[1]
+            created = name not in registry
+            for prefix, role in ((registry.member_prefix, registry.member_role(name)),
+                                 (registry.chief_prefix, registry.chief_role(name))):
+                if role is None:
+                    await self.scheduler.acquire("role_create", guild.id)
+                    registry.add_role(await guild.create_role(name=prefix + name, mentionable=False, hoist=False,
+                                                              reason=reason))
+            if created:
+                self.client.journal.record("create", guild.id, name, job=job.id)
+            return
+
+        clan = registry.get(step[1])
+        if clan is None or clan.member is None:
+            job.add_error("bulk.step_clan_missing", step=_describe(step))
+            return
+        member = await self._member(guild, step[2])
+        if step[0] == "assign" and step[3] == "chief":
+            if clan.chief is None:
+                # Removing the member role alone would leave the member out of the clan
+                job.add_error("bulk.step_no_chief_role", step=_describe(step))
+                return
+            add, remove = [clan.chief], [clan.member]
+        elif step[0] == "assign":
+            if clan.chief is not None and member.get_role(clan.chief.id) is not None:
+                return
+            add, remove = [clan.member], []
+        else:
+            add, remove = [], clan.roles()
+        if not any(role is not None and member.get_role(role.id) is None for role in add) and \
+                not any(member.get_role(role.id) is not None for role in remove):
+            return
+        await self.scheduler.acquire("member_edit", guild.id)
+        # Fetched again after waiting for the limit, here so that the fetch of the RoleMutator is paced too
+        member = await self._member(guild, step[2], FRESH_MEMBER)
+        await self.client.role_mutator.apply(member, add=add, remove=remove, reason=reason)
+        event = "leave" if step[0] == "remove" else "promote" if step[3] == "chief" else "join"
+        self.client.journal.record(event, guild.id, step[1], member=member.id, job=job.id)
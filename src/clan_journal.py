@@ -0,0 +1,308 @@
+"""Append-only journal of the clan events, and the tool rebuilding clan statistics from it
+
+Replay with `python3 src/clan_journal.py [--guild ID] [--clan NAME] [--json]`
+"""
+import argparse
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import metrics
+from atomic_files import open_atomic
+
+logger = logging.getLogger('discord.clanbot.journal')
+
+JOURNAL_PATH = "data/journal/clans.jsonl"
+
+# Kinds of events, the member of join, promote and leave is the user id whose roles changed
+EVENTS = ("create", "delete", "invite_sent", "invite_accepted", "invite_refused", "join", "promote", "leave")
+
+# -<date>-<time>[-<n>].jsonl[.gz] suffix of the rotated files
+_ROTATED = re.compile(r"-(\d{8}-\d{6})(?:-(\d+))?\.jsonl(\.gz)?$")
+
+
+class ClanJournal:
+    """JSON lines journal of the clan events, one {"ts", "event", "guild", "clan", ...} object per line
+
+    record() only appends the event to a buffer. A background task hands the
+    buffer to a worker thread every flush_interval seconds, or as soon as
+    max_batch events wait, so the event loop never waits on the disk. Once the
+    file passes max_bytes it is renamed with the date and gzipped by the same
+    thread. Past max_pending buffered events, when the disk is failing, new
+    events are dropped and counted. Processes sharing the journal all append to
+    it but only the one created with rotate rotates and compresses it.
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH, flush_interval: float = 1.0, max_batch: int = 500,
+                 max_bytes: int = 16 * 1024 * 1024, max_pending: int = 100_000, rotate: bool = True):
+        self.path = path
+        self.rotate = rotate
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending: List[dict] = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clan-journal")
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._wake = asyncio.Event()
+        if self.rotate:
+            # Files left uncompressed by a crash during a rotation
+            self._executor.submit(self._compress_leftovers)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+    def record(self, event: str, guild_id: int, clan: str, actor: Optional[int] = None,
+               member: Optional[int] = None, **fields):
+        """Journal an event, actor being the user id behind it and member the user id it is about"""
+        if len(self._pending) >= self.max_pending:
+            if self.dropped == 0:
+                logger.error("Clan journal buffer full, dropping events")
+            self.dropped += 1
+            metrics.journal_dropped.inc()
+            return
+        entry = {"ts": round(time.time(), 3), "event": event, "guild": guild_id, "clan": clan}
+        if actor is not None:
+            entry["actor"] = actor
+        if member is not None:
+            entry["member"] = member
+        entry.update(fields)
+        self._pending.append(entry)
+        metrics.journal_events.inc(event)
+        if len(self._pending) >= self.max_batch and self._wake is not None:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write the buffered events"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write, batch)
+        except OSError as e:
+            # Kept for the next flush, in front of the newer events
+            self._pending[:0] = batch[-self.max_pending:]
+            logger.error("Error while writing the clan journal")
+            logger.error("Stacktrace :")
+            logger.error(e)
+
+    def _write(self, batch: List[dict]):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        data = "".join(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n" for entry in batch)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(data)
+            size = file.tell()
+        if self.rotate and size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        base = self.path[:-len(".jsonl")] if self.path.endswith(".jsonl") else self.path
+        rotated = base + time.strftime("-%Y%m%d-%H%M%S") + ".jsonl"
+        number = 0
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            number += 1
+            rotated = base + time.strftime("-%Y%m%d-%H%M%S") + "-" + str(number) + ".jsonl"
+        os.replace(self.path, rotated)
+        _compress(rotated)
+        logger.info("Clan journal rotated to " + rotated + ".gz")
+
+    def _compress_leftovers(self):
+        for path in journal_files(self.path):
+            if path.endswith(".jsonl") and path != self.path:
+                _compress(path)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+def _compress(path: str):
+    with open(path, "rb") as source, open_atomic(path + ".gz", "wb") as archive, \
+            gzip.GzipFile(path + ".gz", "wb", fileobj=archive) as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    os.remove(path)
+
+
+def journal_files(path: str = JOURNAL_PATH) -> List[str]:
+    """Files of the journal, oldest first: the rotated ones then the current one"""
+    directory = os.path.dirname(path) or "."
+    base = os.path.basename(path)
+    base = base[:-len(".jsonl")] if base.endswith(".jsonl") else base
+    rotated: List[Tuple[str, int, str]] = []
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            match = _ROTATED.search(filename)
+            if match is not None and filename[:match.start()] == base:
+                rotated.append((match[1], int(match[2] or 0), os.path.join(directory, filename)))
+    files = [filename for _, _, filename in sorted(rotated)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_events(path: str = JOURNAL_PATH, guild_id: Optional[int] = None) -> Iterator[dict]:
+    """Events of the journal in order, read line by line, optionally of one guild only"""
+    # Lines of other guilds are skipped before being parsed
+    needle = '"guild":{0},'.format(guild_id) if guild_id is not None else None
+    # raw_decode skips the checks of json.loads, the lines are written without surrounding whitespace
+    decode = json.JSONDecoder().raw_decode
+    for filename in journal_files(path):
+        if filename.endswith(".gz"):
+            file = io.TextIOWrapper(gzip.open(filename, "rb"), encoding="utf-8")
+        else:
+            file = open(filename, encoding="utf-8")
+        with file:
+            for line in file:
+                if needle is not None and needle not in line:
+                    continue
+                try:
+                    yield decode(line)[0]
+                except ValueError:
+                    # Last line of a journal cut by a crash
+                    continue
+
+
+class ClanStats:
+    """History of one clan, rebuilt from its events"""
+
+    __slots__ = ("guild", "name", "created_at", "created_by", "deleted_at", "invites_sent", "invites_accepted",
+                 "invites_refused", "joins", "promotions", "leaves", "members", "chiefs")
+
+    def __init__(self, guild: int, name: str):
+        self.guild = guild
+        self.name = name
+        self.created_at: Optional[float] = None
+        self.created_by: Optional[int] = None
+        self.deleted_at: Optional[float] = None
+        self.invites_sent = 0
+        self.invites_accepted = 0
+        self.invites_refused = 0
+        self.joins = 0
+        self.promotions = 0
+        self.leaves = 0
+        self.members: Set[int] = set()
+        self.chiefs: Set[int] = set()
+
+    def apply(self, event: dict):
+        kind = event["event"]
+        member = event.get("member")
+        if kind == "create":
+            # A clan created again after its deletion starts empty
+            self.created_at = event["ts"]
+            self.created_by = event.get("actor")
+            self.deleted_at = None
+            self.members.clear()
+            self.chiefs.clear()
+        elif kind == "delete":
+            self.deleted_at = event["ts"]
+            self.members.clear()
+            self.chiefs.clear()
+        elif kind == "invite_sent":
+            self.invites_sent += 1
+        elif kind == "invite_refused":
+            self.invites_refused += 1
+        elif kind in ("invite_accepted", "join"):
+            if kind == "invite_accepted":
+                self.invites_accepted += 1
+            self.joins += 1
+            if member not in self.chiefs:
+                self.members.add(member)
+        elif kind == "promote":
+            self.promotions += 1
+            self.members.discard(member)
+            self.chiefs.add(member)
+        elif kind == "leave":
+            self.leaves += 1
+            self.members.discard(member)
+            self.chiefs.discard(member)
+
+    def to_dict(self) -> dict:
+        return {"guild": self.guild, "clan": self.name, "created_at": self.created_at, "created_by": self.created_by,
+                "deleted_at": self.deleted_at, "invites_sent": self.invites_sent,
+                "invites_accepted": self.invites_accepted, "invites_refused": self.invites_refused,
+                "joins": self.joins, "promotions": self.promotions, "leaves": self.leaves,
+                "members": len(self.members), "chiefs": len(self.chiefs)}
+
+
+def replay(events, clan: Optional[str] = None) -> Dict[Tuple[int, str], ClanStats]:
+    """Statistics of every clan of events, or of one clan, by (guild id, clan name)"""
+    stats: Dict[Tuple[int, str], ClanStats] = {}
+    for event in events:
+        if clan is not None and event["clan"] != clan:
+            continue
+        key = (event["guild"], event["clan"])
+        entry = stats.get(key)
+        if entry is None:
+            entry = stats[key] = ClanStats(*key)
+        entry.apply(event)
+    return stats
+
+
+def _date(timestamp: Optional[float]) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the clan statistics from the clan journal")
+    parser.add_argument("--path", default=JOURNAL_PATH, help="current journal file, the rotated ones are found next to it")
+    parser.add_argument("--guild", type=int, help="only this guild")
+    parser.add_argument("--clan", help="only this clan")
+    parser.add_argument("--json", action="store_true", help="one JSON object per clan")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = 0
+
+    def counted(events):
+        nonlocal count
+        for event in events:
+            count += 1
+            yield event
+
+    stats = replay(counted(read_events(args.path, args.guild)), args.clan)
+    elapsed = time.perf_counter() - start
+    ordered = sorted(stats.values(), key=lambda entry: (entry.guild, entry.name.casefold()))
+    if args.json:
+        for entry in ordered:
+            print(json.dumps(entry.to_dict(), ensure_ascii=False))
+    else:
+        print("{0:<24} {1:<17} {2:<17} {3:>6} {4:>6} {5:>6} {6:>6} {7:>6} {8:>6} {9:>8} {10:>6}".format(
+            "clan", "created", "deleted", "sent", "accept", "refuse", "joined", "promo", "left", "members", "chiefs"))
+        for entry in ordered:
+            print("{0:<24} {1:<17} {2:<17} {3:>6} {4:>6} {5:>6} {6:>6} {7:>6} {8:>6} {9:>8} {10:>6}".format(
+                entry.name[:24], _date(entry.created_at), _date(entry.deleted_at), entry.invites_sent,
+                entry.invites_accepted, entry.invites_refused, entry.joins, entry.promotions, entry.leaves,
+                len(entry.members), len(entry.chiefs)))
+    print("{0} events, {1} clans in {2:.2f}s".format(count, len(stats), elapsed), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
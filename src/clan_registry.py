@@ -0,0 +1,151 @@
+from bisect import bisect_left, insort
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import discord
+
+MEMBER_PREFIX = "Membre "
+CHIEF_PREFIX = "Chef "
+
+
+class ClanRoles:
+    """Member and chief roles of a clan, either may be missing
+
+    A guild can hold several roles of the same name (two "Membre X"): they are
+    all kept, member and chief being the first one seen of each kind, so that
+    deleting it falls back to the next one.
+    """
+
+    __slots__ = ("name", "member_roles", "chief_roles")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.member_roles: List["discord.Role"] = []
+        self.chief_roles: List["discord.Role"] = []
+
+    @property
+    def member(self) -> Optional["discord.Role"]:
+        return self.member_roles[0] if self.member_roles else None
+
+    @property
+    def chief(self) -> Optional["discord.Role"]:
+        return self.chief_roles[0] if self.chief_roles else None
+
+    def roles(self):
+        """Every role of the clan, duplicates included"""
+        return self.member_roles + self.chief_roles
+
+
+class ClanRegistry:
+    """Index of the clans of a guild, keyed by clan name
+
+    Built once from the guild roles, then kept up to date from the role events
+    so that commands never have to walk the whole role list. Clan names are also
+    kept sorted (case-insensitively) for prefix searches.
+    """
+
+    def __init__(self, member_prefix: str = MEMBER_PREFIX, chief_prefix: str = CHIEF_PREFIX):
+        self.member_prefix = member_prefix
+        self.chief_prefix = chief_prefix
+        self._clans: Dict[str, ClanRoles] = {}
+        # role id -> (clan name, "member" or "chief")
+        self._roles: Dict[int, Tuple[str, str]] = {}
+        self._index: List[Tuple[str, str]] = []
+
+    def build(self, roles: Iterable["discord.Role"]):
+        self._clans.clear()
+        self._roles.clear()
+        self._index.clear()
+        for role in roles:
+            self.add_role(role)
+
+    def _parse(self, role_name: str):
+        if role_name.startswith(self.member_prefix):
+            return role_name[len(self.member_prefix):], "member"
+        if role_name.startswith(self.chief_prefix):
+            return role_name[len(self.chief_prefix):], "chief"
+        return None, None
+
+    def add_role(self, role: "discord.Role"):
+        name, kind = self._parse(role.name)
+        if name is None or role.id in self._roles:
+            return
+        clan = self._clans.get(name)
+        if clan is None:
+            clan = self._clans[name] = ClanRoles(name)
+            insort(self._index, (name.casefold(), name))
+        # Appended, the first role seen stays the one used, like discord.utils.get would on duplicates
+        (clan.chief_roles if kind == "chief" else clan.member_roles).append(role)
+        self._roles[role.id] = (name, kind)
+
+    def remove_role(self, role: "discord.Role"):
+        entry = self._roles.pop(role.id, None)
+        if entry is None:
+            return
+        name, kind = entry
+        clan = self._clans[name]
+        roles = clan.chief_roles if kind == "chief" else clan.member_roles
+        roles[:] = [other for other in roles if other.id != role.id]
+        if not clan.member_roles and not clan.chief_roles:
+            del self._clans[name]
+            del self._index[bisect_left(self._index, (name.casefold(), name))]
+
+    def update_role(self, before: "discord.Role", after: "discord.Role"):
+        self.remove_role(before)
+        self.add_role(after)
+
+    def get(self, name: str) -> Optional[ClanRoles]:
+        return self._clans.get(name)
+
+    def member_role(self, name: str) -> Optional["discord.Role"]:
+        clan = self._clans.get(name)
+        return clan.member if clan is not None else None
+
+    def chief_role(self, name: str) -> Optional["discord.Role"]:
+        clan = self._clans.get(name)
+        return clan.chief if clan is not None else None
+
+    def clan_of(self, role_id: int) -> Optional[str]:
+        entry = self._roles.get(role_id)
+        return entry[0] if entry is not None else None
+
+    def ranks_of(self, roles: Iterable["discord.Role"]) -> Dict[str, str]:
+        """Clans of a member holding roles, clan name -> "member" or "chief"
+
+        A member holding both roles of a clan is its chief.
+        """
+        ranks = {}
+        for role in roles:
+            entry = self._roles.get(role.id)
+            if entry is None:
+                continue
+            name, kind = entry
+            if kind == "chief":
+                ranks[name] = "chief"
+            else:
+                ranks.setdefault(name, "member")
+        return ranks
+
+    def _prefix_range(self, prefix: str) -> Tuple[int, int]:
+        key = prefix.casefold()
+        return bisect_left(self._index, (key,)), bisect_left(self._index, (key + "\U0010ffff",))
+
+    def search(self, prefix: str = "", offset: int = 0, limit: int = 25) -> List[str]:
+        """Clan names starting with prefix, sorted, from offset to offset + limit"""
+        start, end = self._prefix_range(prefix)
+        start = min(start + offset, end)
+        return [name for _, name in self._index[start:min(start + limit, end)]]
+
+    def count(self, prefix: str = "") -> int:
+        start, end = self._prefix_range(prefix)
+        return end - start
+
+    def __contains__(self, name: str) -> bool:
+        # A clan exists as long as its member role exists
+        return self.member_role(name) is not None
+
+    def __iter__(self):
+        return iter(list(self._clans.values()))
+
+    def __len__(self) -> int:
+        return len(self._clans)
@@ -0,0 +1,148 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+
+class ClanRoster:
+    """Members and chiefs of every clan of a guild, kept up to date incrementally
+
+    Fed with the same membership changes as the ClanStore: set_member() diffs
+    the new clans of a member against the previous ones, so counts are never
+    recomputed by walking the members. Clans are also kept ranked by size, and
+    each clan has a version bumped on every change, for the caches.
+
+    The roster is seeded from the store once the guild is reconciled; members
+    set before that keep their fresher clans.
+    """
+
+    def __init__(self):
+        self.members: Dict[str, Set[int]] = {}
+        self.chiefs: Dict[str, Set[int]] = {}
+        self._versions: Dict[str, int] = {}
+        # user id -> clan name -> rank
+        self._ranks: Dict[int, Dict[str, str]] = {}
+        # (-size, casefolded name, name), biggest clans first
+        self._ranking: List[Tuple[int, str, str]] = []
+        self.seeded = False
+        self._fresh: Set[int] = set()
+
+    def _key(self, name: str) -> Tuple[int, str, str]:
+        return -(len(self.members[name]) + len(self.chiefs[name])), name.casefold(), name
+
+    def _unrank(self, name: str):
+        del self._ranking[bisect_left(self._ranking, self._key(name))]
+
+    def add_clan(self, name: str):
+        if name not in self.members:
+            self.members[name] = set()
+            self.chiefs[name] = set()
+            self._versions[name] = 0
+            insort(self._ranking, self._key(name))
+
+    def remove_clan(self, name: str):
+        if name not in self.members:
+            return
+        self._unrank(name)
+        for user_id in self.members.pop(name) | self.chiefs.pop(name):
+            ranks = self._ranks[user_id]
+            del ranks[name]
+            if not ranks:
+                del self._ranks[user_id]
+        del self._versions[name]
+
+    def touch(self, name: str):
+        """Mark a clan as changed, e.g. when its details change in the store"""
+        if name in self._versions:
+            self._versions[name] += 1
+
+    def set_member(self, user_id: int, ranks: Dict[str, str]):
+        """Replace the clans of a member by ranks, clan name -> "member" or "chief\""""
+        if not self.seeded:
+            self._fresh.add(user_id)
+        previous = self._ranks.get(user_id, {})
+        if previous == ranks:
+            return
+        for name in set(previous) | set(ranks):
+            before, after = previous.get(name), ranks.get(name)
+            if before == after:
+                continue
+            self.add_clan(name)
+            self._unrank(name)
+            if before is not None:
+                (self.chiefs if before == "chief" else self.members)[name].discard(user_id)
+            if after is not None:
+                (self.chiefs if after == "chief" else self.members)[name].add(user_id)
+            insort(self._ranking, self._key(name))
+            self._versions[name] += 1
+        if ranks:
+            self._ranks[user_id] = dict(ranks)
+        else:
+            self._ranks.pop(user_id, None)
+
+    def remove_member(self, user_id: int):
+        self.set_member(user_id, {})
+
+    def seed(self, clans: Iterable[str], memberships: Iterable[Tuple[int, str, str]]):
+        """Load the clans and the stored (user_id, clan, rank) memberships"""
+        for name in clans:
+            self.add_clan(name)
+        ranks: Dict[int, Dict[str, str]] = {}
+        for user_id, name, rank in memberships:
+            if user_id not in self._fresh and name in self.members:
+                ranks.setdefault(user_id, {})[name] = rank
+        for user_id, member_ranks in ranks.items():
+            self.set_member(user_id, member_ranks)
+        self._fresh.clear()
+        self.seeded = True
+
+    def counts(self, name: str) -> Tuple[int, int]:
+        """(members, chiefs) of a clan"""
+        if name not in self.members:
+            return 0, 0
+        return len(self.members[name]), len(self.chiefs[name])
+
+    def version(self, name: str) -> int:
+        return self._versions.get(name, -1)
+
+    def ranked(self, offset: int = 0, limit: int = 25) -> List[str]:
+        """Clan names by decreasing size, from offset to offset + limit"""
+        return [name for _, _, name in self._ranking[offset:offset + limit]]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.members
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+
+class EmbedCache:
+    """Rendered embeds by key, valid as long as their stamp is unchanged
+
+    The stamp is built from the versions of what the embed shows, so an entry
+    is only rendered again when one of its clans changed. Least recently used
+    entries are dropped past maxsize.
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, stamp: Hashable) -> Optional[object]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != stamp:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, stamp: Hashable, value: object):
+        self._entries[key] = (stamp, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
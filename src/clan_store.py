@@ -0,0 +1,179 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+STORE_PATH = "data/clans.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clans (
+    guild_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    member_role_id INTEGER,
+    chief_role_id INTEGER,
+    created_at REAL NOT NULL,
+    created_by TEXT,
+    PRIMARY KEY (guild_id, name)
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    clan TEXT NOT NULL,
+    rank TEXT NOT NULL,
+    PRIMARY KEY (guild_id, user_id, clan)
+);
+CREATE INDEX IF NOT EXISTS memberships_by_clan ON memberships (guild_id, clan, rank);
+"""
+
+# Milliseconds of the first second of 2015, where the Discord snowflake timestamps start
+DISCORD_EPOCH = 1420070400000
+
+
+def _created_at(member_role_id: Optional[int], chief_role_id: Optional[int]) -> float:
+    """Creation time of the oldest role of a clan, from its snowflake, so clans older than the store keep their date"""
+    role_ids = [role_id for role_id in (member_role_id, chief_role_id) if role_id is not None]
+    if not role_ids:
+        return time.time()
+    return ((min(role_ids) >> 22) + DISCORD_EPOCH) / 1000
+
+
+class ClanStore:
+    """SQLite store of the clans, their roles, leaders and members
+
+    The database is in WAL mode and only used from one worker thread, every
+    method is a coroutine that never blocks the event loop. Ranks are "member"
+    or "chief".
+    """
+
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clan-store")
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _run(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    async def open(self):
+        await self._run(self._open)
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
+
+    # Clans
+
+    def _upsert_clan(self, guild_id, name, member_role_id, chief_role_id):
+        self._db.execute("INSERT INTO clans (guild_id, name, member_role_id, chief_role_id, created_at) "
+                         "VALUES (?, ?, ?, ?, ?) ON CONFLICT (guild_id, name) DO UPDATE SET "
+                         "member_role_id = excluded.member_role_id, chief_role_id = excluded.chief_role_id, "
+                         "created_at = MIN(created_at, excluded.created_at)",
+                         (guild_id, name, member_role_id, chief_role_id, _created_at(member_role_id, chief_role_id)))
+        self._db.commit()
+
+    async def upsert_clan(self, guild_id: int, name: str, member_role_id: Optional[int], chief_role_id: Optional[int]):
+        await self._run(self._upsert_clan, guild_id, name, member_role_id, chief_role_id)
+
+    def _set_creator(self, guild_id, name, created_by):
+        self._db.execute("UPDATE clans SET created_by = ? WHERE guild_id = ? AND name = ?", (created_by, guild_id, name))
+        self._db.commit()
+
+    async def set_creator(self, guild_id: int, name: str, created_by: str):
+        await self._run(self._set_creator, guild_id, name, created_by)
+
+    def _delete_clan(self, guild_id, name):
+        self._db.execute("DELETE FROM clans WHERE guild_id = ? AND name = ?", (guild_id, name))
+        self._db.execute("DELETE FROM memberships WHERE guild_id = ? AND clan = ?", (guild_id, name))
+        self._db.commit()
+
+    async def delete_clan(self, guild_id: int, name: str):
+        await self._run(self._delete_clan, guild_id, name)
+
+    def _clan(self, guild_id, name):
+        return self._db.execute("SELECT name, member_role_id, chief_role_id, created_at, created_by FROM clans "
+                                "WHERE guild_id = ? AND name = ?", (guild_id, name)).fetchone()
+
+    async def clan(self, guild_id: int, name: str) -> Optional[tuple]:
+        """(name, member_role_id, chief_role_id, created_at, created_by) of a clan"""
+        return await self._run(self._clan, guild_id, name)
+
+    # Memberships
+
+    def _set_member_clans(self, guild_id, user_id, ranks):
+        self._db.execute("DELETE FROM memberships WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+        self._db.executemany("INSERT INTO memberships (guild_id, user_id, clan, rank) VALUES (?, ?, ?, ?)",
+                             [(guild_id, user_id, clan, rank) for clan, rank in ranks.items()])
+        self._db.commit()
+
+    async def set_member_clans(self, guild_id: int, user_id: int, ranks: Dict[str, str]):
+        """Replace the clans of a member by ranks, clan name -> rank"""
+        await self._run(self._set_member_clans, guild_id, user_id, ranks)
+
+    async def remove_member(self, guild_id: int, user_id: int):
+        await self._run(self._set_member_clans, guild_id, user_id, {})
+
+    def _memberships(self, guild_id):
+        return self._db.execute("SELECT user_id, clan, rank FROM memberships WHERE guild_id = ?", (guild_id,)).fetchall()
+
+    async def memberships(self, guild_id: int) -> List[Tuple[int, str, str]]:
+        """(user_id, clan, rank) of every stored membership of a guild"""
+        return await self._run(self._memberships, guild_id)
+
+    def _export(self, guild_id):
+        clans = {}
+        for (name,) in self._db.execute("SELECT name FROM clans WHERE guild_id = ? ORDER BY name", (guild_id,)):
+            clans[name] = {"name": name, "chiefs": [], "members": []}
+        for user_id, clan, rank in self._db.execute("SELECT user_id, clan, rank FROM memberships WHERE guild_id = ?",
+                                                    (guild_id,)):
+            if clan in clans:
+                clans[clan]["chiefs" if rank == "chief" else "members"].append(user_id)
+        return {"clans": list(clans.values())}
+
+    async def export(self, guild_id: int) -> dict:
+        """Clans and members of a guild, in the bulk import JSON format"""
+        return await self._run(self._export, guild_id)
+
+    # Reconciliation with the guild
+
+    def _reconcile(self, guild_id, clans, memberships):
+        names = [clan[0] for clan in clans]
+        self._db.execute("CREATE TEMP TABLE IF NOT EXISTS live_clans (name TEXT PRIMARY KEY)")
+        self._db.execute("DELETE FROM live_clans")
+        self._db.executemany("INSERT OR IGNORE INTO live_clans (name) VALUES (?)", [(name,) for name in names])
+        self._db.execute("DELETE FROM clans WHERE guild_id = ? AND name NOT IN (SELECT name FROM live_clans)",
+                         (guild_id,))
+        self._db.execute("DELETE FROM memberships WHERE guild_id = ? AND clan NOT IN (SELECT name FROM live_clans)",
+                         (guild_id,))
+        self._db.executemany("INSERT INTO clans (guild_id, name, member_role_id, chief_role_id, created_at) "
+                             "VALUES (?, ?, ?, ?, ?) ON CONFLICT (guild_id, name) DO UPDATE SET "
+                             "member_role_id = excluded.member_role_id, chief_role_id = excluded.chief_role_id, "
+                             "created_at = MIN(created_at, excluded.created_at)",
+                             [(guild_id, name, member_role_id, chief_role_id,
+                               _created_at(member_role_id, chief_role_id))
+                              for name, member_role_id, chief_role_id in clans])
+        if memberships is not None:
+            self._db.execute("DELETE FROM memberships WHERE guild_id = ?", (guild_id,))
+            self._db.executemany("INSERT OR REPLACE INTO memberships (guild_id, user_id, clan, rank) VALUES (?, ?, ?, ?)",
+                                 [(guild_id, user_id, clan, rank) for user_id, clan, rank in memberships])
+        self._db.commit()
+
+    async def reconcile(self, guild_id: int, clans: Iterable[Tuple[str, Optional[int], Optional[int]]],
+                        memberships: Optional[Iterable[Tuple[int, str, str]]] = None):
+        """Make the stored clans of a guild match clans, (name, member_role_id, chief_role_id)
+
+        memberships, (user_id, clan, rank), replace the stored ones when given.
+        """
+        await self._run(self._reconcile, guild_id, list(clans), list(memberships) if memberships is not None else None)
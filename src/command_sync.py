@@ -0,0 +1,76 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+import discord
+from discord import app_commands
+
+from atomic_files import open_atomic
+
+logger = logging.getLogger('discord.clanbot.command_sync')
+
+FINGERPRINTS_PATH = "data/command_tree.json"
+
+
+class CommandSync:
+    """Syncs the command tree only when it differs from the last synced one
+
+    The fingerprint of the payload synced to each target, the global commands
+    or one guild, is kept in a JSON file per application. A restart with the
+    same commands then costs no REST call. Delete the file to force a sync.
+    """
+
+    def __init__(self, tree: app_commands.CommandTree, path: str = FINGERPRINTS_PATH):
+        self.tree = tree
+        self.path = path
+        self._fingerprints: Optional[Dict[str, str]] = None
+
+    async def fingerprint(self, guild: Optional[discord.abc.Snowflake] = None) -> str:
+        commands = self.tree.get_commands(guild=guild)
+        # The translations are part of what is synced, a new one must trigger a sync
+        translator = self.tree.translator
+        if translator is not None:
+            payload = [await command.get_translated_payload(self.tree, translator) for command in commands]
+        else:
+            payload = [command.to_dict(self.tree) for command in commands]
+        # Definition order does not matter to Discord, it should not trigger a sync either
+        payload.sort(key=lambda command: (command.get("type", 1), command["name"]))
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _load(self) -> Dict[str, str]:
+        if self._fingerprints is None:
+            try:
+                with open(self.path, encoding="utf-8") as file:
+                    self._fingerprints = json.load(file)
+            except FileNotFoundError:
+                self._fingerprints = {}
+            except (OSError, ValueError) as e:
+                logger.warning("Could not read " + self.path + ", syncing every command tree : " + str(e))
+                self._fingerprints = {}
+        return self._fingerprints
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open_atomic(self.path) as file:
+            json.dump(self._fingerprints, file, indent=1, sort_keys=True)
+
+    def _key(self, guild: Optional[discord.abc.Snowflake]) -> str:
+        return "{0}:{1}".format(self.tree.client.application_id, guild.id if guild is not None else "global")
+
+    async def sync(self, guild: Optional[discord.abc.Snowflake] = None) -> bool:
+        """Sync the commands of guild, or the global ones, if they changed; True when synced"""
+        fingerprints = self._load()
+        key = self._key(guild)
+        fingerprint = await self.fingerprint(guild)
+        if fingerprints.get(key) == fingerprint:
+            logger.info("Commands of " + key + " unchanged, not synced")
+            return False
+        await self.tree.sync(guild=guild)
+        fingerprints[key] = fingerprint
+        self._save()
+        logger.info("Commands of " + key + " synced")
+        return True
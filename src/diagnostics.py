@@ -0,0 +1,222 @@
+import asyncio
+import collections.abc
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from interactions import current_handler, percentile
+
+logger = logging.getLogger('discord.clanbot.diagnostics')
+
+
+class LoopLagSampler:
+    """Measures how late the event loop wakes up a task sleeping `interval` seconds
+
+    The lag is the time the loop was busy running something else: synchronous
+    work in a callback delays every interaction and the gateway heartbeats.
+    The last `samples` values are kept for the percentiles.
+    """
+
+    def __init__(self, interval: float = 0.1, samples: int = 3000, warn_after: float = 0.25):
+        self.interval = interval
+        self.warn_after = warn_after
+        self.lags: deque = deque(maxlen=samples)
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            metrics.loop_lag_seconds.observe(lag)
+            if lag > self.warn_after:
+                logger.warning("Event loop blocked for {0:.3f}s".format(lag))
+
+    def summary(self) -> Dict[str, float]:
+        lags = sorted(self.lags)
+        return {"p50": percentile(lags, 0.5), "p99": percentile(lags, 0.99), "max": self.max_lag}
+
+
+class _TimedCoroutine(collections.abc.Coroutine):
+    """Coroutine forwarding to another one, timing each step the loop runs"""
+
+    __slots__ = ("_coro", "_detector")
+
+    def __init__(self, coro, detector: "SlowCallbackDetector"):
+        self._coro = coro
+        self._detector = detector
+
+    def send(self, value):
+        start = time.perf_counter()
+        try:
+            return self._coro.send(value)
+        finally:
+            self._detector.observe(self._coro, time.perf_counter() - start)
+
+    def throw(self, *args):
+        start = time.perf_counter()
+        try:
+            return self._coro.throw(*args)
+        finally:
+            self._detector.observe(self._coro, time.perf_counter() - start)
+
+    def close(self):
+        return self._coro.close()
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    def __getattr__(self, name):
+        # cr_frame, __qualname__... for asyncio's task repr
+        return getattr(self._coro, name)
+
+
+class SlowCallbackDetector:
+    """Times every step of every task and reports the ones holding the loop too long
+
+    Installed as the task factory of the loop, on top of any previous factory.
+    A step slower than `threshold` seconds is attributed to the handler set in
+    current_handler, or to the coroutine when no handler is running.
+    """
+
+    def __init__(self, threshold: float = 0.05, max_names: int = 256):
+        self.threshold = threshold
+        self.max_names = max_names
+        # name -> [count, total seconds, max seconds]
+        self.slow: Dict[str, List[float]] = {}
+        self._previous = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def install(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._previous = loop.get_task_factory()
+        loop.set_task_factory(self._factory)
+
+    def uninstall(self):
+        if self._loop is not None and self._loop.get_task_factory() == self._factory:
+            self._loop.set_task_factory(self._previous)
+
+    def _factory(self, loop, coro, **kwargs):
+        if asyncio.iscoroutine(coro) and not isinstance(coro, _TimedCoroutine):
+            coro = _TimedCoroutine(coro, self)
+        if self._previous is not None:
+            return self._previous(loop, coro, **kwargs)
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    def observe(self, coro, elapsed: float):
+        if elapsed < self.threshold:
+            return
+        name = current_handler.get() or getattr(coro, "__qualname__", type(coro).__name__)
+        entry = self.slow.get(name)
+        if entry is None:
+            if len(self.slow) >= self.max_names:
+                name = "other"
+                entry = self.slow.setdefault(name, [0, 0.0, 0.0])
+            else:
+                entry = self.slow[name] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+        metrics.slow_callbacks.inc(name)
+        logger.warning("{0} held the event loop for {1:.3f}s".format(name, elapsed))
+
+    def top(self, count: int = 5) -> List[Tuple[str, List[float]]]:
+        """Slowest callbacks, by total time spent in slow steps"""
+        return sorted(self.slow.items(), key=lambda item: item[1][1], reverse=True)[:count]
+
+
+class SamplingProfiler:
+    """Samples the stack of the event loop thread from another thread
+
+    Stacks are counted in the collapsed format of flamegraph.pl and speedscope,
+    one "frame;frame;frame count" line per stack, and written to a file once
+    the profile is over. One profile at a time.
+    """
+
+    def __init__(self, directory: str = "logs", interval: float = 0.005):
+        self.directory = directory
+        self.interval = interval
+        self.running = False
+
+    def _sample(self, thread_id: int, duration: float) -> Counter:
+        stacks = Counter()
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{0} ({1}:{2})".format(code.co_name, os.path.basename(code.co_filename),
+                                                    code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    def _profile(self, thread_id: int, duration: float) -> Tuple[str, int]:
+        stacks = self._sample(thread_id, duration)
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in stacks.most_common():
+                file.write("{0} {1}\n".format(stack, count))
+        return path, sum(stacks.values())
+
+    async def profile(self, duration: float) -> Tuple[str, int]:
+        """Profile the running loop for duration seconds, returns the file written and the sample count"""
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        self.running = True
+        try:
+            loop_thread = threading.get_ident()
+            # The sampling thread must not be the loop thread, and must not be blocked by it
+            return await asyncio.get_running_loop().run_in_executor(None, self._profile, loop_thread, duration)
+        finally:
+            self.running = False
+
+
+class Diagnostics:
+    """Loop lag sampler, slow callback detector and sampling profiler of the bot"""
+
+    def __init__(self, slow_threshold: float = 0.05):
+        self.lag = LoopLagSampler()
+        self.slow = SlowCallbackDetector(slow_threshold)
+        self.profiler = SamplingProfiler()
+
+    def start(self):
+        self.lag.start()
+        self.slow.install(asyncio.get_running_loop())
+        logger.info("Diagnostics started, callbacks slower than {0:.0f}ms are reported".format(
+            self.slow.threshold * 1000))
+
+    def stop(self):
+        self.lag.stop()
+        self.slow.uninstall()
+
+    @staticmethod
+    def tasks(count: int = 5) -> Tuple[int, List[Tuple[str, int]]]:
+        """Number of pending tasks, and the most frequent coroutines among them"""
+        names = Counter()
+        tasks = asyncio.all_tasks()
+        for task in tasks:
+            coro = task.get_coro()
+            names[getattr(coro, "__qualname__", type(coro).__name__)] += 1
+        return len(tasks), names.most_common(count)
@@ -0,0 +1,101 @@
+import json
+import os
+from typing import Dict, Iterable, Optional
+
+import discord
+
+from clan_registry import CHIEF_PREFIX, MEMBER_PREFIX
+
+CONFIG_PATH = "guilds.json"
+
+KEYS = ("member_prefix", "chief_prefix", "manager_roles")
+
+
+class GuildConfig:
+    """Clan settings of one guild
+
+    Clan roles are named member_prefix + clan name and chief_prefix + clan name.
+    Members of the manager_roles can do what the server administrators do:
+    create clans, delete any clan, promote chiefs and run bulk operations.
+    """
+
+    __slots__ = ("member_prefix", "chief_prefix", "manager_roles")
+
+    def __init__(self, member_prefix: str = MEMBER_PREFIX, chief_prefix: str = CHIEF_PREFIX,
+                 manager_roles: Iterable[int] = ()):
+        self.member_prefix = member_prefix
+        self.chief_prefix = chief_prefix
+        self.manager_roles = frozenset(manager_roles)
+
+    def can_manage(self, member: discord.Member) -> bool:
+        if member.guild_permissions.administrator:
+            return True
+        return any(member.get_role(role_id) is not None for role_id in self.manager_roles)
+
+
+def _parse(entry, base: Optional[dict], where: str) -> dict:
+    if not isinstance(entry, dict):
+        raise ValueError(where + " must be an object")
+    unknown = set(entry) - set(KEYS)
+    if unknown:
+        raise ValueError(where + " has unknown keys " + ", ".join(sorted(unknown)))
+    values = dict(base or {})
+    for key in ("member_prefix", "chief_prefix"):
+        if key in entry:
+            if not isinstance(entry[key], str) or entry[key] == "":
+                raise ValueError(where + "." + key + " must be a non empty string")
+            values[key] = entry[key]
+    if "manager_roles" in entry:
+        roles = entry["manager_roles"]
+        if not isinstance(roles, list) or not all(str(role).isdigit() for role in roles):
+            raise ValueError(where + ".manager_roles must be a list of role IDs")
+        values["manager_roles"] = [int(role) for role in roles]
+    member_prefix = values.get("member_prefix", MEMBER_PREFIX)
+    chief_prefix = values.get("chief_prefix", CHIEF_PREFIX)
+    # "Clan " and "Clan Chef " would make every chief role a member role as well
+    if member_prefix.startswith(chief_prefix) or chief_prefix.startswith(member_prefix):
+        raise ValueError(where + " has a member or chief prefix starting with the other one")
+    return values
+
+
+class GuildConfigs:
+    """GuildConfig of every guild, read from a JSON file
+
+    {"default": {"member_prefix": "Membre ", "chief_prefix": "Chef ", "manager_roles": []},
+     "<guild id>": {...}}
+
+    Every key is optional, a guild entry overrides the default one key by key
+    and guilds without an entry get the default. Configs are built once.
+    """
+
+    def __init__(self, default: Optional[dict] = None, guilds: Optional[Dict[int, dict]] = None):
+        self.default = GuildConfig(**(default or {}))
+        self._guilds = {guild_id: GuildConfig(**values) for guild_id, values in (guilds or {}).items()}
+
+    @classmethod
+    def load(cls, path: str = CONFIG_PATH) -> "GuildConfigs":
+        """Configs of the file, the defaults when it does not exist, ValueError when it is invalid"""
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+        except json.JSONDecodeError as e:
+            raise ValueError(path + " is not valid JSON: " + str(e))
+        if not isinstance(data, dict):
+            raise ValueError(path + " must be an object of guild IDs")
+        default = _parse(data.get("default", {}), None, "default")
+        guilds = {}
+        for key, entry in data.items():
+            if key == "default":
+                continue
+            if not key.isdigit():
+                raise ValueError(path + ": " + key + " is not a guild ID")
+            guilds[int(key)] = _parse(entry, default, key)
+        return cls(default, guilds)
+
+    def get(self, guild_id: int) -> GuildConfig:
+        return self._guilds.get(guild_id, self.default)
+
+    def __len__(self) -> int:
+        return len(self._guilds)
@@ -0,0 +1,100 @@
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Optional
+
+import discord
+
+import metrics
+from background import spawn
+from messages import Catalog, catalog
+
+logger = logging.getLogger('discord.clanbot.interactions')
+
+# Discord drops interactions that are not acknowledged within 3 seconds
+ACK_DEADLINE = 3.0
+
+# Name of the command or UI callback running in the current task, for the diagnostics
+current_handler: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_handler", default=None)
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+class InteractionPipeline:
+    """Acknowledge an interaction first, do the work, then answer it
+
+    async with InteractionPipeline(interaction, "new_clan") as reply:
+        ...
+        await reply.send(embed=embed, delete_after=15)
+
+    The interaction is deferred on entry, as an ephemeral "thinking" message, or
+    as an update of the message of the component when update is True. send()
+    edits that response, so it can be called from error handlers whatever
+    happened before. messages are the ones of the language of the user. Times
+    to acknowledge and to complete are recorded in the metrics.
+    """
+
+    def __init__(self, interaction: discord.Interaction, name: str, update: bool = False,
+                 messages_catalog: Catalog = catalog):
+        self.interaction = interaction
+        self.name = name
+        self.messages = messages_catalog.get(interaction.locale)
+        self.update = update
+        self.sent = False
+        self._start = 0.0
+        self._acked = 0.0
+
+    async def __aenter__(self) -> "InteractionPipeline":
+        self._start = time.perf_counter()
+        current_handler.set(self.name)
+        if not self.interaction.response.is_done():
+            if self.update:
+                await self.interaction.response.defer()
+            else:
+                await self.interaction.response.defer(ephemeral=True, thinking=True)
+        self._acked = time.perf_counter()
+        since_creation = (discord.utils.utcnow() - self.interaction.created_at).total_seconds()
+        if since_creation > ACK_DEADLINE * 0.8:
+            logger.warning("{0} acknowledged {1:.2f}s after the interaction was created".format(self.name,
+                                                                                                since_creation))
+        return self
+
+    async def send(self, content: Optional[str] = None, *, embed: Optional[discord.Embed] = None,
+                   view: Optional[discord.ui.View] = None, file: Optional[discord.File] = None,
+                   delete_after: Optional[float] = None):
+        """Answer the interaction, replacing the content and the components of the response"""
+        kwargs = {"content": content, "embed": embed, "view": view}
+        if file is not None:
+            kwargs["attachments"] = [file]
+        await self.interaction.edit_original_response(**kwargs)
+        self.sent = True
+        if delete_after is not None:
+            spawn(self._delete_later(delete_after), "delete_after")
+
+    async def _delete_later(self, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            await self.interaction.delete_original_response()
+        except discord.HTTPException:
+            pass
+
+    async def __aexit__(self, exc_type, exc, tb):
+        done = time.perf_counter()
+        metrics.interactions.inc(self.name)
+        metrics.mark_startup("first_command")
+        metrics.interaction_ack_seconds.observe(self._acked - self._start, self.name)
+        metrics.interaction_seconds.observe(done - self._start, self.name)
+        logger.debug("{0} acknowledged in {1:.3f}s, completed in {2:.3f}s".format(self.name, self._acked - self._start,
+                                                                                  done - self._start))
+        if exc_type is not None and not self.sent:
+            # Do not leave the user with an endless "thinking" message
+            try:
+                await self.send(self.messages.text("error"), view=None, delete_after=15)
+            except discord.HTTPException:
+                pass
+        return False
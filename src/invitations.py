@@ -0,0 +1,157 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple
+
+import discord
+
+import metrics
+from background import spawn
+from rate_limit import RouteScheduler
+
+# Invitations a leader can send in a burst, then one every 12 seconds
+LEADER_LIMIT = (1 / 12, 5)
+# Invitations to one clan, from all its leaders
+CLAN_LIMIT = (1 / 3, 20)
+# Members whose DMs were closed are not tried again before this many seconds
+CLOSED_DMS_TTL = 3600
+# Clans of a batched invitation, one row of buttons each
+MAX_BATCH = 5
+
+
+class InviteRefused(Exception):
+    """Invitation not sent, reason is "pending", "leader_cooldown", "clan_cooldown" or "closed_dms"
+
+    retry_after is the number of seconds before a new attempt can succeed.
+    """
+
+    def __init__(self, reason: str, retry_after: float = 0.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Batch:
+
+    __slots__ = ("member", "invites", "futures")
+
+    def __init__(self, member: discord.Member):
+        self.member = member
+        self.invites: List[Tuple[str, discord.Role, discord.Member]] = []
+        self.futures: List[asyncio.Future] = []
+
+
+class InvitationManager:
+    """Sends the clan invitations, at most once per clan and member and not too often
+
+    - an invitation still pending for the same (guild, clan, member) is refused
+    - leaders and clans each have a token bucket, see LEADER_LIMIT and CLAN_LIMIT
+    - members whose DMs are closed are refused without a request for CLOSED_DMS_TTL seconds
+    - with a batch_window, invitations to the same member within that many
+      seconds are sent together in one DM
+
+    send(member, invites) sends one DM for a list of (clan, member role,
+    leader). Every structure is bounded: the buckets by the scheduler, the
+    pending invitations and the closed DMs by max_entries.
+    """
+
+    def __init__(self, send: Callable, ttl: float, batch_window: float = 0.0, max_entries: int = 10_000):
+        self.send = send
+        self.ttl = ttl
+        self.batch_window = batch_window
+        self.max_entries = max_entries
+        self.buckets = RouteScheduler({"leader": LEADER_LIMIT, "clan": CLAN_LIMIT}, max_buckets=max_entries)
+        # (guild id, clan, member id) -> expiry, in expiry order
+        self._pending: "OrderedDict[Tuple[int, str, int], float]" = OrderedDict()
+        # user id -> expiry, in expiry order
+        self._closed_dms: "OrderedDict[int, float]" = OrderedDict()
+        self._batches: Dict[Tuple[int, int], _Batch] = {}
+
+    @staticmethod
+    def _purge(entries: OrderedDict, now: float, max_entries: int):
+        while entries and (next(iter(entries.values())) <= now or len(entries) > max_entries):
+            entries.popitem(last=False)
+
+    def _remember(self, entries: OrderedDict, key, expires: float):
+        entries[key] = expires
+        entries.move_to_end(key)
+        self._purge(entries, time.monotonic(), self.max_entries)
+
+    def has_closed_dms(self, user_id: int) -> bool:
+        expires = self._closed_dms.get(user_id)
+        return expires is not None and expires > time.monotonic()
+
+    def is_pending(self, guild_id: int, clan: str, user_id: int) -> bool:
+        expires = self._pending.get((guild_id, clan, user_id))
+        return expires is not None and expires > time.monotonic()
+
+    def resolve(self, guild_id: int, clan: str, user_id: int):
+        """The invitation was accepted, refused or expired, a new one can be sent"""
+        self._pending.pop((guild_id, clan, user_id), None)
+
+    async def invite(self, leader: discord.Member, member: discord.Member, clan: str, role: discord.Role):
+        """Send an invitation to join clan, raises InviteRefused or the discord.HTTPException of the DM"""
+        guild_id = member.guild.id
+        if self.has_closed_dms(member.id):
+            metrics.invitations.inc("closed_dms")
+            raise InviteRefused("closed_dms", self._closed_dms[member.id] - time.monotonic())
+        if self.is_pending(guild_id, clan, member.id):
+            metrics.invitations.inc("pending")
+            raise InviteRefused("pending", self._pending[(guild_id, clan, member.id)] - time.monotonic())
+        # Both buckets are checked before taking from either
+        leader_bucket = self.buckets.bucket("leader", (guild_id, leader.id))
+        clan_bucket = self.buckets.bucket("clan", (guild_id, clan))
+        for reason, bucket in (("leader_cooldown", leader_bucket), ("clan_cooldown", clan_bucket)):
+            delay = bucket.delay()
+            if delay > 0:
+                metrics.invitations.inc(reason)
+                raise InviteRefused(reason, delay)
+        leader_bucket.try_acquire()
+        clan_bucket.try_acquire()
+
+        # Pending from now on, a second click during the send is refused
+        self._remember(self._pending, (guild_id, clan, member.id), time.monotonic() + self.ttl)
+        try:
+            if self.batch_window > 0:
+                await self._send_batched(leader, member, clan, role)
+            else:
+                await self.send(member, [(clan, role, leader)])
+        except discord.Forbidden:
+            self.resolve(guild_id, clan, member.id)
+            self._remember(self._closed_dms, member.id, time.monotonic() + CLOSED_DMS_TTL)
+            metrics.invitations.inc("failed")
+            raise
+        except Exception:
+            self.resolve(guild_id, clan, member.id)
+            metrics.invitations.inc("failed")
+            raise
+        metrics.invitations.inc("sent")
+
+    async def _send_batched(self, leader: discord.Member, member: discord.Member, clan: str, role: discord.Role):
+        key = (member.guild.id, member.id)
+        batch = self._batches.get(key)
+        if batch is None or len(batch.invites) >= MAX_BATCH:
+            batch = self._batches[key] = _Batch(member)
+            asyncio.get_running_loop().call_later(self.batch_window,
+                                                  lambda: spawn(self._flush(key, batch), "invitation_batch"))
+        future = asyncio.get_running_loop().create_future()
+        batch.invites.append((clan, role, leader))
+        batch.futures.append(future)
+        await future
+
+    async def _flush(self, key: Tuple[int, int], batch: _Batch):
+        if self._batches.get(key) is batch:
+            del self._batches[key]
+        try:
+            await self.send(batch.member, batch.invites)
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_result(None)
+
+    def __len__(self) -> int:
+        return len(self._pending)
@@ -0,0 +1,67 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, List
+
+import metrics
+
+
+class _KeyLock:
+
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Holders and waiters, the lock is dropped when it falls to 0
+        self.users = 0
+
+
+class KeyedLocks:
+    """asyncio locks by key, created on demand and dropped once unused
+
+    async with locks.hold("new_clan", clan_key(guild.id, name)):
+        ...
+
+    Operations on different keys run in parallel. hold() takes several keys in
+    sorted order, so two operations locking the same keys never deadlock. The
+    time spent waiting is observed per operation in the metrics.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, _KeyLock] = {}
+        self.contended = 0
+
+    @asynccontextmanager
+    async def hold(self, operation: str, *keys: Hashable):
+        registered: List[Hashable] = []
+        acquired: List[asyncio.Lock] = []
+        start = time.perf_counter()
+        try:
+            for key in sorted(set(keys)):
+                entry = self._locks.get(key)
+                if entry is None:
+                    entry = self._locks[key] = _KeyLock()
+                entry.users += 1
+                registered.append(key)
+                if entry.lock.locked():
+                    self.contended += 1
+                await entry.lock.acquire()
+                acquired.append(entry.lock)
+            metrics.lock_wait_seconds.observe(time.perf_counter() - start, operation)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            # Also reached by the waiters cancelled before getting their locks
+            for key in registered:
+                entry = self._locks[key]
+                entry.users -= 1
+                if entry.users == 0:
+                    del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+def clan_key(guild_id: int, name: str) -> tuple:
+    return "clan", guild_id, name
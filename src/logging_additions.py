@@ -1,5 +1,9 @@
+import atexit
+import copy
+import json
 import logging
 import logging.handlers
+import queue
 
 
 class ConsoleColoredFormatter(logging.Formatter):
@@ -13,17 +17,74 @@ class ConsoleColoredFormatter(logging.Formatter):
     reset = '\x1b[0m'
 
     def __init__(self, fmt):
-        super().__init__()
+        super().__init__(fmt)
         self.fmt = fmt
+        # One formatter per level, built once
         self.FORMATS = {
-            logging.DEBUG: self.grey + self.fmt + self.reset,
-            logging.INFO: self.blue + self.fmt + self.reset,
-            logging.WARNING: self.yellow + self.fmt + self.reset,
-            logging.ERROR: self.red + self.fmt + self.reset,
-            logging.CRITICAL: self.bold_red + self.fmt + self.reset
+            logging.DEBUG: logging.Formatter(self.grey + self.fmt + self.reset),
+            logging.INFO: logging.Formatter(self.blue + self.fmt + self.reset),
+            logging.WARNING: logging.Formatter(self.yellow + self.fmt + self.reset),
+            logging.ERROR: logging.Formatter(self.red + self.fmt + self.reset),
+            logging.CRITICAL: logging.Formatter(self.bold_red + self.fmt + self.reset)
         }
 
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.FORMATS.get(record.levelno)
+        if formatter is None:
+            return super().format(record)
         return formatter.format(record)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Logging formatter writing one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler for a queue read by a thread of the same process
+
+    The base class renders the whole record, traceback included, into its
+    message and drops exc_info, so that it can cross processes. Here only the
+    message is rendered: the traceback is formatted by the listener thread, and
+    the formatters still see it apart, e.g. as the exception field of
+    JsonLinesFormatter.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        # Rendered now, the arguments may change once the call returns
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+
+def setup_queue_logging(logger, handlers):
+    """Attach handlers to logger behind a queue
+
+    The logger only enqueues records, a background thread does the formatting
+    and the I/O of the handlers, so logging never blocks the event loop.
+    Returns the started QueueListener, stopped at exit.
+    """
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(LocalQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    def stop():
+        # The listener may already have been stopped by its owner
+        if listener._thread is not None:
+            listener.stop()
+
+    atexit.register(stop)
+    return listener
@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import discord
+
+# Seconds a fetched member is trusted for, no member event refreshes it in lean mode
+MEMBER_TTL = 60.0
+
+
+class MemberCache:
+    """Small LRU of guild members, fetched on demand
+
+    Used in lean mode where the gateway member cache is disabled: members (and
+    so their roles) are only fetched when a clan operation needs them. Without
+    member events nothing tells when their roles change, so entries expire
+    after ttl seconds; callers about to rewrite the roles ask for a younger
+    one with max_age.
+    """
+
+    def __init__(self, size: int = 1024, ttl: float = MEMBER_TTL):
+        self.size = size
+        self.ttl = ttl
+        # (guild id, member id) -> (member, time.monotonic() when stored)
+        self._members = OrderedDict()
+
+    def put(self, member: "discord.Member"):
+        key = (member.guild.id, member.id)
+        self._members[key] = (member, time.monotonic())
+        self._members.move_to_end(key)
+        if len(self._members) > self.size:
+            self._members.popitem(last=False)
+
+    def invalidate(self, guild_id: int, member_id: int):
+        self._members.pop((guild_id, member_id), None)
+
+    def get_cached(self, guild: "discord.Guild", member_id: int,
+                   max_age: Optional[float] = None) -> Optional["discord.Member"]:
+        """Member from the gateway cache, or stored less than max_age (ttl by default) seconds ago"""
+        member = guild.get_member(member_id)
+        if member is not None:
+            return member
+        key = (guild.id, member_id)
+        entry = self._members.get(key)
+        if entry is None:
+            return None
+        member, stored = entry
+        age = time.monotonic() - stored
+        if age > self.ttl:
+            del self._members[key]
+            return None
+        if max_age is not None and age > max_age:
+            return None
+        self._members.move_to_end(key)
+        return member
+
+    async def get(self, guild: "discord.Guild", member_id: int, max_age: Optional[float] = None) -> "discord.Member":
+        """Member from the gateway cache, this cache, or the API in that order
+
+        Raises discord.NotFound if the member left the guild.
+        """
+        member = self.get_cached(guild, member_id, max_age)
+        if member is None:
+            member = await guild.fetch_member(member_id)
+            self.put(member)
+        return member
+
+    def __len__(self) -> int:
+        return len(self._members)
@@ -0,0 +1,183 @@
+import json
+import os
+import string
+from typing import Dict, FrozenSet, Optional, Tuple
+
+import discord
+from discord import app_commands
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales")
+# Language of the messages written in the code, and of the users whose locale has no catalog
+DEFAULT_LOCALE = "fr"
+
+SUCCESS = 0x00ff00
+ERROR = 0xff0000
+
+
+class Template:
+    """Message with {name} placeholders, parsed once when the catalog is loaded"""
+
+    __slots__ = ("text", "fields")
+
+    def __init__(self, text: str):
+        fields = set()
+        try:
+            for _, field, _, _ in string.Formatter().parse(text):
+                if field is not None:
+                    if not field.isidentifier():
+                        raise ValueError("placeholders must be names, not {" + field + "}")
+                    fields.add(field)
+        except ValueError as e:
+            raise ValueError(repr(text) + " : " + str(e))
+        self.text = text
+        self.fields: FrozenSet[str] = frozenset(fields)
+
+    def __call__(self, **values) -> str:
+        # Texts without placeholders are returned as they are
+        return self.text.format(**values) if self.fields else self.text
+
+
+class FrozenEmbed(discord.Embed):
+    """Embed shared by every reply showing it, which must not be modified once built"""
+
+    __slots__ = ("_frozen",)
+
+    def __init__(self, *, footer: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        if footer is not None:
+            self.set_footer(text=footer)
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise TypeError("FrozenEmbed is shared between replies, copy() it to change it")
+        super().__setattr__(name, value)
+
+    def _refuse(self, *args, **kwargs):
+        raise TypeError("FrozenEmbed is shared between replies, copy() it to change it")
+
+    add_field = insert_field_at = set_field_at = remove_field = clear_fields = _refuse
+
+    def copy(self) -> discord.Embed:
+        return discord.Embed.from_dict(self.to_dict())
+
+
+class Messages:
+    """Templates of one locale, those it does not translate coming from the default locale
+
+    text() renders a template by key. embed() builds an embed from title,
+    description and footer keys; when none of them has placeholders the embed
+    is built once and the same FrozenEmbed is returned to every later call.
+    """
+
+    def __init__(self, locale: str, templates: Dict[str, Template], commands: Dict[str, str]):
+        self.locale = locale
+        self.templates = templates
+        self.commands = commands
+        self._prototypes: Dict[Tuple, FrozenEmbed] = {}
+
+    def text(self, key: str, **values) -> str:
+        return self.templates[key](**values)
+
+    def embed(self, title: str, description: Optional[str] = None, /, color: Optional[int] = None,
+              footer: Optional[str] = None, **values) -> discord.Embed:
+        key = (title, description, color, footer)
+        prototype = self._prototypes.get(key)
+        if prototype is not None:
+            return prototype
+        templates = self.templates
+        parts = [templates[title]] + [templates[part] for part in (description, footer) if part is not None]
+        kwargs = {"title": templates[title](**values), "color": color}
+        if description is not None:
+            kwargs["description"] = templates[description](**values)
+        if not any(template.fields for template in parts):
+            prototype = self._prototypes[key] = FrozenEmbed(
+                footer=templates[footer]() if footer is not None else None, **kwargs)
+            return prototype
+        embed = discord.Embed(**kwargs)
+        if footer is not None:
+            embed.set_footer(text=templates[footer](**values))
+        return embed
+
+    def command(self, text: str) -> Optional[str]:
+        """Translation of a command, option or context menu description written in the default locale"""
+        return self.commands.get(text)
+
+
+class Catalog:
+    """Messages of every locale of a directory of <locale>.json files, loaded and checked once
+
+    Each file is {"messages": {key: template}, "commands": {description: translation}}.
+    The default locale must have every key; the others may leave some out, and
+    may only use the placeholders of the default template. The Messages of each
+    Discord locale are resolved when loading (en-US, then en, then the default
+    locale), so a reply only pays one dict lookup, however many locales there
+    are.
+    """
+
+    def __init__(self, locales: Dict[str, Messages], default: str = DEFAULT_LOCALE):
+        self.locales = locales
+        self.default = locales[default]
+        self._resolved: Dict[object, Messages] = {}
+        for name in locales:
+            self._resolved[name] = locales[name]
+        for locale in discord.Locale:
+            messages = locales.get(locale.value) or locales.get(locale.value.split("-")[0]) or self.default
+            self._resolved[locale] = self._resolved[locale.value] = messages
+
+    @classmethod
+    def load(cls, directory: str = LOCALES_DIR, default: str = DEFAULT_LOCALE) -> "Catalog":
+        """Read and check every locale, raises ValueError when one is invalid"""
+        raw = {}
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".json"):
+                with open(os.path.join(directory, filename), encoding="utf-8") as file:
+                    try:
+                        raw[filename[:-len(".json")]] = json.load(file)
+                    except ValueError as e:
+                        raise ValueError(filename + " : " + str(e))
+        if default not in raw:
+            raise ValueError("no " + default + ".json in " + directory)
+        base = {key: Template(text) for key, text in raw[default].get("messages", {}).items()}
+        locales = {}
+        for name, content in raw.items():
+            templates = dict(base)
+            for key, text in content.get("messages", {}).items():
+                if key not in base:
+                    raise ValueError(name + ".json : unknown message " + key)
+                template = Template(text)
+                if not template.fields <= base[key].fields:
+                    raise ValueError(name + ".json : " + key + " uses " + ", ".join(
+                        sorted(template.fields - base[key].fields)) + ", which the bot does not provide")
+                templates[key] = template
+            locales[name] = Messages(name, templates, dict(content.get("commands", {})))
+        return cls(locales, default)
+
+    def get(self, locale) -> Messages:
+        """Messages of a discord.Locale or locale name, e.g. interaction.locale"""
+        return self._resolved.get(locale, self.default)
+
+
+class CatalogTranslator(app_commands.Translator):
+    """Serves the descriptions of the commands and the names of the context menus from the catalog"""
+
+    def __init__(self, messages_catalog: "Catalog"):
+        self.catalog = messages_catalog
+
+    async def translate(self, string: app_commands.locale_str, locale: discord.Locale,
+                        context: app_commands.TranslationContext) -> Optional[str]:
+        location = context.location
+        if location in (app_commands.TranslationContextLocation.parameter_name,
+                        app_commands.TranslationContextLocation.group_name):
+            return None
+        # Slash command names are the same in every language, context menu names are sentences
+        if location == app_commands.TranslationContextLocation.command_name and \
+                not isinstance(context.data, app_commands.ContextMenu):
+            return None
+        messages = self.catalog.get(locale)
+        if messages is self.catalog.default:
+            return None
+        return messages.command(string.message)
+
+
+catalog = Catalog.load()
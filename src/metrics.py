@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import math
+import re
+import time
+import weakref
+from bisect import bisect_left
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger('discord.clanbot.metrics')
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _value(value) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = ['{0}="{1}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def samples(self):
+        return []
+
+    def render(self) -> str:
+        lines = ["# HELP {0} {1}".format(self.name, self.documentation), "# TYPE {0} {1}".format(self.name, self.kind)]
+        for suffix, labels, value in self.samples():
+            lines.append("{0}{1}{2} {3}".format(self.name, suffix, labels, _value(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonic counter, one value per label values tuple"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        return [("", _labels(self.labels, key), value) for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """Value read from a function when scraped
+
+    The function returns a number, or a dict of label values tuple -> number
+    for labelled gauges.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def samples(self):
+        value = self.function()
+        if isinstance(value, dict):
+            return [("", _labels(self.labels, key), item) for key, item in value.items()]
+        return [("", "", value)]
+
+
+class CounterFunction(Gauge):
+    """Counter kept by another object, read from a function when scraped"""
+
+    kind = "counter"
+
+
+class Histogram(Metric):
+    """Cumulative histogram of observed values, one per label values tuple"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        # Non cumulative counts per bucket, plus the +Inf bucket, the sum and the count
+        counts = self.values.get(label_values)
+        if counts is None:
+            counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def samples(self):
+        samples = []
+        for key, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append(("_bucket", _labels(self.labels, key, 'le="' + le + '"'), cumulative))
+            samples.append(("_sum", _labels(self.labels, key), counts[-2]))
+            samples.append(("_count", _labels(self.labels, key), counts[-1]))
+        return samples
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        parts = []
+        for metric in self.metrics:
+            try:
+                parts.append(metric.render())
+            except Exception as e:
+                # One broken gauge should not take the whole page down
+                logger.error("Error while rendering metric " + metric.name)
+                logger.error(e)
+        return "\n".join(parts) + "\n"
+
+
+registry = MetricsRegistry()
+
+interactions = registry.register(Counter("clanbot_interactions_total", "Commands and UI callbacks handled",
+                                         ("handler",)))
+interaction_ack_seconds = registry.register(Histogram("clanbot_interaction_ack_seconds",
+                                                      "Time to acknowledge an interaction", ("handler",)))
+interaction_seconds = registry.register(Histogram("clanbot_interaction_seconds",
+                                                  "Time to complete an interaction", ("handler",)))
+rest_requests = registry.register(Counter("clanbot_rest_requests_total", "Discord REST requests",
+                                          ("method", "route", "status")))
+rate_limited = registry.register(Counter("clanbot_rest_rate_limited_total", "Discord REST 429 responses",
+                                         ("method", "route")))
+errors = registry.register(Counter("clanbot_errors_total", "Discord errors logged by the handlers", ("type",)))
+lock_wait_seconds = registry.register(Histogram("clanbot_lock_wait_seconds", "Time waited for the clan locks",
+                                                ("operation",), (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)))
+loop_lag_seconds = registry.register(Histogram("clanbot_loop_lag_seconds", "Event loop lag, with DIAGNOSTICS",
+                                               buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)))
+slow_callbacks = registry.register(Counter("clanbot_slow_callbacks_total",
+                                           "Steps of a callback holding the event loop too long, with DIAGNOSTICS",
+                                           ("handler",)))
+invitations = registry.register(Counter("clanbot_invitations_total", "Clan invitations by result", ("result",)))
+journal_events = registry.register(Counter("clanbot_journal_events_total", "Clan events journaled", ("event",)))
+journal_dropped = registry.register(Counter("clanbot_journal_dropped_total",
+                                            "Clan events dropped, the journal buffer being full"))
+
+# Import time of this module, which the bot imports before anything else
+started = time.monotonic()
+# Seconds from started to the first time each startup stage was reached
+startup_stages: Dict[str, float] = {}
+registry.register(Gauge("clanbot_startup_seconds", "Time from the process start to each startup stage",
+                        lambda: {(stage,): seconds for stage, seconds in startup_stages.items()}, ("stage",)))
+
+
+def mark_startup(stage: str):
+    if stage not in startup_stages:
+        startup_stages[stage] = time.monotonic() - started
+        logger.info("Startup stage {0} reached after {1:.2f}s".format(stage, startup_stages[stage]))
+
+
+# Views register themselves here, the gauge counts the ones still listening
+live_views = weakref.WeakSet()
+
+_api_prefix = re.compile(r"^/api/v[0-9]+")
+_snowflake = re.compile(r"/[0-9]{15,21}(?=/|$)")
+_token = re.compile(r"^(/(?:interactions|webhooks)/\{id\})/[^/]+")
+
+
+def route_of(path: str) -> str:
+    """REST route of a request path, IDs and tokens replaced to keep the label count bounded"""
+    return _token.sub(r"\1/{token}", _snowflake.sub("/{id}", _api_prefix.sub("", path)))
+
+
+def http_trace():
+    """aiohttp TraceConfig counting the REST requests of the client, per route"""
+    import aiohttp
+
+    async def on_request_end(session, context, params):
+        route = route_of(params.url.path)
+        status = params.response.status
+        rest_requests.inc(params.method, route, str(status))
+        if status == 429:
+            rate_limited.inc(params.method, route)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+class ErrorCounter(logging.Handler):
+    """Counts the exceptions handlers log with logger.error(e)"""
+
+    def __init__(self, types: Tuple[type, ...]):
+        super().__init__(logging.ERROR)
+        self.types = types
+
+    def emit(self, record):
+        if isinstance(record.msg, self.types):
+            errors.inc(type(record.msg).__name__)
+
+
+class MetricsServer:
+    """Serves GET /metrics in the Prometheus text format, on the running event loop"""
+
+    def __init__(self, host: str, port: int, metrics: MetricsRegistry = registry):
+        self.host = host
+        self.port = port
+        self.metrics = metrics
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Metrics served on http://{0}:{1}/metrics".format(self.host, self.port))
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                request_line = (await asyncio.wait_for(reader.readline(), 5)).decode("latin-1").split()
+                while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                    pass
+            except (ValueError, asyncio.LimitOverrunError):
+                # Request line or header longer than the stream limit
+                request_line = None
+            if request_line is None:
+                body = b"Bad request\n"
+                head = "HTTP/1.1 400 Bad Request\r\nContent-Type: text/plain\r\n"
+            elif len(request_line) >= 2 and request_line[0] == "GET" and request_line[1].split("?")[0] == "/metrics":
+                body = self.metrics.render().encode("utf-8")
+                head = "HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            else:
+                body = b"Not found\n"
+                head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+            writer.write((head + "Content-Length: {0}\r\nConnection: close\r\n\r\n".format(len(body))).encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
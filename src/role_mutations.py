@@ -0,0 +1,119 @@
+import asyncio
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Set, Tuple
+
+import discord
+
+from background import spawn
+
+if TYPE_CHECKING:
+    from member_cache import MemberCache
+
+# Seconds since a member was fetched for its roles to be the base of an edit, older ones are fetched again
+FRESH_MEMBER = 2.0
+
+
+class _PendingEdit:
+
+    __slots__ = ("member", "reason", "add", "remove", "future")
+
+    def __init__(self, member: discord.Member, reason: Optional[str], future: asyncio.Future):
+        self.member = member
+        self.reason = reason
+        self.add: Set[int] = set()
+        self.remove: Set[int] = set()
+        self.future = future
+
+    def merge(self, add: Iterable[int], remove: Iterable[int]):
+        # The last queued change of a role wins
+        for role_id in add:
+            self.add.add(role_id)
+            self.remove.discard(role_id)
+        for role_id in remove:
+            self.remove.add(role_id)
+            self.add.discard(role_id)
+
+
+class RoleMutator:
+    """Applies the role changes of a member in a single request
+
+    Changes queued for the same member within `window` seconds are merged, the
+    resulting role set is computed from the member's current roles and applied
+    with one Member.edit call. Changes that leave the roles untouched cost no
+    request at all.
+
+    The current roles are never the ones of the member passed by the callers,
+    which may be a snapshot from long ago: they come from the gateway cache, or
+    from a member fetched at most max_age seconds ago. Edits of the same member
+    run one after the other, each starting from the roles the previous one
+    returned.
+    """
+
+    def __init__(self, members: "MemberCache", window: float = 0.05, max_age: float = FRESH_MEMBER):
+        self.members = members
+        self.window = window
+        self.max_age = max_age
+        self._pending: Dict[Tuple[int, int], _PendingEdit] = {}
+        # Edit running or waiting for the previous one, per member
+        self._flushes: Dict[Tuple[int, int], asyncio.Task] = {}
+        # Counters, for the tests and the metrics
+        self.operations = 0
+        self.rest_calls = 0
+        self.skipped = 0
+        # Called with the edited member after each edit
+        self.listeners = []
+
+    async def apply(self, member: discord.Member, add: Iterable[Optional[discord.abc.Snowflake]] = (),
+                    remove: Iterable[Optional[discord.abc.Snowflake]] = (), reason: Optional[str] = None) -> bool:
+        """Add and remove roles of member, None roles are ignored
+
+        Returns False if the member already had the requested roles. Raises the
+        discord.HTTPException of the edit, shared by every merged change.
+        """
+        self.operations += 1
+        key = (member.guild.id, member.id)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _PendingEdit(member, reason, asyncio.get_running_loop().create_future())
+            asyncio.get_running_loop().call_later(self.window, self._start_flush, key)
+        pending.merge([role.id for role in add if role is not None],
+                      [role.id for role in remove if role is not None])
+        # Shielded so that a cancelled caller does not cancel the edit of the others
+        return await asyncio.shield(pending.future)
+
+    def _start_flush(self, key: Tuple[int, int]):
+        pending = self._pending.pop(key)
+        previous = self._flushes.get(key)
+        self._flushes[key] = spawn(self._flush(key, pending, previous), "role_edit")
+
+    async def _flush(self, key: Tuple[int, int], pending: _PendingEdit,
+                     previous: Optional[asyncio.Task]) -> Optional[discord.Member]:
+        """Apply pending, returns the member as it is afterwards when known"""
+        try:
+            # The gateway may not have told about the previous edit yet, its answer is fresher
+            member = await previous if previous is not None else None
+            if member is None:
+                member = await self.members.get(pending.member.guild, pending.member.id, self.max_age)
+            # Member.roles starts with @everyone, which is not sent, like the role edits of discord.py
+            current = {role.id for role in member.roles[1:]}
+            target = (current - pending.remove) | pending.add
+            if target == current:
+                self.skipped += 1
+                pending.future.set_result(False)
+                return member
+            self.rest_calls += 1
+            edited = await member.edit(roles=[discord.Object(id=role_id) for role_id in target],
+                                       reason=pending.reason)
+        except Exception as e:
+            pending.future.set_exception(e)
+            # Retrieved here in case every caller was cancelled
+            pending.future.exception()
+            return None
+        finally:
+            if self._flushes.get(key) is asyncio.current_task():
+                del self._flushes[key]
+        if edited is not None:
+            self.members.put(edited)
+            for listener in self.listeners:
+                listener(edited)
+        pending.future.set_result(True)
+        return edited
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The bot modules, and the fake Discord API of the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
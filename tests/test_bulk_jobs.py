@@ -0,0 +1,70 @@
+"""Bulk files parsing and the jobs a process owns"""
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from bulk_jobs import BulkFileError, BulkJob, JobQueue, parse_import, parse_member_ids
+
+
+def test_csv_import():
+    data = "clan,member_id,rank\nRouge,1,chief\nRouge,2,\nBleu,,\n Vert ,3,MEMBER\n".encode("utf-8")
+    assert parse_import("clans.csv", data) == [
+        ["create", "Rouge"], ["create", "Bleu"], ["create", "Vert"],
+        ["assign", "Rouge", 1, "chief"], ["assign", "Rouge", 2, "member"], ["assign", "Vert", 3, "member"]]
+
+
+def test_json_import_reads_the_export_format():
+    export = {"clans": [{"name": "Rouge", "chiefs": ["1"], "members": [2, 3]}, {"name": "Bleu"}], "partial": True}
+    assert parse_import("clans.JSON", json.dumps(export).encode("utf-8")) == [
+        ["create", "Rouge"], ["create", "Bleu"],
+        ["assign", "Rouge", 1, "chief"], ["assign", "Rouge", 2, "member"], ["assign", "Rouge", 3, "member"]]
+
+
+@pytest.mark.parametrize("filename, data, key", [
+    ("clans.csv", b"clan,member_id,rank\nRouge,abc,member\n", "bulk.invalid_member_id"),
+    ("clans.csv", b"clan,member_id,rank\nRouge,1,admin\n", "bulk.invalid_rank"),
+    ("clans.csv", b"name,id\nRouge,1\n", "bulk.csv_columns"),
+    ("clans.json", b'{"clans": [{"members": [1]}]}', "bulk.invalid_json"),
+    ("clans.json", b'{"clans": [{"name": "Rouge", "members": ["x"]}]}', "bulk.invalid_member_id"),
+    ("clans.txt", b"Rouge", "bulk.file_type"),
+    ("clans.csv", "clan\nRouge\n".encode("utf-16"), "bulk.not_utf8"),
+])
+def test_invalid_imports(filename, data, key):
+    with pytest.raises(BulkFileError) as error:
+        parse_import(filename, data)
+    assert error.value.key == key
+
+
+def test_member_ids():
+    assert parse_member_ids(b"\xef\xbb\xbf1\n 2 ,Pseudo\n\nid\n3") == [1, 2, 3]
+    with pytest.raises(BulkFileError) as error:
+        parse_member_ids("1\n2".encode("utf-16"))
+    assert error.value.key == "bulk.not_utf8"
+
+
+def test_errors_survive_a_save():
+    job = BulkJob.new(1, "admin", "assign", [["assign", "Rouge", 1, "member"]])
+    job.add_error("bulk.step_clan_missing", step="assign Rouge 1 member")
+    saved = BulkJob.from_dict(json.loads(json.dumps(job.to_dict())))
+    assert saved.errors == [["bulk.step_clan_missing", {"step": "assign Rouge 1 member"}]]
+
+
+def test_jobs_of_the_guilds_on_other_shards_are_left_alone(tmp_path):
+    # Shard of a guild: (guild_id >> 22) % shard_count
+    guilds = {shard: ((1000 * 4 + shard) << 22) + 7 for shard in range(4)}
+    for shard, guild_id in guilds.items():
+        job = BulkJob("job" + str(shard), guild_id, "admin", "assign", [["create", "Rouge"]])
+        (tmp_path / (job.id + ".json")).write_text(json.dumps(job.to_dict()), encoding="utf-8")
+
+    async def main():
+        client = SimpleNamespace(shard_ids=[1, 3], shard_count=4, wait_until_ready=asyncio.Event().wait)
+        queue = JobQueue(client, directory=str(tmp_path))
+        queue.start()
+        queue._worker.cancel()
+        return queue
+
+    queue = asyncio.run(main())
+    assert sorted(queue.jobs) == ["job1", "job3"]
+    assert JobQueue(SimpleNamespace(shard_ids=None))._owns(guilds[0])
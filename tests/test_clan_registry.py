@@ -0,0 +1,76 @@
+"""Clan index built from role names, with the duplicates a guild can hold"""
+from types import SimpleNamespace
+
+from clan_registry import ClanRegistry
+
+
+def role(role_id: int, name: str):
+    return SimpleNamespace(id=role_id, name=name)
+
+
+def registry_of(*roles) -> ClanRegistry:
+    registry = ClanRegistry()
+    registry.build(roles)
+    return registry
+
+
+def test_roles_outside_the_prefixes_are_ignored():
+    registry = registry_of(role(1, "Membre Rouge"), role(2, "Modérateur"), role(3, "Chef Rouge"))
+    assert len(registry) == 1
+    assert registry.member_role("Rouge").id == 1
+    assert registry.chief_role("Rouge").id == 3
+    assert registry.clan_of(2) is None
+
+
+def test_duplicate_roles_are_all_tracked():
+    first, second = role(1, "Membre Rouge"), role(2, "Membre Rouge")
+    registry = registry_of(first, second, role(3, "Chef Rouge"))
+    assert registry.member_role("Rouge") is first
+    assert [other.id for other in registry.get("Rouge").roles()] == [1, 2, 3]
+    registry.remove_role(first)
+    # The clan stays, served by the other member role
+    assert registry.member_role("Rouge") is second
+    assert "Rouge" in registry
+
+
+def test_clan_goes_with_its_last_role():
+    member, chief = role(1, "Membre Rouge"), role(2, "Chef Rouge")
+    registry = registry_of(member, chief)
+    registry.remove_role(member)
+    assert "Rouge" not in registry
+    assert registry.search() == ["Rouge"]
+    registry.remove_role(chief)
+    assert registry.get("Rouge") is None
+    assert registry.search() == []
+
+
+def test_renamed_role_moves_to_its_new_clan():
+    registry = registry_of(role(1, "Membre Rouge"))
+    registry.update_role(role(1, "Membre Rouge"), role(1, "Membre Bleu"))
+    assert registry.search() == ["Bleu"]
+    assert registry.clan_of(1) == "Bleu"
+
+
+def test_search_is_sorted_and_case_insensitive():
+    registry = registry_of(*(role(i, "Membre " + name) for i, name in enumerate(["rouge", "Bleu", "Roux", "Vert"])))
+    assert registry.search() == ["Bleu", "rouge", "Roux", "Vert"]
+    assert registry.search("ro") == ["rouge", "Roux"]
+    assert registry.search("RO", offset=1) == ["Roux"]
+    assert registry.search("r", limit=1) == ["rouge"]
+    assert registry.count("ro") == 2
+    assert registry.search("z") == []
+
+
+def test_ranks_of_prefers_chief_with_duplicates():
+    registry = registry_of(role(1, "Membre Rouge"), role(2, "Chef Rouge"), role(3, "Chef Rouge"),
+                           role(4, "Membre Bleu"))
+    # Holding the duplicate chief role only still makes a chief
+    assert registry.ranks_of([role(1, "Membre Rouge"), role(3, "Chef Rouge")]) == {"Rouge": "chief"}
+    assert registry.ranks_of([role(4, "Membre Bleu"), role(9, "Autre")]) == {"Bleu": "member"}
+
+
+def test_other_prefixes():
+    registry = ClanRegistry("Member ", "Leader ")
+    registry.build([role(1, "Member Red"), role(2, "Membre Rouge"), role(3, "Leader Red")])
+    assert registry.search() == ["Red"]
+    assert registry.ranks_of([role(3, "Leader Red")]) == {"Red": "chief"}
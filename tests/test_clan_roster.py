@@ -0,0 +1,48 @@
+"""Incremental clan counts and ranking"""
+from clan_roster import ClanRoster
+
+
+def test_counts_follow_the_membership_changes():
+    roster = ClanRoster()
+    roster.add_clan("Rouge")
+    roster.set_member(1, {"Rouge": "member"})
+    roster.set_member(2, {"Rouge": "chief"})
+    assert roster.counts("Rouge") == (1, 1)
+    version = roster.version("Rouge")
+    roster.set_member(1, {"Rouge": "chief"})
+    assert roster.counts("Rouge") == (0, 2)
+    assert roster.version("Rouge") > version
+    roster.remove_member(2)
+    assert roster.counts("Rouge") == (0, 1)
+    assert roster.counts("Inconnu") == (0, 0)
+
+
+def test_unchanged_member_keeps_the_version():
+    roster = ClanRoster()
+    roster.set_member(1, {"Rouge": "member"})
+    version = roster.version("Rouge")
+    roster.set_member(1, {"Rouge": "member"})
+    assert roster.version("Rouge") == version
+
+
+def test_ranked_by_size_then_name():
+    roster = ClanRoster()
+    for name in ("Vert", "bleu", "Rouge"):
+        roster.add_clan(name)
+    roster.set_member(1, {"Vert": "member", "Rouge": "member"})
+    roster.set_member(2, {"Vert": "chief"})
+    assert roster.ranked() == ["Vert", "Rouge", "bleu"]
+    assert roster.ranked(1, 1) == ["Rouge"]
+    roster.remove_clan("Vert")
+    assert roster.ranked() == ["Rouge", "bleu"]
+
+
+def test_seed_keeps_the_members_set_before():
+    roster = ClanRoster()
+    # Changed by an event while the guild was being reconciled, fresher than the store
+    roster.set_member(1, {"Bleu": "member"})
+    roster.seed(["Rouge", "Bleu"], [(1, "Rouge", "member"), (2, "Rouge", "chief"), (3, "Supprimé", "member")])
+    assert roster.seeded
+    assert roster.counts("Rouge") == (0, 1)
+    assert roster.counts("Bleu") == (1, 0)
+    assert "Supprimé" not in roster
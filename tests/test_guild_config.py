@@ -0,0 +1,43 @@
+"""Per-guild clan settings read from guilds.json"""
+import json
+
+import pytest
+
+from clan_registry import CHIEF_PREFIX, MEMBER_PREFIX
+from guild_config import GuildConfigs
+
+
+def load(tmp_path, data) -> GuildConfigs:
+    path = tmp_path / "guilds.json"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return GuildConfigs.load(str(path))
+
+
+def test_missing_file_gives_the_defaults(tmp_path):
+    configs = GuildConfigs.load(str(tmp_path / "missing.json"))
+    assert configs.get(1).member_prefix == MEMBER_PREFIX
+    assert configs.get(1).chief_prefix == CHIEF_PREFIX
+    assert len(configs) == 0
+
+
+def test_guild_entries_override_the_default_key_by_key(tmp_path):
+    configs = load(tmp_path, {"default": {"member_prefix": "Member ", "manager_roles": [5]},
+                              "123": {"chief_prefix": "Leader "}})
+    assert (configs.get(123).member_prefix, configs.get(123).chief_prefix) == ("Member ", "Leader ")
+    assert configs.get(123).manager_roles == frozenset({5})
+    assert (configs.get(456).member_prefix, configs.get(456).chief_prefix) == ("Member ", CHIEF_PREFIX)
+
+
+@pytest.mark.parametrize("data, error", [
+    ({"default": {"member_prefix": "Clan ", "chief_prefix": "Clan Chef "}}, "starting with the other"),
+    ({"123": {"member_prefix": "Chef Membre "}}, "starting with the other"),
+    ({"123": {"chief_prefix": MEMBER_PREFIX}}, "starting with the other"),
+    ({"123": {"member_prefix": ""}}, "non empty string"),
+    ({"123": {"manager_roles": ["admin"]}}, "list of role IDs"),
+    ({"123": {"prefix": "Clan "}}, "unknown keys prefix"),
+    ({"serveur": {}}, "not a guild ID"),
+    ([], "must be an object"),
+])
+def test_invalid_configs_are_refused(tmp_path, data, error):
+    with pytest.raises(ValueError, match=error):
+        load(tmp_path, data)
@@ -0,0 +1,81 @@
+"""Invitation dedupe, cooldowns, closed DMs and batching, without Discord"""
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from invitations import LEADER_LIMIT, InvitationManager, InviteRefused
+
+GUILD = SimpleNamespace(id=1)
+LEADER = SimpleNamespace(id=10, guild=GUILD)
+
+
+def member(user_id: int):
+    return SimpleNamespace(id=user_id, guild=GUILD)
+
+
+class Outbox:
+    """send callable of the manager, recording the DMs and failing for the closed ones"""
+
+    def __init__(self, closed=()):
+        self.sent = []
+        self.closed = set(closed)
+
+    async def __call__(self, target, invites):
+        if target.id in self.closed:
+            raise discord.Forbidden(SimpleNamespace(status=403, reason="Forbidden"), "Cannot send messages")
+        self.sent.append((target.id, [clan for clan, _, _ in invites]))
+
+
+def refusal(manager: InvitationManager, target, clan: str) -> str:
+    with pytest.raises(InviteRefused) as refused:
+        asyncio.run(manager.invite(LEADER, target, clan, None))
+    return refused.value.reason
+
+
+def test_pending_invitation_is_not_sent_twice():
+    outbox = Outbox()
+    manager = InvitationManager(outbox, ttl=60)
+    asyncio.run(manager.invite(LEADER, member(1), "Rouge", None))
+    assert refusal(manager, member(1), "Rouge") == "pending"
+    # Another clan, or the same once the first one was answered, is sent
+    asyncio.run(manager.invite(LEADER, member(1), "Bleu", None))
+    manager.resolve(GUILD.id, "Rouge", 1)
+    asyncio.run(manager.invite(LEADER, member(1), "Rouge", None))
+    assert outbox.sent == [(1, ["Rouge"]), (1, ["Bleu"]), (1, ["Rouge"])]
+
+
+def test_leader_cooldown_after_a_burst():
+    manager = InvitationManager(Outbox(), ttl=60)
+    burst = LEADER_LIMIT[1]
+    for user_id in range(burst):
+        asyncio.run(manager.invite(LEADER, member(100 + user_id), "Rouge", None))
+    with pytest.raises(InviteRefused) as refused:
+        asyncio.run(manager.invite(LEADER, member(200), "Rouge", None))
+    assert refused.value.reason == "leader_cooldown"
+    assert 0 < refused.value.retry_after <= 1 / LEADER_LIMIT[0]
+
+
+def test_closed_dms_are_not_tried_again():
+    outbox = Outbox(closed={1})
+    manager = InvitationManager(outbox, ttl=60)
+    with pytest.raises(discord.Forbidden):
+        asyncio.run(manager.invite(LEADER, member(1), "Rouge", None))
+    assert not manager.is_pending(GUILD.id, "Rouge", 1)
+    outbox.closed.clear()
+    assert refusal(manager, member(1), "Bleu") == "closed_dms"
+    assert outbox.sent == []
+
+
+def test_invitations_within_the_window_share_one_message():
+    outbox = Outbox()
+    manager = InvitationManager(outbox, ttl=60, batch_window=0.01)
+
+    async def main():
+        await asyncio.gather(manager.invite(LEADER, member(1), "Rouge", None),
+                             manager.invite(LEADER, member(1), "Bleu", None),
+                             manager.invite(LEADER, member(2), "Rouge", None))
+
+    asyncio.run(main())
+    assert sorted(outbox.sent) == [(1, ["Rouge", "Bleu"]), (2, ["Rouge"])]
@@ -0,0 +1,61 @@
+"""Keyed asyncio locks, serializing operations on the same clan"""
+import asyncio
+
+from locks import KeyedLocks, clan_key
+
+
+def test_same_key_is_serialized_other_keys_are_not():
+    async def main():
+        locks = KeyedLocks()
+        running = []
+
+        async def operation(name: str):
+            async with locks.hold("test", clan_key(1, name)):
+                running.append(name)
+                await asyncio.sleep(0.01)
+                # Nobody else entered the same clan meanwhile
+                assert running.count(name) == 1
+                running.remove(name)
+
+        await asyncio.gather(operation("Rouge"), operation("Rouge"), operation("Bleu"))
+        assert locks.contended == 1
+        assert len(locks) == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_drops_its_lock():
+    async def main():
+        locks = KeyedLocks()
+        holding = asyncio.Event()
+        release = asyncio.Event()
+
+        async def holder():
+            async with locks.hold("test", clan_key(1, "Rouge")):
+                holding.set()
+                await release.wait()
+
+        async def waiter():
+            # Takes Bleu, then waits for Rouge
+            async with locks.hold("test", clan_key(1, "Rouge"), clan_key(1, "Bleu")):
+                pass
+
+        first = asyncio.ensure_future(holder())
+        await holding.wait()
+        second = asyncio.ensure_future(waiter())
+        await asyncio.sleep(0.01)
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        # Bleu is free again, Rouge still held
+        assert len(locks) == 1
+
+        async def take_bleu():
+            async with locks.hold("test", clan_key(1, "Bleu")):
+                pass
+
+        await asyncio.wait_for(take_bleu(), 1)
+        release.set()
+        await first
+        assert len(locks) == 0
+
+    asyncio.run(main())
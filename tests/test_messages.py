@@ -0,0 +1,49 @@
+"""Locale catalogs: fallback to the default locale and the checks made when loading"""
+import json
+import os
+
+import discord
+import pytest
+
+from messages import LOCALES_DIR, Catalog, catalog
+
+
+def write_catalogs(directory, **locales):
+    for name, messages in locales.items():
+        (directory / (name + ".json")).write_text(json.dumps({"messages": messages}), encoding="utf-8")
+
+
+def test_missing_keys_and_locales_fall_back_to_the_default(tmp_path):
+    write_catalogs(tmp_path, fr={"hello": "Bonjour {name}", "bye": "Au revoir"}, en={"hello": "Hello {name}"})
+    loaded = Catalog.load(str(tmp_path))
+    assert loaded.get(discord.Locale.american_english).text("hello", name="Ana") == "Hello Ana"
+    assert loaded.get(discord.Locale.british_english).text("bye") == "Au revoir"
+    assert loaded.get(discord.Locale.german) is loaded.default
+    assert loaded.get("xx") is loaded.default
+
+
+def test_unknown_keys_are_refused(tmp_path):
+    write_catalogs(tmp_path, fr={"hello": "Bonjour"}, en={"helo": "Hello"})
+    with pytest.raises(ValueError, match="unknown message helo"):
+        Catalog.load(str(tmp_path))
+
+
+def test_placeholders_the_bot_does_not_provide_are_refused(tmp_path):
+    write_catalogs(tmp_path, fr={"hello": "Bonjour {name}"}, en={"hello": "Hello {user}"})
+    with pytest.raises(ValueError, match="user"):
+        Catalog.load(str(tmp_path))
+
+
+def test_embeds_without_placeholders_are_shared():
+    messages = catalog.default
+    first = messages.embed("clans.title", "clans.empty")
+    assert messages.embed("clans.title", "clans.empty") is first
+    with pytest.raises(TypeError):
+        first.add_field(name="a", value="b")
+    assert messages.embed("clan_info.title", clan="Rouge") is not messages.embed("clan_info.title", clan="Rouge")
+
+
+def test_english_translates_every_message():
+    with open(os.path.join(LOCALES_DIR, "en.json"), encoding="utf-8") as file:
+        english = json.load(file)["messages"]
+    assert set(english) == set(catalog.default.templates)
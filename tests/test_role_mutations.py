@@ -0,0 +1,153 @@
+"""REST calls of the RoleMutator, counted by the fake Discord API of the benchmarks"""
+import asyncio
+
+import discord
+
+from fake_discord import FakeDiscord
+from locks import KeyedLocks, clan_key
+from member_cache import MemberCache
+from role_mutations import RoleMutator
+
+MEMBER_EDIT = "PATCH /guilds/{id}/members/{id}"
+MEMBER_FETCH = "GET /guilds/{id}/members/{id}"
+
+
+class Setup:
+    """Lean client connected to a fake guild of a few clans"""
+
+    def __init__(self, fake: FakeDiscord, client: discord.Client):
+        self.fake = fake
+        self.client = client
+        self.fake_guild = next(iter(fake.guilds.values()))
+        self.guild = client.get_guild(self.fake_guild.id)
+        self.mutator = RoleMutator(MemberCache())
+
+    def clan(self, name: str):
+        """(chief id, member ids, member role, chief role) of a clan"""
+        chief, members = self.fake_guild.clans[name]
+        roles = {role.name: role for role in self.guild.roles}
+        return chief, members, roles["Membre " + name], roles["Chef " + name]
+
+    async def member(self, user_id: int) -> discord.Member:
+        return await self.guild.fetch_member(user_id)
+
+    def roles_of(self, user_id: int):
+        return set(self.fake_guild.members[user_id])
+
+
+def run(test, latency: float = 0.0):
+    """Run test(setup) against a fresh fake API, then disconnect"""
+    async def main():
+        fake = FakeDiscord(latency=latency)
+        fake.generate_guild(members=200, clans=3, clan_share=1.0, admins=1)
+        await fake.start()
+        intents = discord.Intents.none()
+        intents.guilds = True
+        client = discord.Client(intents=intents, member_cache_flags=discord.MemberCacheFlags.none())
+        try:
+            await fake.connect(client)
+            await test(Setup(fake, client))
+        finally:
+            await client.close()
+            await fake.close()
+
+    asyncio.run(main())
+
+
+def test_no_op_sends_nothing():
+    async def test(setup: Setup):
+        _, members, member_role, _ = setup.clan("Clan00000")
+        member = await setup.member(members[0])
+        setup.fake.reset_stats()
+        assert await setup.mutator.apply(member, add=[member_role]) is False
+        assert await setup.mutator.apply(member, remove=[None]) is False
+        assert setup.fake.requests[MEMBER_EDIT] == 0
+        assert setup.mutator.skipped == 2
+    run(test)
+
+
+def test_promotion_is_one_edit():
+    async def test(setup: Setup):
+        _, members, member_role, chief_role = setup.clan("Clan00000")
+        member = await setup.member(members[0])
+        setup.fake.reset_stats()
+        assert await setup.mutator.apply(member, add=[chief_role], remove=[member_role]) is True
+        assert setup.fake.requests[MEMBER_EDIT] == 1
+        assert setup.roles_of(member.id) == {chief_role.id}
+    run(test)
+
+
+def test_concurrent_changes_are_one_edit():
+    async def test(setup: Setup):
+        _, members, member_role, _ = setup.clan("Clan00000")
+        _, _, other_role, _ = setup.clan("Clan00001")
+        _, _, third_role, _ = setup.clan("Clan00002")
+        member = await setup.member(members[0])
+        setup.fake.reset_stats()
+        await asyncio.gather(setup.mutator.apply(member, remove=[member_role]),
+                             setup.mutator.apply(member, add=[other_role]),
+                             setup.mutator.apply(member, add=[third_role]))
+        assert setup.fake.requests[MEMBER_EDIT] == 1
+        assert setup.roles_of(member.id) == {other_role.id, third_role.id}
+    run(test)
+
+
+def test_changes_under_different_clan_locks_are_one_edit():
+    async def test(setup: Setup):
+        _, members, member_role, _ = setup.clan("Clan00000")
+        _, _, other_role, _ = setup.clan("Clan00001")
+        member = await setup.member(members[0])
+        locks = KeyedLocks()
+        setup.fake.reset_stats()
+
+        async def change(name: str, **roles):
+            # Like leaving one clan while accepting the invitation of another
+            async with locks.hold("change", clan_key(setup.guild.id, name)):
+                await setup.mutator.apply(member, **roles)
+
+        await asyncio.gather(change("Clan00000", remove=[member_role]), change("Clan00001", add=[other_role]))
+        assert setup.fake.requests[MEMBER_EDIT] == 1
+        assert setup.roles_of(member.id) == {other_role.id}
+    run(test)
+
+
+def test_everyone_is_not_sent():
+    async def test(setup: Setup):
+        _, members, _, chief_role = setup.clan("Clan00000")
+        member = await setup.member(members[0])
+        await setup.mutator.apply(member, add=[chief_role])
+        assert setup.guild.id not in setup.roles_of(member.id)
+    run(test)
+
+
+def test_roles_granted_since_the_snapshot_are_kept():
+    async def test(setup: Setup):
+        _, members, member_role, chief_role = setup.clan("Clan00000")
+        _, _, other_role, _ = setup.clan("Clan00001")
+        snapshot = await setup.member(members[0])
+        # Granted by someone else once the caller got its member
+        setup.fake_guild.members[snapshot.id].append(other_role.id)
+        await setup.mutator.apply(snapshot, add=[chief_role], remove=[member_role])
+        assert setup.roles_of(snapshot.id) == {chief_role.id, other_role.id}
+    run(test)
+
+
+def test_successive_edits_build_on_each_other():
+    async def test(setup: Setup):
+        _, members, member_role, chief_role = setup.clan("Clan00000")
+        _, _, other_role, _ = setup.clan("Clan00001")
+        member = await setup.member(members[0])
+        setup.fake.reset_stats()
+
+        async def later():
+            # Queued while the first edit is in flight, too late to be merged with it
+            await asyncio.sleep(setup.mutator.window * 1.5)
+            await setup.mutator.apply(member, add=[other_role])
+
+        await asyncio.gather(setup.mutator.apply(member, add=[chief_role], remove=[member_role]), later())
+        assert setup.fake.requests[MEMBER_EDIT] == 2
+        # The second edit waited for the first one and started from its answer, not from a fetch
+        assert setup.fake.requests[MEMBER_FETCH] == 1
+        assert setup.roles_of(member.id) == {chief_role.id, other_role.id}
+    # Slow enough for the second edit to start while the first one is in flight
+    run(test, latency=0.05)